@@ -128,6 +128,23 @@ async def share_required_login(
     return True
 
 
+async def metrics_required(authorization: str = Header(default=None)):
+    """
+    验证指标接口权限
+
+    接受管理员 token，或与配置项 metrics_token 一致的固定 token（便于 Prometheus 抓取）
+    """
+    token = authorization.split(" ")[-1] if authorization else ""
+    if settings.metrics_token and hmac.compare_digest(token.encode(), settings.metrics_token.encode()):
+        return True
+    try:
+        if verify_token(token).get("is_admin", False):
+            return True
+    except ValueError:
+        pass
+    raise HTTPException(status_code=401, detail="未授权或授权校验失败")
+
+
 async def get_file_service():
     return FileService()
 
@@ -28,3 +28,12 @@ class UpdateFileData(BaseModel):
     suffix: Optional[str] = None
     expired_at: Optional[datetime.datetime] = None
     expired_count: Optional[int] = None
+
+
+class StorageMigrationData(BaseModel):
+    source: str
+    target: str
+    concurrency: Optional[int] = None
+    bandwidth: Optional[int] = None
+    delete_source: bool = False
+    restart: bool = False
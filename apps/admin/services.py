@@ -1,28 +1,30 @@
 import os
 import time
 
+from tortoise.transactions import in_transaction
+
 from core.response import APIResponse
-from core.storage import FileStorageInterface, storages
+from core.storage import get_file_storage, select_storage, storages
 from core.settings import settings
 from apps.base.models import FileCodes, KeyValue
-from apps.base.utils import get_expire_info, get_file_path_name
+from apps.base.utils import get_expire_info, get_file_path_name, create_file_code, code_pool
 from fastapi import HTTPException
 from core.settings import data_root
 
 
 class FileService:
-    def __init__(self):
-        self.file_storage: FileStorageInterface = storages[settings.file_storage]()
-
     async def delete_file(self, file_id: int):
         file_code = await FileCodes.get(id=file_id)
-        await self.file_storage.delete_file(file_code)
+        if not file_code.is_text:
+            await get_file_storage(file_code.storage).delete_file(file_code)
         await file_code.delete()
+        code_pool.release(file_code.code)
 
     async def list_files(self, page: int, size: int, keyword: str = ""):
         offset = (page - 1) * size
+        # 直接返回字段字典，列表页不需要模型对象
         files = (
-            await FileCodes.filter(prefix__icontains=keyword).limit(size).offset(offset)
+            await FileCodes.filter(prefix__icontains=keyword).limit(size).offset(offset).values()
         )
         total = await FileCodes.filter(prefix__icontains=keyword).count()
         return files, total
@@ -31,10 +33,10 @@ class FileService:
         file_code = await FileCodes.filter(id=file_id).first()
         if not file_code:
             raise HTTPException(status_code=404, detail="文件不存在")
-        if file_code.text:
-            return APIResponse(detail=file_code.text)
+        if file_code.is_text:
+            return APIResponse(detail=await file_code.get_text())
         else:
-            return await self.file_storage.get_file_response(file_code)
+            return await get_file_storage(file_code.storage).get_file_response(file_code)
 
     async def share_local_file(self, item):
         local_file = LocalFileClass(item.filename)
@@ -47,9 +49,10 @@ class FileService:
         )
         path, suffix, prefix, uuid_file_name, save_path = await get_file_path_name(item)
 
-        await self.file_storage.save_file(text, save_path)
+        storage_name = select_storage(local_file.size, expired_at)
+        await get_file_storage(storage_name).save_file(text, save_path)
 
-        await FileCodes.create(
+        file_code = await create_file_code(
             code=code,
             prefix=prefix,
             suffix=suffix,
@@ -59,10 +62,11 @@ class FileService:
             expired_at=expired_at,
             expired_count=expired_count,
             used_count=used_count,
+            storage=storage_name,
         )
 
         return {
-            "code": code,
+            "code": file_code.code,
             "name": local_file.file,
         }
 
@@ -79,27 +83,29 @@ class ConfigService:
         for key, value in data.items():
             if key not in settings.default_config:
                 continue
-            if key in [
-                "errorCount",
-                "errorMinute",
-                "max_save_seconds",
-                "onedrive_proxy",
-                "openUpload",
-                "port",
-                "s3_proxy",
-                "uploadCount",
-                "uploadMinute",
-                "uploadSize",
-            ]:
-                data[key] = int(value)
-            elif key in ["opacity"]:
-                data[key] = float(value)
+            default = settings.default_config[key]
+            # 数值配置按默认值的类型转换，表单提交的值可能是字符串
+            if isinstance(default, (int, float)) and not isinstance(default, bool):
+                try:
+                    data[key] = type(default)(value)
+                except (TypeError, ValueError):
+                    raise HTTPException(status_code=400, detail=f"配置项 {key} 格式错误")
+            elif key == "storage_policy":
+                if not isinstance(value, list) or any(
+                        not isinstance(rule, dict) or rule.get("storage") not in storages for rule in value
+                ):
+                    raise HTTPException(status_code=400, detail="存储规则格式错误")
+                data[key] = value
             else:
                 data[key] = value
 
-        await KeyValue.filter(key="settings").update(value=data)
-        for k, v in data.items():
-            settings.__setattr__(k, v)
+        # 保存配置并递增版本号，其他进程通过版本号发现配置变化
+        async with in_transaction():
+            await KeyValue.filter(key="settings").update(value=data)
+            version = await KeyValue.filter(key="settings_version").select_for_update().first()
+            version.value = (version.value or 0) + 1
+            await version.save(update_fields=["value"])
+        settings.load(data, version.value)
 
 
 class LocalFileService:
@@ -0,0 +1,220 @@
+import asyncio
+import datetime
+import hashlib
+import tempfile
+import time
+from typing import List, Optional
+
+from fastapi import HTTPException, UploadFile
+from starlette.datastructures import Headers
+from tortoise.expressions import Q
+from tortoise.queryset import QuerySet
+
+from apps.base.models import FileCodes, KeyValue
+from core.logger import logger
+from core.metrics import storage_migration_bytes, storage_migration_files
+from core.settings import settings
+from core.storage import FileStorageInterface, get_file_storage, get_policy_storages, storage_registry, storages
+from core.throttle import TokenBucket
+from core.utils import get_now
+
+
+class StorageMigration:
+    """
+    把仍有效的文件从一个存储复制到另一个存储的后台任务
+
+    按 id 顺序分批处理，每批完成后把进度写入 KeyValue，中断后再次启动（或应用重启）时从检查点继续。
+    每个文件从源存储流式读入临时文件（小文件留在内存），限速后写入目标存储，读回校验哈希一致后
+    再在事务中有条件地更新记录的存储；迁移期间记录被删除或已被修改时删除目标存储中的副本。
+    """
+    key = "storage_migration"
+    # 临时文件超过该大小后写入磁盘
+    spool_size = 8 * 1024 * 1024
+    # 最多保留的错误信息条数
+    max_errors = 20
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.state: dict = {}
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    async def status(self) -> dict:
+        if not self.state:
+            checkpoint = await KeyValue.filter(key=self.key).first()
+            self.state = checkpoint.value if checkpoint else {}
+        return {**self.state, "running": self.running}
+
+    async def _save(self):
+        self.state["updated_at"] = int(time.time() * 1000)
+        await KeyValue.update_or_create(key=self.key, defaults={"value": self.state})
+
+    @staticmethod
+    def _live_files(state: dict, now: datetime.datetime) -> QuerySet:
+        """源存储中仍有效的文件记录"""
+        query = FileCodes.filter(
+            Q(expired_at__isnull=True) | Q(expired_at__gte=now),
+            ~Q(expired_count=0),
+            is_text=False,
+        )
+        if state["include_default"]:
+            # 没有记录存储名称的旧记录保存在迁移开始时的默认存储中
+            return query.filter(Q(storage=state["source"]) | Q(storage__isnull=True))
+        return query.filter(storage=state["source"])
+
+    async def start(self, source: str, target: str, concurrency: Optional[int] = None,
+                    bandwidth: Optional[int] = None, delete_source: bool = False, restart: bool = False) -> dict:
+        """
+        启动迁移，源和目标与上次未完成的迁移相同时从检查点继续
+        :param source: 源存储名称
+        :param target: 目标存储名称
+        :param concurrency: 同时迁移的文件数，默认 storage_migration_concurrency
+        :param bandwidth: 读取源存储的带宽上限（字节/秒），默认 storage_migration_bandwidth
+        :param delete_source: 迁移成功后是否删除源存储中的文件
+        :param restart: 忽略检查点，重新扫描源存储中的全部文件（用于重试失败的文件）
+        """
+        if self.running:
+            raise HTTPException(status_code=400, detail="已有迁移任务正在运行")
+        if source not in storages or target not in storages or source == target:
+            raise HTTPException(status_code=400, detail="源存储或目标存储错误")
+        state = await self.status()
+        state.pop("running", None)
+        if restart or state.get("source") != source or state.get("target") != target \
+                or state.get("status") == "done":
+            state = {
+                "source": source,
+                "target": target,
+                "include_default": source == settings.file_storage,
+                "last_id": 0,
+                "migrated": 0,
+                "skipped": 0,
+                "failed": 0,
+                "bytes": 0,
+                "errors": [],
+                "started_at": int(time.time() * 1000),
+            }
+            state["total"] = await self._live_files(state, await get_now()).count()
+        state.update(
+            status="running",
+            concurrency=max(concurrency or settings.storage_migration_concurrency, 1),
+            bandwidth=settings.storage_migration_bandwidth if bandwidth is None else bandwidth,
+            delete_source=delete_source,
+        )
+        self.state = state
+        await self._save()
+        self.task = asyncio.create_task(self._run())
+        return await self.status()
+
+    async def resume(self):
+        """应用启动时继续上次被中断的迁移"""
+        state = await self.status()
+        if state.get("status") == "running" and not self.running:
+            logger.info(f"继续迁移存储 {state['source']} -> {state['target']}")
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """暂停迁移，之后可以从检查点继续"""
+        await self.shutdown()
+        if self.state.get("status") == "running":
+            self.state["status"] = "paused"
+            await self._save()
+
+    async def shutdown(self):
+        """应用关闭时取消任务，保留 running 状态以便重启后继续"""
+        if self.running:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def _run(self):
+        state = self.state
+        source = get_file_storage(state["source"])
+        target = get_file_storage(state["target"])
+        bucket = TokenBucket(state["bandwidth"])
+        semaphore = asyncio.Semaphore(state["concurrency"])
+        batch_size = state["concurrency"] * 4
+
+        async def migrate(row: FileCodes):
+            async with semaphore:
+                try:
+                    result = await self._migrate_file(row, source, target, bucket)
+                except Exception as e:
+                    result = "failed"
+                    logger.error(f"迁移文件 {row.code} 失败: {e}")
+                    errors: List[dict] = state["errors"]
+                    errors.append({"id": row.id, "code": row.code, "error": str(e)[:200]})
+                    del errors[:-self.max_errors]
+                state[result] += 1
+                storage_migration_files.inc(result=result)
+
+        try:
+            while True:
+                rows = await self._live_files(state, await get_now()).filter(
+                    id__gt=state["last_id"]
+                ).order_by("id").limit(batch_size)
+                if not rows:
+                    break
+                await asyncio.gather(*(migrate(row) for row in rows))
+                state["last_id"] = rows[-1].id
+                await self._save()
+            state["status"] = "done"
+            await self._save()
+            logger.info(f"存储迁移完成 {state['source']} -> {state['target']}")
+        except Exception as e:
+            state["status"] = "failed"
+            state["errors"].append({"error": str(e)[:200]})
+            await self._save()
+            logger.error(f"存储迁移失败: {e}")
+            return
+        # 源存储不再接收新文件且没有文件留在其中时释放连接
+        if state["source"] not in get_policy_storages() \
+                and not await self._live_files(state, await get_now()).exists():
+            storage_registry.retire(state["source"])
+
+    async def _migrate_file(self, row: FileCodes, source: FileStorageInterface,
+                            target: FileStorageInterface, bucket: TokenBucket) -> str:
+        """
+        迁移单个文件
+        :return: migrated 或 skipped（迁移期间记录已被删除或修改）
+        """
+        sha256 = hashlib.sha256()
+        size = 0
+        with tempfile.SpooledTemporaryFile(max_size=self.spool_size) as spool:
+            async for chunk in source.iter_file(row):
+                await bucket.consume(len(chunk))
+                sha256.update(chunk)
+                size += len(chunk)
+                spool.write(chunk)
+            spool.seek(0)
+            upload = UploadFile(
+                file=spool,
+                size=size,
+                filename=row.uuid_file_name,
+                headers=Headers({"content-type": "application/octet-stream"}),
+            )
+            await target.save_file(upload, await row.get_file_path())
+        digest = sha256.hexdigest()
+
+        # 从目标存储读回校验
+        copied = hashlib.sha256()
+        async for chunk in target.iter_file(row):
+            copied.update(chunk)
+        if copied.hexdigest() != digest:
+            await target.delete_file(row)
+            raise ValueError("目标存储中的文件哈希不一致")
+
+        updated = await FileCodes.filter(id=row.id, storage=row.storage).update(
+            storage=self.state["target"], file_hash=row.file_hash or digest
+        )
+        if not updated:
+            await target.delete_file(row)
+            return "skipped"
+        storage_migration_bytes.inc(size)
+        self.state["bytes"] += size
+        if self.state["delete_source"]:
+            await source.delete_file(row)
+        return "migrated"
+
+
+storage_migration = StorageMigration()
@@ -12,10 +12,12 @@ from apps.admin.dependencies import (
     get_config_service,
     get_local_file_service,
 )
-from apps.admin.schemas import IDData, ShareItem, DeleteItem, LoginData, UpdateFileData
+from apps.admin.schemas import IDData, ShareItem, DeleteItem, LoginData, UpdateFileData, StorageMigrationData
+from apps.admin.storage_migration import storage_migration
 from core.response import APIResponse
 from apps.base.models import FileCodes, KeyValue
 from apps.admin.dependencies import create_token
+from apps.base.utils import code_pool
 from core.settings import settings
 
 admin_api = APIRouter(prefix="/admin", tags=["管理"])
@@ -34,8 +36,7 @@ async def login(data: LoginData):
 
 @admin_api.get("/dashboard")
 async def dashboard(admin: bool = Depends(admin_required)):
-    all_codes = await FileCodes.all()
-    all_size = str(sum([code.size for code in all_codes]))
+    total_count, total_size = await FileCodes.stats()
     sys_start = await KeyValue.filter(key="sys_start").first()
     # 获取当前日期时间
     now = datetime.datetime.now()
@@ -43,20 +44,21 @@ async def dashboard(admin: bool = Depends(admin_required)):
     yesterday_start = today_start - datetime.timedelta(days=1)
     yesterday_end = today_start - datetime.timedelta(microseconds=1)
     # 统计昨天一整天的记录数（从昨天0点到23:59:59）
-    yesterday_codes = FileCodes.filter(
+    yesterday_count, yesterday_size = await FileCodes.stats(
         created_at__gte=yesterday_start, created_at__lte=yesterday_end
     )
     # 统计今天到现在的记录数（从今天0点到现在）
-    today_codes = FileCodes.filter(created_at__gte=today_start)
+    today_count, today_size = await FileCodes.stats(created_at__gte=today_start)
     return APIResponse(
         detail={
-            "totalFiles": len(all_codes),
-            "storageUsed": all_size,
+            "totalFiles": total_count,
+            "storageUsed": str(total_size),
             "sysUptime": sys_start.value,
-            "yesterdayCount": await yesterday_codes.count(),
-            "yesterdaySize": str(sum([code.size for code in await yesterday_codes])),
-            "todayCount": await today_codes.count(),
-            "todaySize": str(sum([code.size for code in await today_codes])),
+            "yesterdayCount": yesterday_count,
+            "yesterdaySize": str(yesterday_size),
+            "todayCount": today_count,
+            "todaySize": str(today_size),
+            "codePool": code_pool.stats(),
         }
     )
 
@@ -156,6 +158,7 @@ async def update_file(
     file_code = await FileCodes.filter(id=data.id).first()
     if not file_code:
         raise HTTPException(status_code=404, detail="文件不存在")
+    old_code = file_code.code
     update_data = {}
 
     if data.code is not None and data.code != file_code.code:
@@ -173,4 +176,29 @@ async def update_file(
         update_data["expired_count"] = data.expired_count
 
     await file_code.update_from_dict(update_data).save()
+    if "code" in update_data:
+        code_pool.release(old_code)
+        code_pool.mark_used(update_data["code"])
     return APIResponse(detail="更新成功")
+
+
+@admin_api.post("/storage/migrate")
+async def start_storage_migration(
+        data: StorageMigrationData,
+        admin: bool = Depends(admin_required),
+):
+    status = await storage_migration.start(
+        data.source, data.target, data.concurrency, data.bandwidth, data.delete_source, data.restart
+    )
+    return APIResponse(detail=status)
+
+
+@admin_api.get("/storage/migrate")
+async def get_storage_migration(admin: bool = Depends(admin_required)):
+    return APIResponse(detail=await storage_migration.status())
+
+
+@admin_api.delete("/storage/migrate")
+async def stop_storage_migration(admin: bool = Depends(admin_required)):
+    await storage_migration.stop()
+    return APIResponse(detail=await storage_migration.status())
@@ -1,45 +1,101 @@
-from typing import Dict, Union
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from time import monotonic
 from fastapi import HTTPException, Request
 
+from core.metrics import rate_limit_rejections
+
+
+class IPRecord:
+    """
+    单个IP的滑动窗口计数记录
+    window: 当前窗口编号
+    prev: 上一窗口内的计数
+    curr: 当前窗口内的计数
+    last: 最近一次计数的时间
+    """
+    __slots__ = ("window", "prev", "curr", "last")
+
+    def __init__(self, window: int, now: float):
+        self.window = window
+        self.prev = 0
+        self.curr = 0
+        self.last = now
+
 
 class IPRateLimit:
-    def __init__(self, count: int, minutes: int):
-        self.ips: Dict[str, Dict[str, Union[int, datetime]]] = {}
+    """
+    基于滑动窗口计数的IP限流器
+
+    每个IP只保存一条定长记录（上一窗口计数 + 当前窗口计数），按最近访问顺序排列，
+    过期记录在访问时惰性淘汰，记录总数超过 max_ips 时淘汰最久未访问的IP。
+    不同路由使用各自的限流器实例（见 apps.base.utils.ip_limit），互不影响。
+    """
+
+    def __init__(self, count: int, minutes: int, max_ips: int = 100000, name: str = "default"):
+        self.name = name
+        self.ips: "OrderedDict[str, IPRecord]" = OrderedDict()
         self.count = count
         self.minutes = minutes
+        self.max_ips = max_ips
+
+    @property
+    def window_seconds(self) -> float:
+        return max(self.minutes, 1) * 60
+
+    def _estimate(self, record: IPRecord, now: float) -> float:
+        """滚动窗口并估算最近一个窗口时长内的请求数"""
+        size = self.window_seconds
+        window = int(now // size)
+        if window != record.window:
+            record.prev = record.curr if window == record.window + 1 else 0
+            record.curr = 0
+            record.window = window
+        return record.prev * (1 - (now % size) / size) + record.curr
+
+    def _is_expired(self, record: IPRecord, now: float) -> bool:
+        return record.last + 2 * self.window_seconds <= now
 
     def check_ip(self, ip: str) -> bool:
-        if ip in self.ips:
-            ip_info = self.ips[ip]
-            if ip_info["count"] >= self.count:
-                if ip_info["time"] + timedelta(minutes=self.minutes) > datetime.now():
-                    return False
-                self.ips.pop(ip)
-        return True
+        record = self.ips.get(ip)
+        if record is None:
+            return True
+        now = monotonic()
+        if self._is_expired(record, now):
+            del self.ips[ip]
+            return True
+        return self._estimate(record, now) < self.count
 
     def add_ip(self, ip: str) -> int:
-        ip_info = self.ips.get(ip, {"count": 0, "time": datetime.now()})
-        ip_info["count"] += 1
-        ip_info["time"] = datetime.now()
-        self.ips[ip] = ip_info
-        return ip_info["count"]
+        now = monotonic()
+        record = self.ips.get(ip)
+        if record is None:
+            record = IPRecord(int(now // self.window_seconds), now)
+            self.ips[ip] = record
+            if len(self.ips) > self.max_ips:
+                self.ips.popitem(last=False)
+        else:
+            self.ips.move_to_end(ip)
+        self._estimate(record, now)
+        record.curr += 1
+        record.last = now
+        return record.prev + record.curr
 
     async def remove_expired_ip(self) -> None:
-        now = datetime.now()
-        expiration = timedelta(minutes=self.minutes)
-        self.ips = {
-            ip: info
-            for ip, info in self.ips.items()
-            if info["time"] + expiration >= now
-        }
+        # 记录按最近计数时间排序，从头部淘汰直到遇到未过期的记录
+        now = monotonic()
+        while self.ips:
+            ip, record = next(iter(self.ips.items()))
+            if not self._is_expired(record, now):
+                break
+            del self.ips[ip]
 
     def __call__(self, request: Request) -> str:
         ip = (
             request.headers.get("X-Real-IP")
-            or request.headers.get("X-Forwarded-For")
+            or request.headers.get("X-Forwarded-For", "").split(",")[0].strip()
             or request.client.host
         )
         if not self.check_ip(ip):
+            rate_limit_rejections.inc(limiter=self.name)
             raise HTTPException(status_code=423, detail="请求次数过多，请稍后再试")
         return ip
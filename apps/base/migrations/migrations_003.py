@@ -0,0 +1,16 @@
+from tortoise import connections
+
+
+async def add_upload_chunk_storage_columns():
+    conn = connections.get("default")
+    await conn.execute_script(
+        """
+        ALTER TABLE "uploadchunk" ADD "storage_upload_id" VARCHAR(255);
+        ALTER TABLE "uploadchunk" ADD "etag" VARCHAR(255);
+        ALTER TABLE "uploadchunk" ADD "save_path" VARCHAR(512);
+    """
+    )
+
+
+async def migrate():
+    await add_upload_chunk_storage_columns()
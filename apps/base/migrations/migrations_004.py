@@ -0,0 +1,17 @@
+from tortoise import connections
+
+
+async def create_upload_chunk_indexes():
+    conn = connections.get("default")
+    await conn.execute_script(
+        """
+        CREATE INDEX IF NOT EXISTS idx_uploadchunk_upload_id
+            on uploadchunk (upload_id, chunk_index);
+        CREATE INDEX IF NOT EXISTS idx_uploadchunk_created_at
+            on uploadchunk (chunk_index, created_at);
+    """
+    )
+
+
+async def migrate():
+    await create_upload_chunk_indexes()
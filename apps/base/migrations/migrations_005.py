@@ -0,0 +1,15 @@
+from tortoise import connections
+
+
+async def add_storage_columns():
+    conn = connections.get("default")
+    await conn.execute_script(
+        """
+        ALTER TABLE "filecodes" ADD "storage" VARCHAR(32);
+        ALTER TABLE "uploadchunk" ADD "storage" VARCHAR(32);
+    """
+    )
+
+
+async def migrate():
+    await add_storage_columns()
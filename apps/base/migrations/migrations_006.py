@@ -0,0 +1,54 @@
+from tortoise import connections
+from tortoise.transactions import in_transaction
+
+from apps.base.models import FileCodes, FileText
+
+
+async def create_file_text_table():
+    conn = connections.get("default")
+    await conn.execute_script(
+        """
+        CREATE TABLE IF NOT EXISTS filetext
+        (
+            id          INTEGER                                not null
+                primary key autoincrement,
+            file_id     INT                                    not null
+                unique,
+            content     BLOB                                   not null,
+            compression VARCHAR(16)  default ''                not null,
+            created_at  TIMESTAMP    default CURRENT_TIMESTAMP not null
+        );
+        CREATE INDEX IF NOT EXISTS idx_filetext_file_id
+            on filetext (file_id);
+        ALTER TABLE "filecodes" ADD "is_text" BOOL default 0 not null;
+    """
+    )
+
+
+async def move_text_payloads(batch_size: int = 200):
+    """把已有文本分享的内容压缩后移入 filetext，filecodes 中只保留预览"""
+    last_id = 0
+    while True:
+        async with in_transaction() as conn:
+            _, rows = await conn.execute_query(
+                "SELECT id, text FROM filecodes WHERE text IS NOT NULL AND id > ? ORDER BY id LIMIT ?",
+                [last_id, batch_size],
+            )
+            for row in rows:
+                content, compression = FileText.pack(row["text"])
+                await conn.execute_query(
+                    "INSERT INTO filetext (file_id, content, compression) VALUES (?, ?, ?)",
+                    [row["id"], content, compression],
+                )
+                await conn.execute_query(
+                    "UPDATE filecodes SET text = ?, is_text = 1 WHERE id = ?",
+                    [row["text"][:FileCodes.text_preview_length], row["id"]],
+                )
+        if len(rows) < batch_size:
+            break
+        last_id = rows[-1]["id"]
+
+
+async def migrate():
+    await create_file_text_table()
+    await move_text_payloads()
@@ -2,17 +2,42 @@
 # @Author  : Lan
 # @File    : models.py
 # @Software: PyCharm
-from typing import Optional
+import zlib
+from typing import Dict, List, Optional, Tuple
 
+from tortoise.functions import Count, Sum
 from tortoise.models import Model
 from tortoise.contrib.pydantic import pydantic_model_creator
+from tortoise.queryset import QuerySet
 
 from tortoise import fields, models
 from datetime import datetime
 from core.utils import get_now
 
 
-class FileCodes(models.Model):
+class FileCodeMixin:
+    """FileCodes 与 FileCodeRecord 共用的方法"""
+    __slots__ = ()
+
+    async def is_expired(self):
+        if self.expired_at is None:
+            return False
+        if self.expired_at and self.expired_count < 0:
+            return self.expired_at < await get_now()
+        return self.expired_count <= 0
+
+    async def get_file_path(self):
+        return f"{self.file_path}/{self.uuid_file_name}"
+
+    async def get_text(self) -> Optional[str]:
+        """读取文本分享的完整内容，不是文本分享时返回 None"""
+        if not self.is_text:
+            return None
+        file_text = await FileText.filter(file_id=self.id).first()
+        return file_text.unpack() if file_text else None
+
+
+class FileCodes(FileCodeMixin, models.Model):
     id = fields.IntField(pk=True)
     code = fields.CharField(max_length=255, unique=True, index=True)
     prefix = fields.CharField(max_length=255, default="")
@@ -20,6 +45,7 @@ class FileCodes(models.Model):
     uuid_file_name = fields.CharField(max_length=255, null=True)
     file_path = fields.CharField(max_length=255, null=True)
     size = fields.IntField(default=0)
+    # 文本分享只保存开头一段用于列表展示，完整内容保存在 FileText 中
     text = fields.TextField(null=True)
     expired_at = fields.DatetimeField(null=True)
     expired_count = fields.IntField(default=0)
@@ -28,16 +54,117 @@ class FileCodes(models.Model):
     file_hash = fields.CharField(max_length=64, null=True)
     is_chunked = fields.BooleanField(default=False)
     upload_id = fields.CharField(max_length=36, null=True)
+    # 保存文件的存储名称，为空的旧记录使用 settings.file_storage
+    storage = fields.CharField(max_length=32, null=True)
+    # 是否为文本分享
+    is_text = fields.BooleanField(default=False)
 
-    async def is_expired(self):
-        if self.expired_at is None:
-            return False
-        if self.expired_at and self.expired_count < 0:
-            return self.expired_at < await get_now()
-        return self.expired_count <= 0
+    # text 字段保存的预览长度
+    text_preview_length = 100
 
-    async def get_file_path(self):
-        return f"{self.file_path}/{self.uuid_file_name}"
+    async def delete(self, using_db=None) -> None:
+        if self.is_text:
+            await FileText.filter(file_id=self.id).using_db(using_db).delete()
+        await super().delete(using_db=using_db)
+
+    @classmethod
+    async def stats(cls, *args, **kwargs) -> Tuple[int, int]:
+        """在数据库中统计符合条件的记录数与文件总大小"""
+        row = await cls.filter(*args, **kwargs).annotate(
+            total=Count("id"), total_size=Sum("size")
+        ).first().values("total", "total_size")
+        return row["total"] or 0, row["total_size"] or 0
+
+
+class FileCodeRecord(FileCodeMixin):
+    """
+    FileCodes 的精简只读记录
+
+    取件、下载和过期清理只需要部分字段，用 values() 查询后构造，不创建 Tortoise 模型对象。
+    提供存储后端用到的属性与方法，可以代替 FileCodes 传给 FileStorageInterface。
+    """
+    __slots__ = (
+        "id", "code", "prefix", "suffix", "uuid_file_name", "file_path", "size",
+        "expired_at", "expired_count", "used_count", "storage", "is_text",
+    )
+    _get_by_code_sql: Dict[str, str] = {}
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    @classmethod
+    async def fetch(cls, query: QuerySet) -> List["FileCodeRecord"]:
+        # values_list 超过 10 个字段时结果顺序与字段顺序不一致，使用 values
+        return [cls(*map(row.__getitem__, cls.__slots__)) for row in await query.values(*cls.__slots__)]
+
+    @classmethod
+    def _compile_get_by_code(cls, db) -> str:
+        table = FileCodes._meta.basetable
+        parameter = db.executor_class(model=FileCodes, db=db).parameter(0)
+        query = db.query_class.from_(table).select(
+            *(table[name] for name in cls.__slots__)
+        ).where(table.code == parameter).limit(1)
+        return query.get_sql()
+
+    @classmethod
+    async def get_by_code(cls, code: str) -> Optional["FileCodeRecord"]:
+        """按分享码查询，取件的热点路径，按数据库方言缓存编译好的语句，省去每次构建查询"""
+        db = FileCodes._meta.db
+        sql = cls._get_by_code_sql.get(db.capabilities.dialect)
+        if sql is None:
+            sql = cls._get_by_code_sql[db.capabilities.dialect] = cls._compile_get_by_code(db)
+        _, rows = await db.execute_query(sql, [code])
+        if not rows:
+            return None
+        fields_map = FileCodes._meta.fields_map
+        return cls(*(fields_map[name].to_python_value(rows[0][name]) for name in cls.__slots__))
+
+
+class FileText(models.Model):
+    """文本分享的内容，与 FileCodes 分表保存，只在取件时读取"""
+    id = fields.IntField(pk=True)
+    file_id = fields.IntField(unique=True, index=True)
+    content = fields.BinaryField()
+    # 压缩算法：zstd、zlib，空字符串表示未压缩
+    compression = fields.CharField(max_length=16, default="")
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    # 超过该字节数的文本才压缩
+    compress_threshold = 1024
+
+    @classmethod
+    def pack(cls, text: str) -> Tuple[bytes, str]:
+        """编码并压缩文本，安装了 zstandard 时优先使用 zstd"""
+        data = text.encode("utf-8")
+        if len(data) <= cls.compress_threshold:
+            return data, ""
+        try:
+            import zstandard
+            packed, compression = zstandard.ZstdCompressor(level=3).compress(data), "zstd"
+        except ImportError:
+            packed, compression = zlib.compress(data, 6), "zlib"
+        # 压缩后没有变小时原样保存
+        if len(packed) >= len(data):
+            return data, ""
+        return packed, compression
+
+    def unpack(self) -> str:
+        data = self.content
+        if self.compression == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError('请先安装 `zstandard`')
+            data = zstandard.ZstdDecompressor().decompress(data)
+        elif self.compression == "zlib":
+            data = zlib.decompress(data)
+        return data.decode("utf-8")
+
+    @classmethod
+    async def save_text(cls, file_code: FileCodes, text: str) -> "FileText":
+        content, compression = cls.pack(text)
+        return await cls.create(file_id=file_code.id, content=content, compression=compression)
 
 
 class UploadChunk(models.Model):
@@ -51,6 +178,17 @@ class UploadChunk(models.Model):
     file_name = fields.CharField(max_length=255)
     created_at = fields.DatetimeField(auto_now_add=True)
     completed = fields.BooleanField(default=False)
+    # 存储后端的上传会话ID（如 S3 multipart upload id），仅会话记录（chunk_index=-1）使用
+    storage_upload_id = fields.CharField(max_length=255, null=True)
+    # 存储后端返回的分片 ETag
+    etag = fields.CharField(max_length=255, null=True)
+    # 合并后的文件保存路径，在创建会话时确定
+    save_path = fields.CharField(max_length=512, null=True)
+    # 分片所在的存储名称，在创建会话时按 storage_policy 选定
+    storage = fields.CharField(max_length=32, null=True)
+
+    class Meta:
+        indexes = (("upload_id", "chunk_index"), ("chunk_index", "created_at"))
 
 
 class KeyValue(Model):
@@ -64,6 +202,16 @@ class KeyValue(Model):
     )
 
 
+class Migrates(Model):
+    """已执行的数据库迁移"""
+    id: Optional[int] = fields.IntField(pk=True)
+    migration_file: Optional[str] = fields.CharField(max_length=255, unique=True)
+    executed_at: Optional[datetime] = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "migrates"
+
+
 file_codes_pydantic = pydantic_model_creator(FileCodes, name="FileCodes")
 upload_chunk_pydantic = pydantic_model_creator(UploadChunk, name="UploadChunk")
 key_value_pydantic = pydantic_model_creator(KeyValue, name="KeyValue")
@@ -1,16 +1,20 @@
 import datetime
 import hashlib
 import os
+import random
 import uuid
+from collections import Counter, deque
 from urllib.parse import unquote
 
 from fastapi import UploadFile, HTTPException
-from typing import Optional, Tuple
+from tortoise.exceptions import IntegrityError
+from typing import Deque, Dict, Optional, Set, Tuple
 
 from apps.base.dependencies import IPRateLimit
-from apps.base.models import FileCodes
+from apps.base.models import FileCodes, UploadChunk
+from core.metrics import code_pool_occupancy
 from core.settings import settings
-from core.utils import get_random_num, get_random_string, max_save_times_desc, sanitize_filename
+from core.utils import max_save_times_desc, sanitize_filename, r_s
 
 
 async def get_file_path_name(file: UploadFile) -> Tuple[str, str, str, str, str]:
@@ -30,9 +34,10 @@ async def get_file_path_name(file: UploadFile) -> Tuple[str, str, str, str, str]
     return path, suffix, prefix, filename, save_path
 
 
-async def get_chunk_file_path_name(file_name: str, upload_id: str) -> Tuple[str, str, str, str, str]:
+async def get_chunk_file_path_name(file_name: str, upload_id: str, today: Optional[datetime.datetime] = None
+                                   ) -> Tuple[str, str, str, str, str]:
     """获取切片文件的路径和文件名"""
-    today = datetime.datetime.now()
+    today = today or datetime.datetime.now()
     storage_path = settings.storage_path.strip("/")  # 移除开头和结尾的斜杠
     base_path = f"share/data/{today.strftime('%Y/%m/%d')}/{upload_id}"
     path = f"{storage_path}/{base_path}" if storage_path else base_path
@@ -41,6 +46,15 @@ async def get_chunk_file_path_name(file_name: str, upload_id: str) -> Tuple[str,
     return path, suffix, prefix, file_name, save_path
 
 
+async def get_chunk_session_path_name(chunk_info: UploadChunk) -> Tuple[str, str, str, str, str]:
+    """获取分片上传会话的文件路径，优先使用创建会话时记录的路径，避免跨天上传时路径变化"""
+    if not chunk_info.save_path:
+        return await get_chunk_file_path_name(chunk_info.file_name, chunk_info.upload_id, chunk_info.created_at)
+    path = chunk_info.save_path.rsplit("/", 1)[0]
+    prefix, suffix = os.path.splitext(chunk_info.file_name)
+    return path, suffix, prefix, chunk_info.file_name, chunk_info.save_path
+
+
 async def get_expire_info(expire_value: int, expire_style: str) -> Tuple[Optional[datetime.datetime], int, int, str]:
     """获取过期信息"""
     expired_count, used_count = -1, 0
@@ -88,12 +102,144 @@ async def get_expire_info(expire_value: int, expire_style: str) -> Tuple[Optiona
     return expired_at, expired_count, used_count, code
 
 
+class CodePool:
+    """
+    分享码分配池
+
+    内存中维护已占用分享码集合，并为每种样式预先随机抽取一批空闲分享码，
+    分配时直接从队列头部取出，无需逐个查询数据库。
+    某一长度的占用率超过 threshold 时自动切换到更长的分享码。
+    已占用集合由后台任务定期从数据库同步，删除分享时同步释放。
+    """
+
+    styles = {
+        # 样式: (字符集, 首字符是否不能为0, 初始长度, 最大长度)
+        "num": ("0123456789", True, 5, 9),
+        "string": (r_s, False, 5, 8),
+    }
+
+    def __init__(self, threshold: float = 0.8, batch: int = 256):
+        self.threshold = threshold
+        self.batch = batch
+        self.used: Set[str] = set()
+        self.counts: Counter = Counter()
+        self.lengths: Dict[str, int] = {style: conf[2] for style, conf in self.styles.items()}
+        self.pools: Dict[str, Deque[str]] = {style: deque() for style in self.styles}
+        self.loaded = False
+        self._acquired: Set[str] = set()
+
+    def _classify(self, code: str) -> Optional[Tuple[str, int]]:
+        for style, (alphabet, lead_nonzero, _, _) in self.styles.items():
+            if all(c in alphabet for c in code) and not (lead_nonzero and code.startswith("0")):
+                return style, len(code)
+        return None
+
+    def capacity(self, style: str, length: int) -> int:
+        alphabet, lead_nonzero, _, _ = self.styles[style]
+        if lead_nonzero:
+            return (len(alphabet) - 1) * len(alphabet) ** (length - 1)
+        return len(alphabet) ** length
+
+    def occupancy(self, style: str) -> float:
+        length = self.lengths[style]
+        return self.counts[(style, length)] / self.capacity(style, length)
+
+    def _draw(self, style: str) -> str:
+        alphabet, lead_nonzero, _, _ = self.styles[style]
+        length = self.lengths[style]
+        first = alphabet[1:] if lead_nonzero else alphabet
+        return random.choice(first) + "".join(random.choices(alphabet, k=length - 1))
+
+    def _refill(self, style: str):
+        pool = self.pools[style]
+        while len(pool) < self.batch:
+            code = self._draw(style)
+            if code not in self.used:
+                pool.append(code)
+
+    def _grow(self, style: str):
+        max_length = self.styles[style][3]
+        while self.occupancy(style) > self.threshold and self.lengths[style] < max_length:
+            self.lengths[style] += 1
+            self.pools[style].clear()
+
+    def mark_used(self, code: str):
+        if code in self.used:
+            return
+        self.used.add(code)
+        key = self._classify(code)
+        if key:
+            self.counts[key] += 1
+
+    def release(self, code: str):
+        if code not in self.used:
+            return
+        self.used.discard(code)
+        key = self._classify(code)
+        if key:
+            self.counts[key] -= 1
+
+    async def sync(self):
+        """从数据库同步已占用的分享码"""
+        self._acquired = set()
+        codes = await FileCodes.all().values_list("code", flat=True)
+        self.used = set()
+        self.counts = Counter()
+        for code in [*codes, *self._acquired]:
+            self.mark_used(code)
+        for style in self.styles:
+            self.pools[style].clear()
+            self._grow(style)
+        self.loaded = True
+
+    async def acquire(self, style: str = "num") -> str:
+        if not self.loaded:
+            await self.sync()
+        pool = self.pools[style]
+        while True:
+            if not pool:
+                self._refill(style)
+            code = pool.popleft()
+            if code not in self.used:
+                break
+        self.mark_used(code)
+        self._acquired.add(code)
+        self._grow(style)
+        return code
+
+    def stats(self) -> dict:
+        return {
+            style: {
+                "length": self.lengths[style],
+                "used": self.counts[(style, self.lengths[style])],
+                "capacity": self.capacity(style, self.lengths[style]),
+                "occupancy": round(self.occupancy(style), 6),
+            }
+            for style in self.styles
+        }
+
+
+code_pool = CodePool()
+code_pool_occupancy.set_function(
+    lambda: {(style,): code_pool.occupancy(style) for style in code_pool.styles}
+)
+
+
 async def get_random_code(style="num") -> str:
     """获取随机字符串"""
+    return await code_pool.acquire(style)
+
+
+async def create_file_code(code, **kwargs):
+    """创建分享记录，分享码冲突时（如多实例部署）重新分配"""
     while True:
-        code = await get_random_num() if style == "num" else await get_random_string()
-        if not await FileCodes.filter(code=code).exists():
-            return code
+        try:
+            return await FileCodes.create(code=code, **kwargs)
+        except IntegrityError:
+            if not await FileCodes.filter(code=code).exists():
+                raise
+            code_pool.mark_used(code)
+            code = await get_random_code("num" if code.isdigit() else "string")
 
 
 async def calculate_file_hash(file: UploadFile, chunk_size=1024 * 1024) -> str:
@@ -109,6 +255,6 @@ async def calculate_file_hash(file: UploadFile, chunk_size=1024 * 1024) -> str:
 
 
 ip_limit = {
-    "error": IPRateLimit(count=settings.uploadCount, minutes=settings.errorMinute),
-    "upload": IPRateLimit(count=settings.errorCount, minutes=settings.errorMinute),
+    "error": IPRateLimit(count=settings.errorCount, minutes=settings.errorMinute, name="error"),
+    "upload": IPRateLimit(count=settings.uploadCount, minutes=settings.uploadMinute, name="upload"),
 }
@@ -3,14 +3,17 @@ import uuid
 
 from fastapi import APIRouter, Form, UploadFile, File, Depends, HTTPException
 from starlette import status
+from tortoise.expressions import F
 
 from apps.admin.dependencies import share_required_login
-from apps.base.models import FileCodes, UploadChunk
+from apps.base.models import FileCodeRecord, FileCodes, FileText, UploadChunk
 from apps.base.schemas import SelectFileModel, InitChunkUploadModel, CompleteUploadModel
-from apps.base.utils import get_expire_info, get_file_path_name, ip_limit, get_chunk_file_path_name
+from apps.base.utils import get_expire_info, get_file_path_name, ip_limit, get_chunk_file_path_name, \
+    get_chunk_session_path_name, create_file_code
 from core.response import APIResponse
 from core.settings import settings
-from core.storage import storages, FileStorageInterface
+from core.storage import get_file_storage, FileStorageInterface, select_storage
+from core.throttle import download_shaper
 from core.utils import get_select_token
 
 share_api = APIRouter(prefix="/share", tags=["分享"])
@@ -24,10 +27,6 @@ async def validate_file_size(file: UploadFile, max_size: int):
         )
 
 
-async def create_file_code(code, **kwargs):
-    return await FileCodes.create(code=code, **kwargs)
-
-
 @share_api.post("/text/", dependencies=[Depends(share_required_login)])
 async def share_text(
         text: str = Form(...),
@@ -43,17 +42,23 @@ async def share_text(
     expired_at, expired_count, used_count, code = await get_expire_info(
         expire_value, expire_style
     )
-    await create_file_code(
+    file_code = await create_file_code(
         code=code,
-        text=text,
+        text=text[:FileCodes.text_preview_length],
+        is_text=True,
         expired_at=expired_at,
         expired_count=expired_count,
         used_count=used_count,
         size=len(text),
         prefix="Text",
     )
+    try:
+        await FileText.save_text(file_code, text)
+    except Exception:
+        await file_code.delete()
+        raise
     ip_limit["upload"].add_ip(ip)
-    return APIResponse(detail={"code": code})
+    return APIResponse(detail={"code": file_code.code})
 
 
 @share_api.post("/file/", dependencies=[Depends(share_required_login)])
@@ -68,9 +73,10 @@ async def share_file(
         raise HTTPException(status_code=400, detail="过期时间类型错误")
     expired_at, expired_count, used_count, code = await get_expire_info(expire_value, expire_style)
     path, suffix, prefix, uuid_file_name, save_path = await get_file_path_name(file)
-    file_storage: FileStorageInterface = storages[settings.file_storage]()
+    storage_name = select_storage(file.size, expired_at)
+    file_storage: FileStorageInterface = get_file_storage(storage_name)
     await file_storage.save_file(file, save_path)
-    await create_file_code(
+    file_code = await create_file_code(
         code=code,
         prefix=prefix,
         suffix=suffix,
@@ -80,13 +86,14 @@ async def share_file(
         expired_at=expired_at,
         expired_count=expired_count,
         used_count=used_count,
+        storage=storage_name,
     )
     ip_limit["upload"].add_ip(ip)
-    return APIResponse(detail={"code": code, "name": file.filename})
+    return APIResponse(detail={"code": file_code.code, "name": file.filename})
 
 
 async def get_code_file_by_code(code, check=True):
-    file_code = await FileCodes.filter(code=code).first()
+    file_code = await FileCodeRecord.get_by_code(code)
     if not file_code:
         return False, "文件不存在"
     if await file_code.is_expired() and check:
@@ -94,43 +101,68 @@ async def get_code_file_by_code(code, check=True):
     return True, file_code
 
 
-async def update_file_usage(file_code):
-    file_code.used_count += 1
+async def update_file_usage(file_code: FileCodeRecord) -> bool:
+    """
+    原子地增加使用次数并扣减剩余次数
+    :return: 按次数限制的分享已被并发请求用完时返回 False
+    """
     if file_code.expired_count > 0:
-        file_code.expired_count -= 1
-    await file_code.save()
+        updated = await FileCodes.filter(id=file_code.id, expired_count__gt=0).update(
+            used_count=F("used_count") + 1, expired_count=F("expired_count") - 1
+        )
+        return updated > 0
+    await FileCodes.filter(id=file_code.id).update(used_count=F("used_count") + 1)
+    return True
+
+
+async def shaped_file_response(file_storage: FileStorageInterface, file_code: FileCodeRecord, ip: str,
+                               count_usage: bool = False):
+    """
+    获取文件响应，并按下载限速与每个 IP 的同时下载数限制发送
+    :param count_usage: 占用下载名额后再扣减使用次数，被限制的请求不会消耗次数
+    """
+    if not download_shaper.acquire(ip, file_code.code):
+        raise HTTPException(status_code=429, detail="同时下载的文件过多，请稍后再试")
+    try:
+        if count_usage and not await update_file_usage(file_code):
+            response = APIResponse(code=404, detail="文件已过期")
+        else:
+            response = await file_storage.get_file_response(file_code)
+    except BaseException:
+        download_shaper.release(ip, file_code.code)
+        raise
+    return download_shaper.wrap(response, ip, file_code.code)
 
 
 @share_api.get("/select/")
 async def get_code_file(code: str, ip: str = Depends(ip_limit["error"])):
-    file_storage: FileStorageInterface = storages[settings.file_storage]()
     has, file_code = await get_code_file_by_code(code)
     if not has:
         ip_limit["error"].add_ip(ip)
         return APIResponse(code=404, detail=file_code)
 
-    await update_file_usage(file_code)
-    return await file_storage.get_file_response(file_code)
+    file_storage: FileStorageInterface = get_file_storage(file_code.storage)
+    return await shaped_file_response(file_storage, file_code, ip, count_usage=True)
 
 
 @share_api.post("/select/")
 async def select_file(data: SelectFileModel, ip: str = Depends(ip_limit["error"])):
-    file_storage: FileStorageInterface = storages[settings.file_storage]()
     has, file_code = await get_code_file_by_code(data.code)
     if not has:
         ip_limit["error"].add_ip(ip)
         return APIResponse(code=404, detail=file_code)
 
-    await update_file_usage(file_code)
+    if not await update_file_usage(file_code):
+        return APIResponse(code=404, detail="文件已过期")
     return APIResponse(
         detail={
             "code": file_code.code,
             "name": file_code.prefix + file_code.suffix,
             "size": file_code.size,
             "text": (
-                file_code.text
-                if file_code.text is not None
-                else await file_storage.get_file_url(file_code)
+                await file_code.get_text()
+                if file_code.is_text
+                else await get_file_storage(file_code.storage).get_file_url(file_code)
             ),
         }
     )
@@ -138,16 +170,15 @@ async def select_file(data: SelectFileModel, ip: str = Depends(ip_limit["error"]
 
 @share_api.get("/download")
 async def download_file(key: str, code: str, ip: str = Depends(ip_limit["error"])):
-    file_storage: FileStorageInterface = storages[settings.file_storage]()
     if await get_select_token(code) != key:
         ip_limit["error"].add_ip(ip)
     has, file_code = await get_code_file_by_code(code, False)
     if not has:
         return APIResponse(code=404, detail="文件不存在")
     return (
-        APIResponse(detail=file_code.text)
-        if file_code.text
-        else await file_storage.get_file_response(file_code)
+        APIResponse(detail=await file_code.get_text())
+        if file_code.is_text
+        else await shaped_file_response(get_file_storage(file_code.storage), file_code, ip)
     )
 
 
@@ -174,6 +205,14 @@ async def init_chunk_upload(data: InitChunkUploadModel):
     # 创建上传会话
     upload_id = uuid.uuid4().hex
     total_chunks = (data.file_size + data.chunk_size - 1) // data.chunk_size
+    storage_name = select_storage(data.file_size)
+    storage = get_file_storage(storage_name)
+    if not storage.supports_chunk:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="当前存储不支持分片上传")
+    if total_chunks > 1 and data.chunk_size < storage.min_chunk_size:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"分片大小不能小于{storage.min_chunk_size}字节")
+    _, _, _, _, save_path = await get_chunk_file_path_name(data.file_name, upload_id)
+    storage_upload_id = await storage.init_chunk_upload(upload_id, save_path, total_chunks)
     await UploadChunk.create(
         upload_id=upload_id,
         chunk_index=-1,
@@ -182,6 +221,9 @@ async def init_chunk_upload(data: InitChunkUploadModel):
         chunk_size=data.chunk_size,
         chunk_hash=data.file_hash,
         file_name=data.file_name,
+        storage_upload_id=storage_upload_id,
+        save_path=save_path,
+        storage=storage_name,
     )
     # 获取已上传的分片列表
     uploaded_chunks = await UploadChunk.filter(
@@ -216,6 +258,12 @@ async def upload_chunk(
     chunk_data = await chunk.read()
     chunk_hash = hashlib.sha256(chunk_data).hexdigest()
 
+    # 获取文件路径
+    _, _, _, _, save_path = await get_chunk_session_path_name(chunk_info)
+    # 保存分片到存储，成功后再记录分片
+    storage = get_file_storage(chunk_info.storage)
+    etag = await storage.save_chunk(upload_id, chunk_index, chunk_data, chunk_hash, save_path)
+
     # 更新或创建分片记录
     await UploadChunk.update_or_create(
         upload_id=upload_id,
@@ -226,14 +274,10 @@ async def upload_chunk(
             'file_size': chunk_info.file_size,
             'total_chunks': chunk_info.total_chunks,
             'chunk_size': chunk_info.chunk_size,
-            'file_name': chunk_info.file_name
+            'file_name': chunk_info.file_name,
+            'etag': etag,
         }
     )
-    # 获取文件路径
-    _, _, _, _, save_path = await get_chunk_file_path_name(chunk_info.file_name, upload_id)
-    # 保存分片到存储
-    storage = storages[settings.file_storage]()
-    await storage.save_chunk(upload_id, chunk_index, chunk_data, chunk_hash, save_path)
     return APIResponse(detail={"chunk_hash": chunk_hash})
 
 
@@ -244,7 +288,7 @@ async def complete_upload(upload_id: str, data: CompleteUploadModel, ip: str = D
     if not chunk_info:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="上传会话不存在")
 
-    storage = storages[settings.file_storage]()
+    storage = get_file_storage(chunk_info.storage)
     # 验证所有分片
     completed_chunks = await UploadChunk.filter(
         upload_id=upload_id,
@@ -253,12 +297,12 @@ async def complete_upload(upload_id: str, data: CompleteUploadModel, ip: str = D
     if completed_chunks != chunk_info.total_chunks:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="分片不完整")
     # 获取文件路径
-    path, suffix, prefix, _, save_path = await get_chunk_file_path_name(chunk_info.file_name, upload_id)
+    path, suffix, prefix, _, save_path = await get_chunk_session_path_name(chunk_info)
     # 合并文件并计算哈希
     await storage.merge_chunks(upload_id, chunk_info, save_path)
     # 创建文件记录
     expired_at, expired_count, used_count, code = await get_expire_info(data.expire_value, data.expire_style)
-    await FileCodes.create(
+    file_code = await create_file_code(
         code=code,
         file_hash=chunk_info.chunk_hash,
         is_chunked=True,
@@ -270,8 +314,11 @@ async def complete_upload(upload_id: str, data: CompleteUploadModel, ip: str = D
         file_path=path,
         uuid_file_name=f"{prefix}{suffix}",
         prefix=prefix,
-        suffix=suffix
+        suffix=suffix,
+        storage=chunk_info.storage or settings.file_storage,
     )
-    # 清理临时文件
-    await storage.clean_chunks(upload_id, save_path)
-    return APIResponse(detail={"code": code, "name": chunk_info.file_name})
+    # 清理临时文件和分片记录
+    if not storage.cleans_on_merge:
+        await storage.clean_chunks(upload_id, save_path)
+    await UploadChunk.filter(upload_id=upload_id).delete()
+    return APIResponse(detail={"code": file_code.code, "name": chunk_info.file_name})
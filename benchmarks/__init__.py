@@ -0,0 +1,2 @@
+# 性能基准测试，均在仓库根目录下以模块方式运行，例如：
+# python -m benchmarks.bench_ip_limit
@@ -0,0 +1,43 @@
+"""
+首页与随机 404 路径吞吐量基准
+
+python -m benchmarks.bench_index [--requests 5000]
+"""
+import argparse
+import asyncio
+import json
+import uuid
+
+from benchmarks.utils import asgi_request, summarize, timer
+from main import app
+
+
+async def run(path_factory, name: str, n: int, headers=()) -> dict:
+    latencies = []
+    start = timer()
+    for _ in range(n):
+        t = timer()
+        status, _, _ = await asgi_request(app, "GET", path_factory(), headers)
+        latencies.append(timer() - t)
+        assert status in (200, 304), status
+    return summarize(name, latencies, timer() - start)
+
+
+async def main(n: int):
+    results = [
+        await run(lambda: "/", "index", n),
+        await run(lambda: "/", "index_gzip", n, [("Accept-Encoding", "gzip, br")]),
+        await run(lambda: f"/{uuid.uuid4().hex}", "random_404", n),
+    ]
+    _, headers, _ = await asgi_request(app, "GET", "/")
+    results.append(
+        await run(lambda: "/", "index_304", n, [("If-None-Match", headers["etag"])])
+    )
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    asyncio.run(main(parser.parse_args().requests))
@@ -0,0 +1,57 @@
+"""
+IP 限流器微基准：一百万个不同 IP 的计数、检查与过期清理
+
+python -m benchmarks.bench_ip_limit [--ips 1000000] [--max-ips 100000]
+"""
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+
+from apps.base.dependencies import IPRateLimit
+
+
+def gen_ips(n: int):
+    for i in range(n):
+        yield f"{10 + (i >> 24) % 240}.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+
+
+def run(n: int, max_ips: int) -> dict:
+    limiter = IPRateLimit(count=10, minutes=1, max_ips=max_ips)
+    tracemalloc.start()
+    start = time.perf_counter()
+    for ip in gen_ips(n):
+        if limiter.check_ip(ip):
+            limiter.add_ip(ip)
+    add_seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for ip in gen_ips(n):
+        limiter.check_ip(ip)
+    check_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    asyncio.run(limiter.remove_expired_ip())
+    sweep_seconds = time.perf_counter() - start
+
+    return {
+        "benchmark": "ip_limit",
+        "ips": n,
+        "max_ips": max_ips,
+        "tracked_ips": len(limiter.ips),
+        "add_ops_per_sec": round(n / add_seconds),
+        "check_ops_per_sec": round(n / check_seconds),
+        "sweep_ms": round(sweep_seconds * 1000, 3),
+        "peak_memory_mb": round(peak / 1024 / 1024, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ips", type=int, default=1000000)
+    parser.add_argument("--max-ips", type=int, default=100000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.ips, args.max_ips)))
@@ -0,0 +1,132 @@
+"""
+FileCodes 查询投影微基准
+
+在内存 SQLite 中写入 10k 条分享记录，对取件、后台统计、列表、过期清理四条路径比较
+加载完整模型（model）与精简投影（lean：FileCodeRecord / values() / 数据库聚合）的
+单次耗时与内存分配峰值（tracemalloc）。
+
+python -m benchmarks.bench_queries [--rows 10000] [--iterations 50]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import time
+import tracemalloc
+from typing import Awaitable, Callable, Dict
+
+from tortoise import Tortoise
+
+from apps.base.models import FileCodeRecord, FileCodes
+from benchmarks.utils import summarize, timer
+
+
+async def populate(rows: int):
+    now = datetime.datetime.now()
+    objs = []
+    for i in range(rows):
+        is_text = i % 4 == 0
+        objs.append(FileCodes(
+            code=f"{i:08d}",
+            prefix="Text" if is_text else f"file{i}",
+            suffix="" if is_text else ".bin",
+            uuid_file_name=None if is_text else f"file{i}.bin",
+            file_path=None if is_text else f"share/data/{i % 100}",
+            size=random.randint(1, 1 << 30),
+            text="x" * FileCodes.text_preview_length if is_text else None,
+            is_text=is_text,
+            # 一半记录已过期
+            expired_at=now + datetime.timedelta(days=1 if i % 2 else -1),
+            expired_count=-1,
+            storage="local",
+        ))
+    await FileCodes.bulk_create(objs, batch_size=1000)
+
+
+def scenarios(rows: int) -> Dict[str, Dict[str, Callable[[], Awaitable]]]:
+    def code():
+        return f"{random.randrange(rows):08d}"
+
+    async def select_model():
+        return await FileCodes.filter(code=code()).first()
+
+    async def select_lean():
+        return await FileCodeRecord.get_by_code(code())
+
+    async def stats_model():
+        codes = await FileCodes.all()
+        return len(codes), sum(c.size for c in codes)
+
+    async def stats_lean():
+        return await FileCodes.stats()
+
+    async def list_model():
+        return await FileCodes.filter(prefix__icontains="file").limit(100).offset(100)
+
+    async def list_lean():
+        return await FileCodes.filter(prefix__icontains="file").limit(100).offset(100).values()
+
+    expired = FileCodes.filter(expired_at__lt=datetime.datetime.now())
+
+    async def sweep_model():
+        return await expired.all()
+
+    async def sweep_lean():
+        return await FileCodeRecord.fetch(expired)
+
+    return {
+        "select": {"model": select_model, "lean": select_lean},
+        "stats": {"model": stats_model, "lean": stats_lean},
+        "list": {"model": list_model, "lean": list_lean},
+        "sweep": {"model": sweep_model, "lean": sweep_lean},
+    }
+
+
+async def measure(func: Callable[[], Awaitable], iterations: int) -> dict:
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        begin = timer()
+        await func()
+        latencies.append(timer() - begin)
+    elapsed = time.perf_counter() - start
+
+    # 内存分配单独测量，避免 tracemalloc 影响耗时
+    peaks = []
+    tracemalloc.start()
+    for _ in range(min(iterations, 10)):
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        await func()
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - base)
+    tracemalloc.stop()
+    return {"latencies": latencies, "elapsed": elapsed, "peak_kb": round(max(peaks) / 1024, 1)}
+
+
+async def main(rows: int, iterations: int):
+    await Tortoise.init(
+        db_url="sqlite://:memory:", modules={"models": ["apps.base.models"]},
+        use_tz=False, timezone="Asia/Shanghai",
+    )
+    await Tortoise.generate_schemas()
+    await populate(rows)
+    for path, variants in scenarios(rows).items():
+        for variant, func in variants.items():
+            # 预热
+            await func()
+            result = await measure(func, iterations)
+            print(json.dumps(summarize(
+                f"query_{path}", result["latencies"], result["elapsed"],
+                variant=variant, rows=rows, alloc_peak_kb=result["peak_kb"],
+            )))
+    await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.iterations))
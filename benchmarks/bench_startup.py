@@ -0,0 +1,69 @@
+"""
+冷启动耗时基准
+
+每次迭代启动一个新的 Python 进程，分别测量 `import main` 与执行一次应用 lifespan
+（初始化数据库、执行迁移、加载配置，随后关闭）的耗时，并记录启动后是否加载了
+远程存储的 SDK。lifespan 会读写仓库的 data/ 目录，建议在临时副本中运行。
+
+python -m benchmarks.bench_startup [--iterations 10]
+"""
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+from benchmarks.utils import summarize
+
+# 只使用本机存储时不应加载的模块
+OPTIONAL_MODULES = ("aiohttp", "aioboto3", "botocore", "msal", "opendal")
+
+CHILD = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+from main import app, lifespan
+imported = time.perf_counter()
+
+async def run():
+    async with lifespan(app):
+        pass
+
+asyncio.run(run())
+print(json.dumps({
+    "import": imported - start,
+    "lifespan": time.perf_counter() - imported,
+    "modules": [name for name in %r if name in sys.modules],
+}))
+""" % (OPTIONAL_MODULES,)
+
+
+def run_once(cwd: Path) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=cwd, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(iterations: int):
+    cwd = Path(__file__).resolve().parent.parent
+    # 第一次启动会执行尚未执行的迁移并生成 .pyc，不计入结果
+    run_once(cwd)
+    timings: Dict[str, List[float]] = {"import": [], "lifespan": [], "total": []}
+    modules = set()
+    for _ in range(iterations):
+        result = run_once(cwd)
+        timings["import"].append(result["import"])
+        timings["lifespan"].append(result["lifespan"])
+        timings["total"].append(result["import"] + result["lifespan"])
+        modules.update(result["modules"])
+    for name, values in timings.items():
+        print(json.dumps(summarize(
+            f"startup_{name}", values, sum(values), optional_modules_loaded=sorted(modules),
+        )))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=10)
+    main(parser.parse_args().iterations)
@@ -0,0 +1,290 @@
+"""
+存储后端基准测试
+
+对每个 FileStorageInterface 实现测量上传、下载、分片合并、删除的延迟与吞吐量，
+远程后端使用本地替身：
+- local: SystemFileStorage，数据写入临时目录
+- webdav: benchmarks.fakes.FakeWebDAVServer（aiohttp 内存 WebDAV）
+- s3: moto 服务端（需要 `pip install "moto[server]"`，未安装时跳过）
+- opendal: OpenDAL 的 memory / fs 服务（需要 `pip install opendal`，未安装时跳过）
+
+python -m benchmarks.bench_storage [--backends local,webdav] [--sizes 65536,1048576]
+                                   [--iterations 5] [--output results.json]
+
+结果以 JSON 输出（每行一个结果，或通过 --output 写入文件），便于比较前后差异。
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import tempfile
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+from tortoise import Tortoise
+
+from apps.base.models import FileCodes, UploadChunk
+from benchmarks.fakes import FakeWebDAVServer, free_port
+from benchmarks.utils import summarize, timer
+from core.settings import settings
+from core.storage import FileStorageInterface, storages
+
+CHUNK_SIZE = 5 * 1024 * 1024
+
+
+async def read_response(response) -> bytes:
+    """以 ASGI 方式执行响应对象并收集响应体"""
+    if not hasattr(response, "__call__") or not hasattr(response, "headers"):
+        raise RuntimeError(f"下载失败: {response}")
+    chunks = []
+    status = 0
+
+    async def receive():
+        # 客户端一直保持连接，StreamingResponse 收到 disconnect 会中止发送
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await response({"type": "http", "method": "GET", "headers": []}, receive, send)
+    if status in (301, 302, 307):
+        import aiohttp
+        location = dict(response.headers)["location"]
+        async with aiohttp.ClientSession() as session:
+            async with session.get(location) as resp:
+                return await resp.read()
+    if status >= 400:
+        raise RuntimeError(f"下载失败: HTTP {status}")
+    return b"".join(chunks)
+
+
+def make_upload(data: bytes, filename: str) -> UploadFile:
+    return UploadFile(
+        file=io.BytesIO(data),
+        size=len(data),
+        filename=filename,
+        headers=Headers({"content-type": "application/octet-stream"}),
+    )
+
+
+def make_file_code(save_path: str, size: int) -> FileCodes:
+    file_path, name = save_path.rsplit("/", 1)
+    prefix, suffix = os.path.splitext(name)
+    return FileCodes(
+        code=uuid.uuid4().hex[:8], prefix=prefix, suffix=suffix, uuid_file_name=name,
+        file_path=file_path, size=size,
+    )
+
+
+class Backend:
+    """基准测试中的一个存储后端及其替身服务"""
+
+    def __init__(self, name: str, configure: Callable, cleanup: Optional[Callable] = None,
+                 prepare: Optional[Callable] = None):
+        self.name = name
+        self.configure = configure
+        self.cleanup = cleanup
+        self.prepare = prepare
+
+    async def create(self) -> FileStorageInterface:
+        scheme = await self.configure()
+        storage = storages[scheme]()
+        if self.prepare:
+            self.prepare(storage)
+        return storage
+
+
+async def configure_local(tmp: str):
+    async def configure():
+        return "local"
+
+    def prepare(storage):
+        storage.root_path = Path(tmp)
+
+    return Backend("local", configure, prepare=prepare)
+
+
+async def configure_webdav():
+    server = await FakeWebDAVServer().start()
+
+    async def configure():
+        settings.webdav_url = server.url
+        settings.webdav_username = server.username
+        settings.webdav_password = server.password
+        return "webdav"
+
+    return Backend("webdav", configure, server.stop)
+
+
+async def configure_s3():
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        print(json.dumps({"backend": "s3", "skipped": '请先安装 `moto[server]`'}))
+        return None
+    port = free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    bucket = "filecodebox-bench"
+
+    async def configure():
+        settings.s3_access_key_id = "testing"
+        settings.s3_secret_access_key = "testing"
+        settings.s3_bucket_name = bucket
+        settings.s3_endpoint_url = f"http://127.0.0.1:{port}"
+        settings.s3_region_name = "us-east-1"
+        settings.s3_signature_version = "s3v4"
+        settings.s3_proxy = 1
+        import aioboto3
+        session = aioboto3.Session(aws_access_key_id="testing", aws_secret_access_key="testing")
+        async with session.client("s3", endpoint_url=settings.s3_endpoint_url, region_name="us-east-1") as s3:
+            try:
+                await s3.create_bucket(Bucket=bucket)
+            except Exception:
+                pass
+        return "s3"
+
+    async def cleanup():
+        server.stop()
+
+    return Backend("s3", configure, cleanup)
+
+
+async def configure_opendal(scheme: str, tmp: str):
+    try:
+        import opendal  # noqa: F401
+    except ImportError:
+        print(json.dumps({"backend": f"opendal-{scheme}", "skipped": '请先安装 `opendal`'}))
+        return None
+
+    async def configure():
+        settings.opendal_scheme = scheme
+        if scheme == "fs":
+            settings.opendal_fs_root = os.path.join(tmp, "opendal")
+        return "opendal"
+
+    return Backend(f"opendal-{scheme}", configure)
+
+
+async def bench_backend(backend: Backend, sizes: List[int], iterations: int) -> List[dict]:
+    results = []
+    storage = await backend.create()
+    for size in sizes:
+        data = os.urandom(size)
+        latencies: Dict[str, List[float]] = {"upload": [], "download": [], "merge": [], "delete": []}
+        elapsed: Dict[str, float] = {k: 0.0 for k in latencies}
+        errors: Dict[str, str] = {}
+        for _ in range(iterations):
+            save_path = f"share/data/bench/{uuid.uuid4().hex}/blob.bin"
+            file_code = make_file_code(save_path, size)
+            steps = [
+                ("upload", lambda: storage.save_file(make_upload(data, "blob.bin"), save_path)),
+                ("download", lambda: download(storage, file_code, data)),
+                ("delete", lambda: storage.delete_file(file_code)),
+                ("merge", lambda: chunked_upload(storage, data)),
+            ]
+            for op, step in steps:
+                if op in errors:
+                    continue
+                start = timer()
+                try:
+                    await step()
+                except Exception as e:
+                    errors[op] = f"{type(e).__name__}: {e}"[:200]
+                    continue
+                cost = timer() - start
+                latencies[op].append(cost)
+                elapsed[op] += cost
+        for op, values in latencies.items():
+            if values:
+                result = summarize(
+                    f"storage_{op}", values, elapsed[op], backend=backend.name, size=size,
+                    throughput_mb_s=round(size * len(values) / elapsed[op] / 1024 / 1024, 2),
+                )
+            else:
+                result = {"benchmark": f"storage_{op}", "backend": backend.name, "size": size}
+            if op in errors:
+                result["error"] = errors[op]
+            results.append(result)
+    await storage.close()
+    return results
+
+
+async def download(storage: FileStorageInterface, file_code: FileCodes, expected: bytes):
+    content = await read_response(await storage.get_file_response(file_code))
+    if hashlib.sha256(content).digest() != hashlib.sha256(expected).digest():
+        raise RuntimeError("下载内容与上传内容不一致")
+
+
+async def chunked_upload(storage: FileStorageInterface, data: bytes):
+    """模拟 /chunk/upload/* 流程：逐片保存、合并、清理"""
+    upload_id = uuid.uuid4().hex
+    save_path = f"share/data/bench/{upload_id}/blob.bin"
+    total_chunks = max((len(data) + CHUNK_SIZE - 1) // CHUNK_SIZE, 1)
+    chunk_info = await UploadChunk.create(
+        upload_id=upload_id, chunk_index=-1, total_chunks=total_chunks, file_size=len(data),
+        chunk_size=CHUNK_SIZE, chunk_hash=hashlib.sha256(data).hexdigest(), file_name="blob.bin",
+        storage_upload_id=await storage.init_chunk_upload(upload_id, save_path, total_chunks),
+        save_path=save_path,
+    )
+    for i in range(total_chunks):
+        chunk = data[i * CHUNK_SIZE:(i + 1) * CHUNK_SIZE]
+        chunk_hash = hashlib.sha256(chunk).hexdigest()
+        etag = await storage.save_chunk(upload_id, i, chunk, chunk_hash, save_path)
+        await UploadChunk.create(
+            upload_id=upload_id, chunk_index=i, total_chunks=total_chunks, file_size=len(data),
+            chunk_size=CHUNK_SIZE, chunk_hash=chunk_hash, file_name="blob.bin", completed=True, etag=etag,
+        )
+    await storage.merge_chunks(upload_id, chunk_info, save_path)
+    if not storage.cleans_on_merge:
+        await storage.clean_chunks(upload_id, save_path)
+    await storage.delete_file(make_file_code(save_path, len(data)))
+
+
+async def main(args):
+    await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["apps.base.models"]})
+    await Tortoise.generate_schemas()
+    sizes = [int(s) for s in args.sizes.split(",")]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        factories = {
+            "local": lambda: configure_local(tmp),
+            "webdav": configure_webdav,
+            "s3": configure_s3,
+            "opendal-memory": lambda: configure_opendal("memory", tmp),
+            "opendal-fs": lambda: configure_opendal("fs", tmp),
+        }
+        for name in args.backends.split(","):
+            backend = await factories[name]()
+            if backend is None:
+                continue
+            try:
+                for result in await bench_backend(backend, sizes, args.iterations):
+                    results.append(result)
+                    if not args.output:
+                        print(json.dumps(result, ensure_ascii=False))
+            finally:
+                if backend.cleanup:
+                    await backend.cleanup()
+    await Tortoise.close_connections()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", default="local,webdav,s3,opendal-memory,opendal-fs")
+    parser.add_argument("--sizes", default="65536,1048576,8388608")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--output", default="")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,136 @@
+"""
+基准测试用的本地替身服务
+
+FakeWebDAVServer: 基于 aiohttp 的内存 WebDAV 服务，支持 WebDAVFileStorage 用到的
+PUT/GET/HEAD/DELETE/MKCOL/PROPFIND/PROPPATCH/PATCH 方法。PATCH 按 SabreDAV 的
+partial update 语义处理（X-Update-Range: append 或 bytes=start-end），未带该头时追加写入。
+"""
+import re
+import socket
+from typing import Dict, Optional, Set
+from urllib.parse import unquote
+from xml.sax.saxutils import escape
+
+from aiohttp import web
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class FakeWebDAVServer:
+    def __init__(self, username: str = "user", password: str = "pass"):
+        self.username = username
+        self.password = password
+        self.files: Dict[str, bytearray] = {}
+        self.props: Dict[str, Dict[str, str]] = {}
+        self.collections: Set[str] = {""}
+        self.runner: Optional[web.AppRunner] = None
+        self.port = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/dav/"
+
+    async def start(self):
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_route("*", "/dav/{path:.*}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        self.port = free_port()
+        await web.TCPSite(self.runner, "127.0.0.1", self.port).start()
+        return self
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    @staticmethod
+    def _parent(path: str) -> str:
+        return path.rsplit("/", 1)[0] if "/" in path else ""
+
+    def _children(self, path: str):
+        prefix = f"{path}/" if path else ""
+        for name in list(self.collections) + list(self.files):
+            if name != path and name.startswith(prefix) and "/" not in name[len(prefix):]:
+                yield name
+
+    def _propfind(self, path: str, depth: str) -> web.Response:
+        if path not in self.files and path not in self.collections:
+            return web.Response(status=404)
+        targets = [path] + (list(self._children(path)) if depth == "1" else [])
+        parts = []
+        for target in targets:
+            props = "".join(
+                f'<{name} xmlns="urn:filecodebox">{escape(value)}</{name}>'
+                for name, value in self.props.get(target, {}).items()
+            )
+            parts.append(
+                f"<D:response><D:href>/dav/{target}</D:href>"
+                f"<D:propstat><D:prop>{props}</D:prop>"
+                f"<D:status>HTTP/1.1 200 OK</D:status></D:propstat></D:response>"
+            )
+        body = '<?xml version="1.0"?><D:multistatus xmlns:D="DAV:">' + "".join(parts) + "</D:multistatus>"
+        return web.Response(status=207, body=body, content_type="application/xml")
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        path = unquote(request.match_info["path"]).strip("/")
+        method = request.method
+        if method == "OPTIONS":
+            return web.Response(headers={"DAV": "1, 2, sabredav-partialupdate"})
+        if method == "HEAD":
+            exists = path in self.files or path in self.collections
+            return web.Response(status=200 if exists else 404)
+        if method == "GET":
+            if path not in self.files:
+                return web.Response(status=404)
+            return web.Response(body=bytes(self.files[path]), content_type="application/octet-stream")
+        if method == "PUT":
+            if self._parent(path) not in self.collections:
+                return web.Response(status=409)
+            created = path not in self.files
+            self.files[path] = bytearray(await request.read())
+            return web.Response(status=201 if created else 204)
+        if method == "PATCH":
+            if path not in self.files:
+                return web.Response(status=404)
+            data = await request.read()
+            update_range = request.headers.get("X-Update-Range", "append")
+            match = re.match(r"bytes=(\d+)-", update_range)
+            if match:
+                start = int(match.group(1))
+                self.files[path][start:start + len(data)] = data
+            else:
+                self.files[path].extend(data)
+            return web.Response(status=204)
+        if method == "MKCOL":
+            if path in self.collections:
+                return web.Response(status=405)
+            if self._parent(path) not in self.collections:
+                return web.Response(status=409)
+            self.collections.add(path)
+            return web.Response(status=201)
+        if method == "DELETE":
+            if path in self.files:
+                del self.files[path]
+                self.props.pop(path, None)
+                return web.Response(status=204)
+            if path in self.collections and path:
+                prefix = f"{path}/"
+                for name in [n for n in self.files if n.startswith(prefix)]:
+                    del self.files[name]
+                self.collections = {c for c in self.collections if c != path and not c.startswith(prefix)}
+                return web.Response(status=204)
+            return web.Response(status=404)
+        if method == "PROPFIND":
+            return self._propfind(path, request.headers.get("Depth", "1"))
+        if method == "PROPPATCH":
+            if path not in self.files and path not in self.collections:
+                return web.Response(status=404)
+            body = await request.text()
+            for name, value in re.findall(r'<(\w+) xmlns="urn:filecodebox">([^<]*)</\1>', body):
+                self.props.setdefault(path, {})[name] = value
+            return web.Response(status=207)
+        return web.Response(status=405)
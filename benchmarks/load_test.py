@@ -0,0 +1,166 @@
+"""
+HTTP 端到端压测场景
+
+覆盖 /share/text/、/share/file/、/share/select/ (GET/POST)、/share/download 以及完整的
+/chunk/upload/* 流程，按设定并发执行并输出每个场景的 p50/p95/p99 延迟与 RPS。
+
+默认在进程内通过 httpx 的 ASGI transport 调用应用（会执行应用的 lifespan，
+数据写入仓库的 data/ 目录，建议在临时副本中运行），也可以用 --url 压测已启动的服务。
+需要安装 httpx: pip install httpx
+
+python -m benchmarks.load_test [--scenarios text,file,select_post,select_get,download,chunk]
+                               [--requests 500] [--concurrency 20] [--file-size 1048576]
+                               [--chunk-size 5242880] [--url http://127.0.0.1:12345]
+"""
+import argparse
+import asyncio
+import json
+import os
+import uuid
+from contextlib import AsyncExitStack
+from typing import Awaitable, Callable, List
+
+from benchmarks.utils import summarize, timer
+
+try:
+    import httpx
+except ImportError:
+    raise ImportError('请先安装 `httpx`, 例如: "pip install httpx"')
+
+
+class LoadTest:
+    def __init__(self, client: "httpx.AsyncClient", args):
+        self.client = client
+        self.args = args
+        self.file_data = os.urandom(args.file_size)
+        self.file_codes: List[str] = []
+        self.download_urls: List[str] = []
+
+    @staticmethod
+    def check(response: "httpx.Response") -> dict:
+        response.raise_for_status()
+        data = response.json() if response.headers.get("content-type", "").startswith("application/json") else {}
+        if data and data.get("code", 200) != 200:
+            raise RuntimeError(f"{data.get('code')}: {data.get('detail')}")
+        return data
+
+    async def share_text(self, i: int):
+        self.check(await self.client.post("/share/text/", data={"text": f"load test {i} " * 64}))
+
+    async def share_file(self, i: int):
+        files = {"file": (f"load-{i}.bin", self.file_data, "application/octet-stream")}
+        self.check(await self.client.post("/share/file/", files=files))
+
+    async def select_post(self, i: int):
+        code = self.file_codes[i % len(self.file_codes)]
+        self.check(await self.client.post("/share/select/", json={"code": code}))
+
+    async def select_get(self, i: int):
+        code = self.file_codes[i % len(self.file_codes)]
+        response = await self.client.get("/share/select/", params={"code": code})
+        response.raise_for_status()
+        if len(response.content) != len(self.file_data):
+            raise RuntimeError("下载内容长度不一致")
+
+    async def download(self, i: int):
+        response = await self.client.get(self.download_urls[i % len(self.download_urls)])
+        response.raise_for_status()
+        if len(response.content) != len(self.file_data):
+            raise RuntimeError("下载内容长度不一致")
+
+    async def chunk_upload(self, i: int):
+        chunk_size = self.args.chunk_size
+        data = self.file_data
+        detail = self.check(await self.client.post("/chunk/upload/init/", json={
+            "file_name": f"chunk-{i}.bin",
+            "file_size": len(data),
+            "chunk_size": chunk_size,
+            "file_hash": uuid.uuid4().hex,
+        }))["detail"]
+        upload_id = detail["upload_id"]
+        for index in range(detail["total_chunks"]):
+            chunk = data[index * chunk_size:(index + 1) * chunk_size]
+            self.check(await self.client.post(
+                f"/chunk/upload/chunk/{upload_id}/{index}",
+                files={"chunk": ("blob", chunk, "application/octet-stream")},
+            ))
+        self.check(await self.client.post(
+            f"/chunk/upload/complete/{upload_id}", json={"expire_value": 1, "expire_style": "day"}
+        ))
+
+    async def prepare(self):
+        """创建读取类场景用到的分享码"""
+        for i in range(min(self.args.requests, 20)):
+            files = {"file": (f"seed-{i}.bin", self.file_data, "application/octet-stream")}
+            data = {"expire_value": 1, "expire_style": "day"}
+            detail = self.check(await self.client.post("/share/file/", files=files, data=data))["detail"]
+            self.file_codes.append(detail["code"])
+            detail = self.check(await self.client.post("/share/select/", json={"code": detail["code"]}))["detail"]
+            self.download_urls.append(detail["text"])
+
+    async def run(self, name: str, func: Callable[[int], Awaitable]) -> dict:
+        latencies: List[float] = []
+        errors: List[str] = []
+        counter = iter(range(self.args.requests))
+
+        async def worker():
+            for i in counter:
+                start = timer()
+                try:
+                    await func(i)
+                except Exception as e:
+                    errors.append(f"{type(e).__name__}: {e}"[:200])
+                    continue
+                latencies.append(timer() - start)
+
+        start = timer()
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+        elapsed = timer() - start
+        result = summarize(name, latencies or [0.0], elapsed, concurrency=self.args.concurrency,
+                           errors=len(errors))
+        result["requests"] = len(latencies)
+        if errors:
+            result["first_error"] = errors[0]
+        return result
+
+
+async def main(args):
+    async with AsyncExitStack() as stack:
+        if args.url:
+            client = httpx.AsyncClient(base_url=args.url, timeout=60)
+        else:
+            from apps.base.utils import ip_limit
+            from main import app, lifespan
+            await stack.enter_async_context(lifespan(app))
+            # 进程内压测时放开 IP 限流，否则上传场景很快会被拒绝
+            for limiter in ip_limit.values():
+                limiter.count = 1 << 30
+            client = httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=app), base_url="http://loadtest", timeout=60
+            )
+        await stack.enter_async_context(client)
+        test = LoadTest(client, args)
+        scenarios = {
+            "text": test.share_text,
+            "file": test.share_file,
+            "select_post": test.select_post,
+            "select_get": test.select_get,
+            "download": test.download,
+            "chunk": test.chunk_upload,
+        }
+        names = args.scenarios.split(",")
+        if {"select_post", "select_get", "download"} & set(names):
+            await test.prepare()
+        for name in names:
+            print(json.dumps(await test.run(name, scenarios[name]), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", default="text,file,select_post,select_get,download,chunk")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--file-size", type=int, default=1024 * 1024)
+    parser.add_argument("--chunk-size", type=int, default=5 * 1024 * 1024)
+    parser.add_argument("--url", default="")
+    asyncio.run(main(parser.parse_args()))
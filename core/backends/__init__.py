@@ -0,0 +1,4 @@
+# @Time    : 2023/8/11 20:06
+# @Author  : Lan
+# @File    : __init__.py.py
+# @Software: PyCharm
@@ -0,0 +1,259 @@
+import asyncio
+import datetime
+import re
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote
+
+import aiohttp
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+
+from apps.base.models import FileCodes
+from core.settings import settings
+from core.storage import FileStorageInterface
+from core.stream import stream_coalescer
+from core.utils import get_file_url
+
+
+class OneDriveFileStorage(FileStorageInterface):
+    graph_url = "https://graph.microsoft.com/v1.0"
+    scopes = ["https://graph.microsoft.com/.default"]
+    # 超过该大小的文件使用可续传的上传会话
+    simple_upload_limit = 4 * 1024 * 1024
+    # 上传会话的分片大小必须是 320KiB 的整数倍
+    upload_chunk_size = 320 * 1024 * 32
+    # 令牌过期前多少秒主动刷新
+    token_refresh_margin = 300
+    settings_prefixes = ("onedrive_",)
+
+    def __init__(self):
+        try:
+            import msal
+        except ImportError:
+            raise ImportError("请先安装`msal`")
+        self.msal = msal
+        self.domain = settings.onedrive_domain
+        self.client_id = settings.onedrive_client_id
+        self.username = settings.onedrive_username
+        self.password = settings.onedrive_password
+        self.proxy = settings.onedrive_proxy
+        self.root_path = settings.onedrive_root_path.strip("/")
+        self._app = None
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_lock = asyncio.Lock()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def acquire_token_pwd(self):
+        """获取令牌，优先使用 MSAL 缓存中的刷新令牌，失败时再用账号密码登录"""
+        if self._app is None:
+            self._app = self.msal.PublicClientApplication(
+                authority=f"https://login.microsoftonline.com/{self.domain}", client_id=self.client_id
+            )
+        result = None
+        accounts = self._app.get_accounts(username=self.username)
+        if accounts:
+            result = self._app.acquire_token_silent(self.scopes, account=accounts[0])
+        if not result:
+            result = self._app.acquire_token_by_username_password(
+                username=self.username,
+                password=self.password,
+                scopes=self.scopes,
+            )
+        return result
+
+    async def _get_token(self, force: bool = False) -> str:
+        loop = asyncio.get_running_loop()
+        if not force and self._token and loop.time() < self._token_expires_at - self.token_refresh_margin:
+            return self._token
+        async with self._token_lock:
+            if not force and self._token and loop.time() < self._token_expires_at - self.token_refresh_margin:
+                return self._token
+            # MSAL 是同步库，只在令牌即将过期时调用一次，不占用线程池
+            result = await asyncio.to_thread(self.acquire_token_pwd)
+            if "access_token" not in result:
+                raise HTTPException(
+                    status_code=503,
+                    detail="OneDrive验证失败，请检查配置是否正确\n" + str(result.get("error_description", "")),
+                )
+            self._token = result["access_token"]
+            self._token_expires_at = loop.time() + int(result.get("expires_in", 3600))
+            return self._token
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method: str, url: str, **kwargs) -> aiohttp.ClientResponse:
+        """带令牌请求 Graph 接口，令牌失效时刷新后重试一次"""
+        session = self._get_session()
+        headers = kwargs.pop("headers", {})
+        for force in (False, True):
+            headers["Authorization"] = f"Bearer {await self._get_token(force)}"
+            resp = await session.request(method, url, headers=headers, **kwargs)
+            if resp.status != 401 or force:
+                return resp
+            resp.release()
+        return resp
+
+    @staticmethod
+    async def _raise_for_status(resp: aiohttp.ClientResponse, detail: str):
+        if resp.status >= 400:
+            content = await resp.text()
+            resp.release()
+            raise HTTPException(
+                status_code=404 if resp.status == 404 else 503, detail=f"{detail}: {content[:200]}"
+            )
+
+    def _get_path_str(self, path):
+        if isinstance(path, str):
+            path = path.replace("\\", "/").replace("//", "/").split("/")
+        elif isinstance(path, Path):
+            path = str(path).replace("\\", "/").replace("//", "/").split("/")
+        else:
+            raise TypeError("path must be str or Path")
+        path[-1] = path[-1].split(".")[0]
+        return "/".join(path)
+
+    def _item_url(self, path: str) -> str:
+        return f"{self.graph_url}/me/drive/root:/{quote(f'{self.root_path}/{path}')}:"
+
+    def _file_item_url(self, save_path: str) -> str:
+        """文件保存在以去掉扩展名的文件名命名的目录中: {目录}/{文件名}/{文件名.扩展名}"""
+        return self._item_url(self._get_path_str(save_path) + "/" + Path(save_path).name)
+
+    async def save_file(self, file: UploadFile, save_path: str):
+        item_url = self._file_item_url(save_path)
+        try:
+            if (file.size or 0) <= self.simple_upload_limit:
+                resp = await self._request(
+                    "PUT", f"{item_url}/content", data=await file.read(),
+                    headers={"Content-Type": "application/octet-stream"},
+                )
+                await self._raise_for_status(resp, "文件上传失败")
+                resp.release()
+                return
+            await self._upload_session(file, item_url)
+        except aiohttp.ClientError as e:
+            raise HTTPException(status_code=503, detail=f"OneDrive连接异常: {str(e)}")
+
+    async def _upload_session(self, file: UploadFile, item_url: str):
+        """通过上传会话分片上传大文件，单个分片失败时按服务端返回的进度续传"""
+        resp = await self._request(
+            "POST", f"{item_url}/createUploadSession",
+            json={"item": {"@microsoft.graph.conflictBehavior": "replace"}},
+        )
+        await self._raise_for_status(resp, "创建上传会话失败")
+        upload_url = (await resp.json())["uploadUrl"]
+        session = self._get_session()
+        total = file.size
+        offset = 0
+        await file.seek(0)
+        chunk = await file.read(self.upload_chunk_size)
+        retries = 0
+        try:
+            while chunk:
+                end = offset + len(chunk) - 1
+                # 上传地址已包含授权信息，不能再携带 Authorization 头
+                async with session.put(upload_url, data=chunk, headers={
+                    "Content-Length": str(len(chunk)),
+                    "Content-Range": f"bytes {offset}-{end}/{total}",
+                }) as resp:
+                    if resp.status in (200, 201, 202):
+                        offset = end + 1
+                        chunk = await file.read(self.upload_chunk_size)
+                        retries = 0
+                        continue
+                    if retries >= 3:
+                        raise HTTPException(status_code=503, detail=f"文件上传失败: {(await resp.text())[:200]}")
+                retries += 1
+                async with session.get(upload_url) as status:
+                    ranges = (await status.json()).get("nextExpectedRanges") or [f"{offset}-"]
+                expected = int(ranges[0].split("-")[0])
+                await file.seek(expected)
+                offset = expected
+                chunk = await file.read(self.upload_chunk_size)
+        except BaseException:
+            # 取消上传会话，释放服务端已接收的分片
+            try:
+                async with session.delete(upload_url):
+                    pass
+            except aiohttp.ClientError:
+                pass
+            raise
+
+    async def delete_file(self, file_code: FileCodes):
+        url = self._item_url(self._get_path_str(await file_code.get_file_path()))
+        try:
+            resp = await self._request("DELETE", url)
+            if resp.status != 404:
+                await self._raise_for_status(resp, "OneDrive删除失败")
+            resp.release()
+        except aiohttp.ClientError as e:
+            raise HTTPException(status_code=503, detail=f"OneDrive连接异常: {str(e)}")
+
+    def _convert_link_to_download_link(self, link):
+        p1 = re.search(r"https://(.+)\.sharepoint\.com", link).group(1)
+        p2 = re.search(r"personal/(.+)/", link).group(1)
+        p3 = re.search(rf"{p2}/(.+)", link).group(1)
+        return f"https://{p1}.sharepoint.com/personal/{p2}/_layouts/52/download.aspx?share={p3}"
+
+    async def _get_file_url(self, save_path):
+        expiration_datetime = datetime.datetime.now(
+            tz=datetime.timezone.utc
+        ) + datetime.timedelta(hours=1)
+        resp = await self._request("POST", f"{self._file_item_url(save_path)}/createLink", json={
+            "type": "view",
+            "scope": "anonymous",
+            "expirationDateTime": expiration_datetime.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        })
+        await self._raise_for_status(resp, "创建分享链接失败")
+        permission = await resp.json()
+        return self._convert_link_to_download_link(permission["link"]["webUrl"])
+
+    async def _get_download_url(self, save_path) -> str:
+        resp = await self._request(
+            "GET", self._file_item_url(save_path), params={"select": "id,@microsoft.graph.downloadUrl"}
+        )
+        await self._raise_for_status(resp, "文件获取失败")
+        return (await resp.json())["@microsoft.graph.downloadUrl"]
+
+    async def iter_file(self, file_code: FileCodes, chunk_size: int = 256 * 1024):
+        try:
+            download_url = await self._get_download_url(await file_code.get_file_path())
+            # 下载地址是预授权的临时链接，无需令牌
+            async with self._get_session().get(download_url) as resp:
+                if resp.status != 200:
+                    raise HTTPException(status_code=503, detail="服务代理下载异常，请稍后再试")
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    yield chunk
+        except aiohttp.ClientError:
+            raise HTTPException(status_code=503, detail="服务代理下载异常，请稍后再试")
+
+    async def get_file_response(self, file_code: FileCodes):
+        filename = file_code.prefix + file_code.suffix
+        body = await stream_coalescer.open(
+            f"onedrive:{self._file_item_url(await file_code.get_file_path())}",
+            lambda: self.iter_file(file_code),
+        )
+        return StreamingResponse(
+            body,
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename, safe='')}"},
+        )
+
+    async def get_file_url(self, file_code: FileCodes):
+        if self.proxy:
+            return await get_file_url(file_code.code)
+        else:
+            try:
+                return await self._get_file_url(await file_code.get_file_path())
+            except aiohttp.ClientError as e:
+                raise HTTPException(status_code=503, detail=f"OneDrive连接异常: {str(e)}")
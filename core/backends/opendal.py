@@ -0,0 +1,115 @@
+import hashlib
+from pathlib import Path
+from urllib.parse import quote
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+
+from apps.base.models import FileCodes, UploadChunk
+from core.logger import logger
+from core.settings import settings
+from core.storage import FileStorageInterface
+from core.stream import stream_coalescer
+from core.utils import get_file_url
+
+
+class OpenDALFileStorage(FileStorageInterface):
+    supports_chunk = True
+    settings_prefixes = ("opendal_",)
+
+    def __init__(self):
+        try:
+            import opendal
+        except ImportError:
+            raise ImportError('请先安装 `opendal`, 例如: "pip install opendal"')
+        self.service = settings.opendal_scheme
+        self.chunk_size = 256 * 1024
+        service_settings = {}
+        for key, value in settings.items():
+            if key.startswith("opendal_" + self.service):
+                setting_name = key.split("_", 2)[2]
+                service_settings[setting_name] = value
+        self.operator = opendal.AsyncOperator(
+            settings.opendal_scheme, **service_settings
+        )
+
+    async def save_file(self, file: UploadFile, save_path: str):
+        """从上传的临时文件分块读取并流式写入，不阻塞事件循环"""
+        await file.seek(0)
+        async with await self.operator.open(save_path, "wb") as writer:
+            while chunk := await file.read(self.chunk_size):
+                await writer.write(chunk)
+
+    async def delete_file(self, file_code: FileCodes):
+        await self.operator.delete(await file_code.get_file_path())
+
+    async def get_file_url(self, file_code: FileCodes):
+        return await get_file_url(file_code.code)
+
+    async def get_file_response(self, file_code: FileCodes):
+        """并发下载同一文件时共用一次读取，边读边发送"""
+        filename = file_code.prefix + file_code.suffix
+        body = await stream_coalescer.open(
+            f"opendal:{self.service}:{await file_code.get_file_path()}",
+            lambda: self.iter_file(file_code),
+        )
+        return StreamingResponse(
+            body,
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename, safe='')}"},
+        )
+
+    async def _iter_path(self, path: str, chunk_size: int):
+        """按块读取 path 中的数据"""
+        try:
+            file = await self.operator.open(path, "rb")
+        except Exception as e:
+            logger.info(e)
+            raise HTTPException(status_code=404, detail="文件已过期删除")
+        try:
+            # 部分服务在首次读取时才检查文件是否存在
+            try:
+                chunk = await file.read(chunk_size)
+            except Exception as e:
+                logger.info(e)
+                raise HTTPException(status_code=404, detail="文件已过期删除")
+            while chunk:
+                yield bytes(chunk)
+                chunk = await file.read(chunk_size)
+        finally:
+            await file.close()
+
+    async def iter_file(self, file_code: FileCodes, chunk_size: int = 256 * 1024):
+        async for chunk in self._iter_path(await file_code.get_file_path(), chunk_size):
+            yield chunk
+
+    @staticmethod
+    def _chunk_dir(upload_id: str, save_path: str) -> str:
+        return f"{Path(save_path).parent.as_posix()}/chunks/{upload_id}/"
+
+    async def save_chunk(self, upload_id: str, chunk_index: int, chunk_data: bytes, chunk_hash: str, save_path: str):
+        await self.operator.write(f"{self._chunk_dir(upload_id, save_path)}{chunk_index}.part", chunk_data)
+
+    async def merge_chunks(self, upload_id: str, chunk_info: UploadChunk, save_path: str) -> tuple[str, str]:
+        """逐个流式读取分片并写入目标文件，同时校验分片哈希"""
+        file_sha256 = hashlib.sha256()
+        chunk_dir = self._chunk_dir(upload_id, save_path)
+        chunk_hashes = dict(await UploadChunk.filter(
+            upload_id=upload_id, chunk_index__gte=0
+        ).values_list("chunk_index", "chunk_hash"))
+        async with await self.operator.open(save_path, "wb") as writer:
+            for i in range(chunk_info.total_chunks):
+                chunk_sha256 = hashlib.sha256()
+                async for data in self._iter_path(f"{chunk_dir}{i}.part", self.chunk_size):
+                    chunk_sha256.update(data)
+                    file_sha256.update(data)
+                    await writer.write(data)
+                if chunk_sha256.hexdigest() != chunk_hashes.get(i):
+                    raise ValueError(f"分片{i}哈希不匹配")
+        return save_path, file_sha256.hexdigest()
+
+    async def clean_chunks(self, upload_id: str, save_path: str):
+        try:
+            await self.operator.remove_all(self._chunk_dir(upload_id, save_path))
+        except Exception as e:
+            logger.info(f"清理 OpenDAL 分片时出错: {e}")
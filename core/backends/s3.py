@@ -0,0 +1,253 @@
+import asyncio
+import base64
+from typing import Optional
+from urllib.parse import quote
+
+import aioboto3
+import aiohttp
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import RedirectResponse, StreamingResponse
+
+from apps.base.models import FileCodes, UploadChunk
+from core.cache import TTLCache
+from core.logger import logger
+from core.metrics import s3_presign_requests
+from core.settings import settings
+from core.storage import FileStorageInterface
+from core.stream import stream_coalescer
+from core.utils import get_file_url
+
+
+class S3FileStorage(FileStorageInterface):
+    supports_chunk = True
+    # complete_multipart_upload 成功后 S3 自动清理 part
+    cleans_on_merge = True
+    # S3 要求除最后一个 part 外每个 part 至少 5MB，且最多 10000 个 part
+    min_chunk_size = 5 * 1024 * 1024
+    max_parts = 10000
+    settings_prefixes = ("s3_", "aws_")
+
+    def __init__(self):
+        self.access_key_id = settings.s3_access_key_id
+        self.secret_access_key = settings.s3_secret_access_key
+        self.bucket_name = settings.s3_bucket_name
+        self.s3_hostname = settings.s3_hostname
+        self.region_name = settings.s3_region_name
+        self.signature_version = settings.s3_signature_version
+        self.endpoint_url = settings.s3_endpoint_url or f"https://{self.s3_hostname}"
+        self.aws_session_token = settings.aws_session_token
+        self.proxy = settings.s3_proxy
+        self.session = aioboto3.Session(
+            aws_access_key_id=self.access_key_id,
+            aws_secret_access_key=self.secret_access_key,
+            aws_session_token=self.aws_session_token or None,
+        )
+        if not settings.s3_endpoint_url:
+            self.endpoint_url = f"https://{self.s3_hostname}"
+        else:
+            # 如果提供了 s3_endpoint_url，则优先使用它
+            self.endpoint_url = settings.s3_endpoint_url
+        self._client = None
+        self._client_context = None
+        self._client_lock = asyncio.Lock()
+        self._presigned_urls = TTLCache(settings.s3_presign_cache_size)
+
+    async def _get_client(self):
+        """获取长期复用的 S3 客户端"""
+        async with self._client_lock:
+            if self._client is None:
+                self._client_context = self.session.client(
+                    "s3",
+                    endpoint_url=self.endpoint_url,
+                    region_name=self.region_name,
+                    config=Config(signature_version=self.signature_version),
+                )
+                self._client = await self._client_context.__aenter__()
+            return self._client
+
+    async def close(self):
+        async with self._client_lock:
+            if self._client_context is not None:
+                await self._client_context.__aexit__(None, None, None)
+            self._client = None
+            self._client_context = None
+
+    async def _get_presigned_url(self, file_code: FileCodes) -> str:
+        """
+        获取对象的预签名下载链接
+
+        同一对象的链接缓存到过期前 s3_presign_refresh_margin 秒，热门分享码重复访问时无需重新签名
+        """
+        key = await file_code.get_file_path()
+        url = self._presigned_urls.get(key)
+        if url is not None:
+            s3_presign_requests.inc(result="hit")
+            return url
+        s3_presign_requests.inc(result="miss")
+        expires = int(settings.s3_presign_expires)
+        filename = file_code.prefix + file_code.suffix
+        s3 = await self._get_client()
+        url = await s3.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket_name,
+                "Key": key,
+                "ResponseContentDisposition": f"attachment; filename*=UTF-8''{quote(filename, safe='')}",
+            },
+            ExpiresIn=expires,
+        )
+        ttl = expires - min(int(settings.s3_presign_refresh_margin), expires // 2)
+        self._presigned_urls.set(key, url, ttl)
+        return url
+
+    async def _iter_url(self, key: str, url: str, chunk_size: int = 256 * 1024):
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as resp:
+                if resp.status == 404:
+                    raise HTTPException(status_code=404, detail="文件已过期删除")
+                if resp.status != 200:
+                    # 链接可能因密钥轮换等原因失效，下次重新签名
+                    self._presigned_urls.pop(key)
+                    raise HTTPException(status_code=503, detail="服务代理下载异常，请稍后再试")
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    yield chunk
+
+    async def save_file(self, file: UploadFile, save_path: str):
+        s3 = await self._get_client()
+        await s3.put_object(
+            Bucket=self.bucket_name,
+            Key=save_path,
+            Body=await file.read(),
+            ContentType=file.content_type,
+        )
+
+    async def delete_file(self, file_code: FileCodes):
+        key = await file_code.get_file_path()
+        s3 = await self._get_client()
+        await s3.delete_object(Bucket=self.bucket_name, Key=key)
+        self._presigned_urls.pop(key)
+
+    async def get_file_response(self, file_code: FileCodes):
+        try:
+            url = await self._get_presigned_url(file_code)
+        except Exception:
+            raise HTTPException(status_code=503, detail="服务代理下载异常，请稍后再试")
+        if settings.s3_redirect:
+            # 直接跳转到预签名链接，由 S3 提供下载流量
+            return RedirectResponse(url, status_code=302)
+        key = await file_code.get_file_path()
+        filename = file_code.prefix + file_code.suffix
+        try:
+            body = await stream_coalescer.open(f"s3:{self.bucket_name}:{key}", lambda: self._iter_url(key, url))
+        except aiohttp.ClientError:
+            raise HTTPException(status_code=503, detail="服务代理下载异常，请稍后再试")
+        return StreamingResponse(
+            body,
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename, safe='')}"},
+        )
+
+    async def iter_file(self, file_code: FileCodes, chunk_size: int = 256 * 1024):
+        s3 = await self._get_client()
+        try:
+            response = await s3.get_object(
+                Bucket=self.bucket_name, Key=await file_code.get_file_path()
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                raise HTTPException(status_code=404, detail="文件已过期删除")
+            raise HTTPException(status_code=503, detail="服务代理下载异常，请稍后再试")
+        async with response["Body"] as body:
+            async for chunk in body.iter_chunks(chunk_size):
+                yield chunk
+
+    async def get_file_url(self, file_code: FileCodes):
+        if self.proxy:
+            return await get_file_url(file_code.code)
+        else:
+            return await self._get_presigned_url(file_code)
+
+    async def init_chunk_upload(self, upload_id: str, save_path: str, total_chunks: int) -> Optional[str]:
+        """分片上传直接映射为 S3 multipart upload"""
+        if total_chunks > self.max_parts:
+            raise HTTPException(status_code=400, detail=f"分片数量不能超过{self.max_parts}")
+        s3 = await self._get_client()
+        response = await s3.create_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=save_path,
+            ContentType="application/octet-stream",
+            ChecksumAlgorithm="SHA256",
+        )
+        return response["UploadId"]
+
+    @staticmethod
+    async def _get_storage_upload_id(upload_id: str) -> str:
+        storage_upload_id = await UploadChunk.filter(
+            upload_id=upload_id, chunk_index=-1
+        ).first().values_list("storage_upload_id", flat=True)
+        if not storage_upload_id:
+            raise HTTPException(status_code=404, detail="上传会话不存在")
+        return storage_upload_id
+
+    async def save_chunk(self, upload_id: str, chunk_index: int, chunk_data: bytes, chunk_hash: str,
+                         save_path: str) -> Optional[str]:
+        """分片作为 part 直接上传，S3 按 ChecksumSHA256 校验内容"""
+        s3 = await self._get_client()
+        response = await s3.upload_part(
+            Bucket=self.bucket_name,
+            Key=save_path,
+            PartNumber=chunk_index + 1,
+            UploadId=await self._get_storage_upload_id(upload_id),
+            Body=chunk_data,
+            ChecksumSHA256=base64.b64encode(bytes.fromhex(chunk_hash)).decode(),
+        )
+        return response["ETag"]
+
+    async def merge_chunks(self, upload_id: str, chunk_info: UploadChunk, save_path: str) -> tuple[str, str]:
+        """
+        使用记录的 ETag 和分片校验和完成 multipart upload，不回读数据
+
+        S3 只能给出分片校验和的组合值，返回值中的文件哈希为客户端声明的哈希
+        """
+        chunks = await UploadChunk.filter(
+            upload_id=upload_id, chunk_index__gte=0, completed=True
+        ).order_by("chunk_index").values("chunk_index", "chunk_hash", "etag")
+        if len(chunks) != chunk_info.total_chunks or any(not chunk["etag"] for chunk in chunks):
+            raise HTTPException(status_code=400, detail="分片不完整")
+        s3 = await self._get_client()
+        try:
+            await s3.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=save_path,
+                UploadId=chunk_info.storage_upload_id or await self._get_storage_upload_id(upload_id),
+                MultipartUpload={"Parts": [
+                    {
+                        "PartNumber": chunk["chunk_index"] + 1,
+                        "ETag": chunk["etag"],
+                        "ChecksumSHA256": base64.b64encode(bytes.fromhex(chunk["chunk_hash"])).decode(),
+                    }
+                    for chunk in chunks
+                ]},
+            )
+        except ClientError as e:
+            raise HTTPException(status_code=400, detail=f"分片合并失败: {e.response.get('Error', {}).get('Message', '')}")
+        return save_path, chunk_info.chunk_hash
+
+    async def clean_chunks(self, upload_id: str, save_path: str):
+        """
+        终止未完成的 multipart upload，用于清理过期会话和合并失败的上传
+        :param upload_id: 上传会话ID
+        :param save_path: 文件保存路径
+        """
+        try:
+            s3 = await self._get_client()
+            await s3.abort_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=save_path,
+                UploadId=await self._get_storage_upload_id(upload_id),
+            )
+        except (ClientError, HTTPException) as e:
+            # 上传已完成或会话不存在
+            logger.info(f"清理 S3 分片时出错: {e}")
@@ -0,0 +1,333 @@
+import asyncio
+import hashlib
+import re
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote, unquote
+
+import aiohttp
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+
+from apps.base.models import FileCodes, UploadChunk
+from core.logger import logger
+from core.settings import settings
+from core.storage import FileStorageInterface
+from core.stream import stream_coalescer
+from core.utils import get_file_url, sanitize_filename
+
+
+class WebDAVFileStorage(FileStorageInterface):
+    supports_chunk = True
+    settings_prefixes = ("webdav_",)
+
+    def __init__(self):
+        self.base_url = settings.webdav_url.rstrip("/") + "/"
+        self.auth = aiohttp.BasicAuth(
+            login=settings.webdav_username, password=settings.webdav_password
+        )
+        self._partial_update: Optional[bool] = None
+
+    def _build_url(self, path: str) -> str:
+        encoded_path = quote(str(path.replace("\\", "/").lstrip("/")).lstrip("/"))
+        return f"{self.base_url}{encoded_path}"
+
+    async def _mkdir_p(self, directory_path: str):
+        """递归创建目录（类似mkdir -p）"""
+        path_obj = Path(unquote(directory_path))
+        current_path = ""
+
+        async with aiohttp.ClientSession(auth=self.auth) as session:
+            # 逐级检查目录是否存在
+            for part in path_obj.parts:
+                current_path = str(Path(current_path) / part)
+                url = self._build_url(current_path)
+
+                # 检查目录是否存在
+                async with session.head(url) as resp:
+                    if resp.status == 404:
+                        # 创建目录
+                        async with session.request("MKCOL", url) as mkcol_resp:
+                            if mkcol_resp.status not in (200, 201, 409):
+                                content = await mkcol_resp.text()
+                                raise HTTPException(
+                                    status_code=mkcol_resp.status,
+                                    detail=f"目录创建失败: {content[:200]}",
+                                )
+
+    async def _is_dir_empty(self, dir_path: str) -> bool:
+        """检查目录是否为空"""
+        url = self._build_url(dir_path)
+
+        async with aiohttp.ClientSession(auth=self.auth) as session:
+            async with session.request("PROPFIND", url, headers={"Depth": "1"}) as resp:
+                if resp.status != 207:  # 207 是 Multi-Status 响应
+                    return False
+                content = await resp.text()
+                # 如果只有一个 response（当前目录），说明目录为空
+                return content.count("<D:response>") <= 1
+
+    async def _delete_empty_dirs(self, file_path: str, session: aiohttp.ClientSession):
+        """递归删除空目录"""
+        path_obj = Path(file_path)
+        current_path = path_obj.parent
+
+        while str(current_path) != ".":
+            if not await self._is_dir_empty(str(current_path)):
+                break
+
+            url = self._build_url(str(current_path))
+            async with session.delete(url) as resp:
+                if resp.status not in (200, 204, 404):
+                    break
+
+            current_path = current_path.parent
+
+    async def save_file(self, file: UploadFile, save_path: str):
+        """保存文件（自动创建目录）"""
+        path_obj = Path(save_path)
+        directory_path = str(path_obj.parent)
+        # 提取原始文件名并进行清理
+        filename = await sanitize_filename(path_obj.name)
+        # 构建安全的保存路径
+        safe_save_path = str(Path(directory_path) / filename)
+
+        try:
+            # 先创建目录结构
+            await self._mkdir_p(directory_path)
+            # 上传文件
+            url = self._build_url(safe_save_path)
+            async with aiohttp.ClientSession(auth=self.auth) as session:
+                content = await file.read()
+                async with session.put(
+                        url, data=content, headers={
+                            "Content-Type": file.content_type}
+                ) as resp:
+                    if resp.status not in (200, 201, 204):
+                        content = await resp.text()
+                        raise HTTPException(
+                            status_code=resp.status,
+                            detail=f"文件上传失败: {content[:200]}",
+                        )
+        except aiohttp.ClientError as e:
+            raise HTTPException(
+                status_code=503, detail=f"WebDAV连接异常: {str(e)}")
+
+    async def delete_file(self, file_code: FileCodes):
+        """删除WebDAV文件及空目录"""
+        file_path = await file_code.get_file_path()
+        url = self._build_url(file_path)
+        try:
+            async with aiohttp.ClientSession(auth=self.auth) as session:
+                # 删除文件
+                async with session.delete(url) as resp:
+                    if resp.status not in (200, 204, 404):
+                        content = await resp.text()
+                        raise HTTPException(
+                            status_code=resp.status,
+                            detail=f"WebDAV删除失败: {content[:200]}",
+                        )
+
+                # 使用同一个 session 删除空目录
+                await self._delete_empty_dirs(file_path, session)
+
+        except aiohttp.ClientError as e:
+            raise HTTPException(
+                status_code=503, detail=f"WebDAV连接异常: {str(e)}")
+
+    async def get_file_url(self, file_code: FileCodes):
+        return await get_file_url(file_code.code)
+
+    async def get_file_response(self, file_code: FileCodes):
+        """获取文件响应（代理模式），并发下载同一文件时共用一次上游请求，边读边发送"""
+        filename = file_code.prefix + file_code.suffix
+        body = await stream_coalescer.open(
+            self._build_url(await file_code.get_file_path()), lambda: self.iter_file(file_code)
+        )
+        return StreamingResponse(
+            body,
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename, safe='')}"},
+        )
+
+    async def iter_file(self, file_code: FileCodes, chunk_size: int = 256 * 1024):
+        url = self._build_url(await file_code.get_file_path())
+        try:
+            async with aiohttp.ClientSession(auth=self.auth) as session:
+                async with session.get(url) as resp:
+                    if resp.status != 200:
+                        raise HTTPException(
+                            status_code=404 if resp.status == 404 else 503,
+                            detail=f"文件获取失败{resp.status}",
+                        )
+                    async for chunk in resp.content.iter_chunked(chunk_size):
+                        yield chunk
+        except aiohttp.ClientError as e:
+            raise HTTPException(
+                status_code=503, detail=f"WebDAV连接异常: {str(e)}")
+
+    async def save_chunk(self, upload_id: str, chunk_index: int, chunk_data: bytes, chunk_hash: str, save_path: str):
+        chunk_dir = str(Path(save_path).parent / "chunks" / upload_id)
+        chunk_url = self._build_url(f"{chunk_dir}/{chunk_index}.part")
+        try:
+            async with aiohttp.ClientSession(auth=self.auth) as session:
+                resp = await session.put(chunk_url, data=chunk_data)
+                if resp.status == 409:
+                    # 父目录不存在，创建后重试
+                    resp.release()
+                    await self._mkdir_p(chunk_dir)
+                    resp = await session.put(chunk_url, data=chunk_data)
+                async with resp:
+                    if resp.status not in (200, 201, 204):
+                        raise HTTPException(
+                            status_code=resp.status,
+                            detail=f"分片上传失败: {(await resp.text())[:200]}",
+                        )
+        except aiohttp.ClientError as e:
+            raise HTTPException(
+                status_code=503, detail=f"WebDAV连接异常: {str(e)}")
+
+    async def _supports_partial_update(self, session: aiohttp.ClientSession) -> bool:
+        """检查服务端是否支持 SabreDAV 的 PATCH 追加写入，结果缓存在实例上"""
+        if self._partial_update is None:
+            try:
+                async with session.options(self.base_url) as resp:
+                    self._partial_update = "sabredav-partialupdate" in resp.headers.get("DAV", "")
+            except aiohttp.ClientError:
+                self._partial_update = False
+        return self._partial_update
+
+    async def _fetch_chunk(self, session: aiohttp.ClientSession, url: str, chunk_index: int,
+                           chunk_hash: Optional[str]) -> bytes:
+        async with session.get(url) as resp:
+            if resp.status != 200:
+                raise HTTPException(status_code=400, detail=f"分片{chunk_index}读取失败: {resp.status}")
+            data = await resp.read()
+        if hashlib.sha256(data).hexdigest() != chunk_hash:
+            raise HTTPException(status_code=400, detail=f"分片{chunk_index}哈希不匹配")
+        return data
+
+    async def _iter_chunks(self, session: aiohttp.ClientSession, upload_id: str, chunk_info: UploadChunk,
+                           save_path: str):
+        """按顺序读取并校验分片，调用方写入当前分片时后台预取下一个分片"""
+        chunk_dir = str(Path(save_path).parent / "chunks" / upload_id)
+        chunk_hashes = dict(await UploadChunk.filter(
+            upload_id=upload_id, chunk_index__gte=0
+        ).values_list("chunk_index", "chunk_hash"))
+
+        def fetch(i: int) -> asyncio.Task:
+            url = self._build_url(f"{chunk_dir}/{i}.part")
+            return asyncio.create_task(self._fetch_chunk(session, url, i, chunk_hashes.get(i)))
+
+        next_task: Optional[asyncio.Task] = fetch(0)
+        try:
+            for i in range(chunk_info.total_chunks):
+                data = await next_task
+                next_task = fetch(i + 1) if i + 1 < chunk_info.total_chunks else None
+                yield data
+        finally:
+            if next_task is not None:
+                next_task.cancel()
+
+    async def merge_chunks(self, upload_id: str, chunk_info: UploadChunk, save_path: str) -> tuple[str, str]:
+        """
+        合并分片
+
+        服务端支持 SabreDAV partial update 时创建空文件并逐片 PATCH 追加，否则把所有分片拼接成一个流式 PUT。
+        两种方式都只在内存中保留当前分片和预取的下一个分片，并按实际内容校验分片哈希。
+        """
+        file_sha256 = hashlib.sha256()
+        output_url = self._build_url(save_path)
+        try:
+            async with aiohttp.ClientSession(auth=self.auth) as session:
+                chunks = self._iter_chunks(session, upload_id, chunk_info, save_path)
+                try:
+                    if await self._supports_partial_update(session):
+                        async with session.put(output_url, data=b"") as resp:
+                            if resp.status not in (200, 201, 204):
+                                raise HTTPException(status_code=resp.status, detail="创建合并文件失败")
+                        async for data in chunks:
+                            file_sha256.update(data)
+                            async with session.patch(output_url, data=data, headers={
+                                "Content-Type": "application/x-sabredav-partialupdate",
+                                "X-Update-Range": "append",
+                            }) as resp:
+                                if resp.status not in (200, 204):
+                                    raise HTTPException(
+                                        status_code=resp.status,
+                                        detail=f"分片合并失败: {(await resp.text())[:200]}",
+                                    )
+                    else:
+                        errors = []
+
+                        async def body():
+                            try:
+                                async for data in chunks:
+                                    file_sha256.update(data)
+                                    yield data
+                            except Exception as e:
+                                errors.append(e)
+                                raise
+
+                        try:
+                            async with session.put(output_url, data=body(), headers={
+                                "Content-Type": "application/octet-stream"
+                            }) as resp:
+                                if resp.status not in (200, 201, 204):
+                                    raise HTTPException(
+                                        status_code=resp.status,
+                                        detail=f"分片合并失败: {(await resp.text())[:200]}",
+                                    )
+                        except aiohttp.ClientError:
+                            # 读取分片出错时 aiohttp 会中断请求，抛出原始错误
+                            if errors:
+                                raise errors[0]
+                            raise
+                except BaseException:
+                    # 删除未合并完成的文件
+                    try:
+                        async with session.delete(output_url):
+                            pass
+                    except aiohttp.ClientError:
+                        pass
+                    raise
+                finally:
+                    await chunks.aclose()
+        except aiohttp.ClientError as e:
+            raise HTTPException(
+                status_code=503, detail=f"WebDAV连接异常: {str(e)}")
+        return save_path, file_sha256.hexdigest()
+
+    async def clean_chunks(self, upload_id: str, save_path: str):
+        """
+        清理 WebDAV 上的临时分片文件
+        :param upload_id: 上传会话ID
+        :param save_path: 文件保存路径
+        """
+        chunk_dir = str(Path(save_path).parent / "chunks" / upload_id)
+        chunk_dir_url = self._build_url(chunk_dir)
+        async with aiohttp.ClientSession(auth=self.auth) as session:
+            try:
+                # 检查分片目录是否存在
+                async with session.request("PROPFIND", chunk_dir_url, headers={"Depth": "1"}) as resp:
+                    if resp.status == 207:  # 207 表示 Multi-Status
+                        # 获取目录下的所有分片文件
+                        xml_data = await resp.text()
+                        file_paths = re.findall(
+                            r'<D:href>(.*?)</D:href>', xml_data)
+                        for file_path in file_paths:
+                            if file_path.endswith(".part"):
+                                # 删除分片文件
+                                file_url = self._build_url(file_path)
+                                async with session.delete(file_url) as delete_resp:
+                                    if delete_resp.status not in (200, 204, 404):
+                                        logger.info(f"删除分片文件失败: {file_path}")
+
+                        # 删除分片目录
+                        async with session.delete(chunk_dir_url) as delete_resp:
+                            if delete_resp.status not in (200, 204, 404):
+                                logger.info(f"删除分片目录失败: {chunk_dir_url}")
+                    else:
+                        logger.info(f"分片目录不存在: {chunk_dir_url}")
+            except Exception as e:
+                logger.info(f"清理 WebDAV 分片时出错: {e}")
@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, Optional, Tuple
+
+import aiofiles
+
+from core.logger import logger
+from core.metrics import storage_cache_bytes, storage_cache_requests
+from core.settings import data_root
+
+
+class DiskCache:
+    """
+    本地磁盘热缓存（LRU）
+
+    以对象路径为键，把远程存储下载的文件保存在 root 目录下，总大小超过 max_size 时
+    淘汰最久未访问的文件。同一对象并发未命中时只回源一次，其余请求等待同一次回源完成。
+    """
+
+    def __init__(self, root: Path, max_size: int):
+        self.root = root
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.total = 0
+        self.loaded = False
+        self._inflight: Dict[str, asyncio.Future] = {}
+        storage_cache_bytes.set_function(lambda: {(): self.total})
+
+    @staticmethod
+    def digest(key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def _scan(self):
+        """启动后首次使用时扫描缓存目录重建索引，按修改时间排序"""
+        files = []
+        if self.root.exists():
+            for sub in self.root.iterdir():
+                if not sub.is_dir():
+                    continue
+                for item in sub.iterdir():
+                    if item.name.endswith(".tmp"):
+                        item.unlink(missing_ok=True)
+                        continue
+                    stat = item.stat()
+                    files.append((stat.st_mtime, item.name, stat.st_size))
+        for _, digest, size in sorted(files):
+            self.entries[digest] = size
+            self.total += size
+
+    async def load(self):
+        if not self.loaded:
+            self.loaded = True
+            await asyncio.to_thread(self._scan)
+            await self._evict()
+
+    def get(self, key: str) -> Optional[Path]:
+        digest = self.digest(key)
+        if digest not in self.entries:
+            return None
+        path = self.path(digest)
+        if not path.exists():
+            self.total -= self.entries.pop(digest)
+            return None
+        self.entries.move_to_end(digest)
+        return path
+
+    async def fetch(self, key: str, fill: Callable[[], AsyncIterator[bytes]]) -> Path:
+        """
+        获取缓存文件路径，未命中时调用 fill 回源并写入缓存
+        :param key: 对象路径
+        :param fill: 返回对象内容异步迭代器的函数
+        """
+        await self.load()
+        path = self.get(key)
+        if path is not None:
+            storage_cache_requests.inc(result="hit")
+            return path
+        digest = self.digest(key)
+        future = self._inflight.get(digest)
+        if future is not None:
+            storage_cache_requests.inc(result="coalesced")
+            return await asyncio.shield(future)
+
+        storage_cache_requests.inc(result="miss")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[digest] = future
+        try:
+            path = await self._fill(digest, fill)
+            future.set_result(path)
+            return path
+        except BaseException as e:
+            future.set_exception(e)
+            # 避免没有其他等待者时出现 "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(digest, None)
+
+    async def _fill(self, digest: str, fill: Callable[[], AsyncIterator[bytes]]) -> Path:
+        path = self.path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{digest}.{uuid.uuid4().hex}.tmp")
+        size = 0
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                async for chunk in fill():
+                    size += len(chunk)
+                    await f.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        self.entries[digest] = size
+        self.total += size
+        await self._evict(keep=digest)
+        return path
+
+    async def _evict(self, keep: Optional[str] = None):
+        while self.total > self.max_size and self.entries:
+            digest, size = next(iter(self.entries.items()))
+            if digest == keep:
+                if len(self.entries) == 1:
+                    break
+                self.entries.move_to_end(digest)
+                continue
+            self.entries.pop(digest)
+            self.total -= size
+            try:
+                self.path(digest).unlink(missing_ok=True)
+            except OSError as e:
+                logger.info(f"删除缓存文件失败: {e}")
+
+    def invalidate(self, key: str):
+        digest = self.digest(key)
+        size = self.entries.pop(digest, None)
+        if size is not None:
+            self.total -= size
+        self.path(digest).unlink(missing_ok=True)
+
+
+class TTLCache:
+    """
+    带过期时间的内存 LRU 缓存
+
+    超过 maxsize 条时淘汰最久未访问的条目，过期条目在访问时删除
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Any:
+        item = self.data.get(key)
+        if item is None:
+            return None
+        if item[0] <= time.monotonic():
+            del self.data[key]
+            return None
+        self.data.move_to_end(key)
+        return item[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        self.data[key] = (time.monotonic() + ttl, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self.data.pop(key, None)
+
+    def clear(self):
+        self.data.clear()
+
+
+disk_cache = DiskCache(data_root / "cache", 0)
@@ -0,0 +1,284 @@
+import asyncio
+import bisect
+import functools
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from core.logger import logger
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List["Metric"] = []
+
+    def register(self, metric: "Metric"):
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self.values.items()
+        ]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+        self.function: Optional[Callable[[], Dict[LabelValues, float]]] = None
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], Dict[LabelValues, float]]):
+        """采集时调用 function 获取 {标签值元组: 数值}"""
+        self.function = function
+
+    def samples(self) -> List[str]:
+        values = dict(self.values)
+        if self.function is not None:
+            try:
+                values.update(self.function())
+            except Exception as e:
+                logger.error(f"采集指标 {self.name} 失败: {e}")
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values.items()
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签: [各桶计数..., 总和, 总数]
+        self.values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        data = self.values.get(key)
+        if data is None:
+            data = self.values[key] = [0] * (len(self.buckets) + 2)
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            data[index] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        names = self.labelnames + ("le",)
+        for key, data in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(names, key + ('+Inf',))} {_format_value(data[-1])}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(data[-2])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(data[-1])}")
+        return lines
+
+
+http_request_duration = Histogram(
+    "filecodebox_http_request_duration_seconds", "HTTP 请求耗时", ("method", "route", "status")
+)
+storage_operation_duration = Histogram(
+    "filecodebox_storage_operation_duration_seconds", "存储操作耗时", ("backend", "method")
+)
+storage_operation_bytes = Counter(
+    "filecodebox_storage_operation_bytes_total", "存储操作传输字节数", ("backend", "method")
+)
+storage_operation_errors = Counter(
+    "filecodebox_storage_operation_errors_total", "存储操作失败次数", ("backend", "method")
+)
+db_query_duration = Histogram(
+    "filecodebox_db_query_duration_seconds", "数据库查询耗时", ("operation",)
+)
+expire_sweep_duration = Histogram(
+    "filecodebox_expire_sweep_duration_seconds", "过期文件清理耗时",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+rate_limit_rejections = Counter(
+    "filecodebox_rate_limit_rejections_total", "IP 限流拒绝次数", ("limiter",)
+)
+event_loop_lag = Histogram(
+    "filecodebox_event_loop_lag_seconds", "事件循环调度延迟",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+code_pool_occupancy = Gauge(
+    "filecodebox_code_pool_occupancy_ratio", "当前长度分享码占用率", ("style",)
+)
+storage_cache_requests = Counter(
+    "filecodebox_storage_cache_requests_total", "本地热缓存访问次数", ("result",)
+)
+storage_stream_requests = Counter(
+    "filecodebox_storage_stream_requests_total", "代理下载上游读取与合并次数", ("result",)
+)
+s3_presign_requests = Counter(
+    "filecodebox_s3_presign_requests_total", "S3 预签名链接缓存访问次数", ("result",)
+)
+storage_cache_bytes = Gauge("filecodebox_storage_cache_bytes", "本地热缓存占用字节数")
+storage_migration_files = Counter(
+    "filecodebox_storage_migration_files_total", "存储迁移处理的文件数", ("result",)
+)
+storage_migration_bytes = Counter("filecodebox_storage_migration_bytes_total", "存储迁移复制的字节数")
+download_bytes = Counter("filecodebox_download_bytes_total", "文件下载发送的字节数")
+download_throughput = Gauge("filecodebox_download_throughput_bytes", "最近几秒的平均下载速度（字节/秒）")
+downloads_active = Gauge("filecodebox_downloads_active", "进行中的文件下载数")
+download_throttle_seconds = Counter("filecodebox_download_throttle_seconds_total", "下载因限速等待的总秒数")
+
+
+def response_size(response) -> int:
+    try:
+        if "content-length" in response.headers:
+            return int(response.headers["content-length"])
+        # FileResponse 在发送时才设置 Content-Length
+        path = getattr(response, "path", None)
+        return os.path.getsize(path) if path else 0
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+
+# 存储方法 -> 从调用参数或返回值中取得传输字节数
+storage_bytes_getters: Dict[str, Callable] = {
+    "save_file": lambda args, result: getattr(args[0], "size", None) or 0,
+    "save_chunk": lambda args, result: len(args[2]),
+    "merge_chunks": lambda args, result: args[1].file_size,
+    "get_file_response": lambda args, result: response_size(result),
+}
+
+
+def instrument_storage_method(backend: str, method: str, func: Callable) -> Callable:
+    """记录存储方法的耗时、传输字节数和失败次数"""
+    bytes_getter = storage_bytes_getters.get(method)
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = await func(self, *args, **kwargs)
+        except Exception:
+            storage_operation_errors.inc(backend=backend, method=method)
+            raise
+        finally:
+            storage_operation_duration.observe(time.perf_counter() - start, backend=backend, method=method)
+        if bytes_getter is not None:
+            try:
+                storage_operation_bytes.inc(bytes_getter(args, result), backend=backend, method=method)
+            except (AttributeError, IndexError, TypeError):
+                pass
+        return result
+
+    return wrapper
+
+
+def instrument_db_client(client):
+    """记录数据库连接上各类查询的耗时"""
+    for operation in ("execute_query", "execute_query_dict", "execute_insert", "execute_select",
+                      "execute_many", "execute_script"):
+        func = getattr(client, operation, None)
+        if func is None:
+            continue
+
+        def wrap(func, operation):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with db_query_duration.time(operation=operation):
+                    return await func(*args, **kwargs)
+
+            return wrapper
+
+        setattr(client, operation, wrap(func, operation))
+
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """定时休眠并记录实际唤醒时间与预期的偏差"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        event_loop_lag.observe(max(loop.time() - start - interval, 0))
@@ -0,0 +1,186 @@
+import asyncio
+import gzip
+import time
+from typing import Callable, Dict
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.metrics import http_request_duration
+from core.static import negotiate_encoding
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _gzip(data: bytes, level: int) -> bytes:
+    return gzip.compress(data, level, mtime=0)
+
+
+def _brotli(data: bytes, level: int) -> bytes:
+    # brotli 的质量范围为 0-11，动态响应使用中等质量即可
+    return brotli.compress(data, quality=min(level, 11))
+
+
+def _zstd(data: bytes, level: int) -> bytes:
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def get_encoders() -> Dict[str, Callable[[bytes, int], bytes]]:
+    encoders = {"gzip": _gzip}
+    if brotli is not None:
+        encoders["br"] = _brotli
+    if zstandard is not None:
+        encoders["zstd"] = _zstd
+    return encoders
+
+
+class CompressionMiddleware:
+    """
+    动态响应压缩中间件
+
+    只压缩 JSON、文本等可压缩类型，跳过已带 Content-Encoding 的响应（首页、静态资源已预压缩）
+    以及文件下载（附件、二进制类型、分段响应）。响应体小于 minimum_size 时不压缩，
+    超过 offload_size 时在线程中压缩，避免阻塞事件循环；
+    流式响应累计超过 max_buffer_size 后不再缓冲，按原样输出。
+    """
+
+    compressible_types = ("application/json", "text/", "application/javascript", "application/xml")
+    preference = ("zstd", "br", "gzip")
+
+    def __init__(
+            self,
+            app: ASGIApp,
+            minimum_size: int = 1024,
+            offload_size: int = 64 * 1024,
+            max_buffer_size: int = 4 * 1024 * 1024,
+            level: int = 6,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.offload_size = offload_size
+        self.max_buffer_size = max_buffer_size
+        self.level = level
+        self.encoders = get_encoders()
+
+    def should_compress(self, status: int, headers: Headers) -> bool:
+        if status < 200 or status in (204, 206, 304):
+            return False
+        if "content-encoding" in headers or "content-range" in headers:
+            return False
+        if "attachment" in headers.get("content-disposition", ""):
+            return False
+        return headers.get("content-type", "").startswith(self.compressible_types)
+
+    async def compress(self, encoding: str, body: bytes) -> bytes:
+        encoder = self.encoders[encoding]
+        if len(body) > self.offload_size:
+            return await asyncio.to_thread(encoder, body, self.level)
+        return encoder(body, self.level)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(
+            Headers(scope=scope).get("accept-encoding", ""), self.encoders, self.preference
+        )
+        if encoding == "identity":
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Message = {}
+        chunks = []
+        buffered = 0
+        passthrough = False
+
+        async def send_compressed(message: Message):
+            nonlocal start_message, buffered, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                if not self.should_compress(message["status"], Headers(raw=message["headers"])):
+                    passthrough = True
+                    await send(message)
+                    return
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            chunks.append(body)
+            buffered += len(body)
+            more_body = message.get("more_body", False)
+            if more_body and buffered <= self.max_buffer_size:
+                return
+            content = b"".join(chunks)
+            chunks.clear()
+            if more_body or len(content) < self.minimum_size:
+                # 流式响应过大或响应体过小，按原样输出
+                passthrough = True
+                await send(start_message)
+                await send({"type": "http.response.body", "body": content, "more_body": more_body})
+                return
+
+            compressed = await self.compress(encoding, content)
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
+
+
+class MetricsMiddleware:
+    """
+    记录每个路由的请求耗时
+
+    路由标签使用路由模板（如 /chunk/upload/chunk/{upload_id}/{chunk_index}），
+    挂载的静态目录使用挂载路径，未匹配的请求统一记为 unmatched，避免扫描器制造大量标签。
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        root_path = scope.get("root_path", "")
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            if route is not None:
+                label = route.path
+            elif scope.get("root_path", "") != root_path:
+                label = scope["root_path"]
+            else:
+                label = "unmatched"
+            http_request_duration.observe(
+                time.perf_counter() - start, method=scope["method"], route=label, status=str(status)
+            )
@@ -3,6 +3,8 @@
 # @File    : settings.py
 # @Software: PyCharm
 from pathlib import Path
+from types import MappingProxyType
+from typing import Callable
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 data_root = BASE_DIR / "data"
@@ -27,6 +29,10 @@ DEFAULT_CONFIG = {
     "s3_signature_version": "s3v2",
     "s3_hostname": "",
     "s3_proxy": 0,
+    "s3_redirect": 0,
+    "s3_presign_expires": 3600,
+    "s3_presign_refresh_margin": 300,
+    "s3_presign_cache_size": 10000,
     "max_save_seconds": 0,
     "aws_session_token": "",
     "onedrive_domain": "",
@@ -44,6 +50,7 @@ DEFAULT_CONFIG = {
     "expireStyle": ["day", "hour", "minute", "forever", "count"],
     "uploadMinute": 1,
     "enableChunk": 0,
+    "chunk_session_ttl": 24 * 60 * 60,
     "webdav_url": "",
     "webdav_password": "",
     "webdav_username": "",
@@ -70,31 +77,86 @@ DEFAULT_CONFIG = {
     "port": 12345,
     "showAdminAddr": 0,
     "robotsText": "User-agent: *\nDisallow: /",
+    "metrics_token": "",
+    "storage_cache_enable": 0,
+    "storage_cache_size": 1024 * 1024 * 1024,
+    "storage_cache_max_file_size": 1024 * 1024 * 100,
+    # 存储配置变化后，旧实例等待进行中操作完成的最长秒数
+    "storage_drain_timeout": 30,
+    # 按文件大小和有效期选择存储的规则，按顺序匹配第一条，都不匹配时使用 file_storage
+    # 规则可包含 min_size / max_size（字节）、min_expire_seconds / max_expire_seconds（有效期秒数）和 storage，
+    # 例如 [{"max_size": 1048576, "storage": "local"}, {"storage": "s3"}]
+    "storage_policy": [],
+    # 存储迁移默认的并发文件数和带宽上限（字节/秒，0 表示不限速）
+    "storage_migration_concurrency": 4,
+    "storage_migration_bandwidth": 0,
+    # 文件下载的带宽上限（字节/秒，0 表示不限速），分别作用于全部下载、每个 IP、每个分享码
+    "download_rate_global": 0,
+    "download_rate_per_ip": 0,
+    "download_rate_per_code": 0,
+    # 每个 IP 同时进行的下载数上限，0 表示不限制
+    "download_max_per_ip": 0,
+    # 检查数据库中配置版本号的间隔秒数，多进程或多节点部署时据此同步后台修改的配置
+    "config_poll_interval": 5,
 }
 
 
 class Settings:
+    """
+    配置
+
+    读取访问合并了默认配置与用户配置的只读快照，修改时生成新快照整体替换。
+    快照中的配置值同时作为实例属性，读取时直接命中实例字典，不经过 __getattr__。
+    version 为数据库中的配置版本号，各进程据此判断是否需要重新加载配置。
+    """
+    # 实例自身的属性，其余实例属性都是配置值
+    _fields = ("default_config", "user_config", "version", "_hooks", "_snapshot")
+
     def __init__(self, defaults=None):
-        self.default_config = defaults or {}
-        self.user_config = {}
+        super().__setattr__("default_config", defaults or {})
+        super().__setattr__("user_config", {})
+        super().__setattr__("version", 0)
+        super().__setattr__("_hooks", [])
+        self._rebuild()
+
+    def _rebuild(self):
+        snapshot = MappingProxyType({**self.default_config, **self.user_config})
+        state = {name: self.__dict__[name] for name in self._fields if name in self.__dict__}
+        state["_snapshot"] = snapshot
+        # 与方法或内部属性同名的配置项只能通过 items() 读取
+        state.update(
+            (key, value) for key, value in snapshot.items()
+            if key not in self._fields and not hasattr(Settings, key)
+        )
+        super().__setattr__("__dict__", state)
 
     def __getattr__(self, attr):
-        if attr in self.user_config:
-            return self.user_config[attr]
-        if attr in self.default_config:
-            return self.default_config[attr]
         raise AttributeError(
             f"'{self.__class__.__name__}' object has no attribute '{attr}'"
         )
 
     def __setattr__(self, key, value):
-        if key in ["default_config", "user_config"]:
+        if key in ["default_config", "user_config", "version"]:
             super().__setattr__(key, value)
         else:
             self.user_config[key] = value
+        if key != "version":
+            self._rebuild()
 
     def items(self):
-        return {**self.default_config, **self.user_config}.items()
+        return self._snapshot.items()
+
+    def on_change(self, hook: Callable[[], None]):
+        """注册配置加载后的回调，如更新限流参数、重新渲染首页"""
+        self._hooks.append(hook)
+
+    def load(self, user_config: dict, version: int = 0):
+        """替换用户配置并生成新快照，随后依次调用回调"""
+        super().__setattr__("user_config", dict(user_config))
+        super().__setattr__("version", version)
+        self._rebuild()
+        for hook in self._hooks:
+            hook()
 
 
 settings = Settings(DEFAULT_CONFIG)
@@ -0,0 +1,231 @@
+import asyncio
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import stat
+from typing import Dict, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.types import Scope
+
+from core.settings import BASE_DIR, settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def compress_variants(content: bytes) -> Dict[str, bytes]:
+    """
+    预先生成内容的压缩版本
+    :param content: 原始内容
+    :return: {编码: 内容}，始终包含 identity
+    """
+    variants = {"identity": content, "gzip": gzip.compress(content, 9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(content)
+    return variants
+
+
+def negotiate_encoding(accept_encoding: str, available, preference=("br", "gzip")) -> str:
+    """
+    根据 Accept-Encoding 选择编码，按 preference 顺序优先，都不接受时返回 identity
+    """
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    for encoding in preference:
+        q = accepted.get(encoding, accepted.get("*", 0))
+        if encoding in available and q > 0:
+            return encoding
+    return "identity"
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    return if_none_match(request.headers, etag)
+
+
+def if_none_match(headers: Headers, etag: str) -> bool:
+    if_none_match = headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+class IndexPage:
+    """
+    首页缓存
+
+    加载配置和修改配置后渲染一次主题的 index.html，并预先生成压缩版本，
+    请求时直接从内存返回，客户端携带 If-None-Match 时返回 304。
+    """
+
+    def __init__(self):
+        self.variants: Dict[str, bytes] = {}
+        self.etag = ""
+
+    def render(self):
+        content = (
+            open(BASE_DIR / f"{settings.themesSelect}/index.html", "r", encoding="utf-8")
+            .read()
+            .replace("{{title}}", str(settings.name))
+            .replace("{{description}}", str(settings.description))
+            .replace("{{keywords}}", str(settings.keywords))
+            .replace("{{opacity}}", str(settings.opacity))
+            .replace('"/assets/', '"assets/')
+            .replace("{{background}}", str(settings.background))
+        ).encode("utf-8")
+        self.variants = compress_variants(content)
+        self.etag = f'W/"{hashlib.sha1(content).hexdigest()[:20]}"'
+
+    def response(self, request: Request) -> Response:
+        if not self.variants:
+            self.render()
+        headers = {
+            "Cache-Control": "no-cache",
+            "ETag": self.etag,
+            "Vary": "Accept-Encoding",
+        }
+        if etag_matches(request, self.etag):
+            return Response(status_code=304, headers=headers)
+        encoding = negotiate_encoding(
+            request.headers.get("accept-encoding", ""), self.variants
+        )
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(
+            content=self.variants[encoding], media_type="text/html", headers=headers
+        )
+
+
+index_page = IndexPage()
+
+
+class StaticAsset:
+    __slots__ = ("mtime", "size", "etag", "media_type", "variants")
+
+    def __init__(self, mtime: float, size: int, etag: str, media_type: str, variants: Dict[str, bytes]):
+        self.mtime = mtime
+        self.size = size
+        self.etag = etag
+        self.media_type = media_type
+        self.variants = variants
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(v) for v in self.variants.values())
+
+
+class ThemeStaticFiles(StaticFiles):
+    """
+    主题静态资源服务
+
+    - 小文件首次访问时读入内存，可压缩类型同时生成 gzip/br 版本，之后直接从内存返回
+    - 大文件优先使用构建时生成的同名 .br/.gz 文件，否则按原文件返回
+    - 带内容哈希的文件名（如 index-B-Ka-o3f.js）返回 immutable 长缓存头，其余文件需协商缓存
+    """
+
+    hashed_pattern = re.compile(r"-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$")
+    compressible_types = ("text/", "application/javascript", "application/json", "image/svg+xml", "font/ttf",
+                          "application/x-font-ttf", "font/otf")
+    static_encodings = (("br", ".br"), ("gzip", ".gz"))
+
+    def __init__(self, *args, max_file_size: int = 1024 * 1024, memory_limit: int = 32 * 1024 * 1024, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_file_size = max_file_size
+        self.memory_limit = memory_limit
+        self.memory_used = 0
+        self.assets: Dict[str, StaticAsset] = {}
+
+    def cache_control(self, path: str) -> str:
+        if self.hashed_pattern.search(path):
+            return "public, max-age=31536000, immutable"
+        return "no-cache"
+
+    def is_compressible(self, media_type: str) -> bool:
+        return media_type.startswith(self.compressible_types)
+
+    def _load(self, full_path: str, stat_result: os.stat_result) -> StaticAsset:
+        with open(full_path, "rb") as f:
+            content = f.read()
+        media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+        if self.is_compressible(media_type):
+            variants = compress_variants(content)
+            # 压缩后反而更大时不使用压缩版本
+            variants = {k: v for k, v in variants.items() if k == "identity" or len(v) < len(content)}
+        else:
+            variants = {"identity": content}
+        etag = f'W/"{hashlib.sha1(content).hexdigest()[:20]}"'
+        return StaticAsset(stat_result.st_mtime, stat_result.st_size, etag, media_type, variants)
+
+    async def get_asset(self, full_path: str, stat_result: os.stat_result) -> Optional[StaticAsset]:
+        asset = self.assets.get(full_path)
+        if asset and asset.mtime == stat_result.st_mtime and asset.size == stat_result.st_size:
+            return asset
+        if stat_result.st_size > self.max_file_size:
+            return None
+        new_asset = await asyncio.to_thread(self._load, full_path, stat_result)
+        if asset:
+            self.memory_used -= asset.nbytes
+            self.assets.pop(full_path, None)
+        if self.memory_used + new_asset.nbytes > self.memory_limit:
+            return new_asset
+        self.assets[full_path] = new_asset
+        self.memory_used += new_asset.nbytes
+        return new_asset
+
+    def _precompressed(self, full_path: str, request_headers: Headers) -> Optional[Tuple[str, str]]:
+        available = {}
+        for encoding, ext in self.static_encodings:
+            if os.path.isfile(full_path + ext):
+                available[encoding] = full_path + ext
+        if not available:
+            return None
+        encoding = negotiate_encoding(request_headers.get("accept-encoding", ""), available)
+        if encoding == "identity":
+            return None
+        return encoding, available[encoding]
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] in ("GET", "HEAD"):
+            full_path, stat_result = await asyncio.to_thread(self.lookup_path, path)
+            if stat_result and stat.S_ISREG(stat_result.st_mode):
+                return await self.asset_response(path, full_path, stat_result, scope)
+        return await super().get_response(path, scope)
+
+    async def asset_response(self, path: str, full_path: str, stat_result: os.stat_result, scope: Scope) -> Response:
+        request_headers = Headers(scope=scope)
+        headers = {"Cache-Control": self.cache_control(path), "Vary": "Accept-Encoding"}
+        asset = await self.get_asset(full_path, stat_result)
+        if asset is None:
+            precompressed = await asyncio.to_thread(self._precompressed, full_path, request_headers)
+            if precompressed:
+                encoding, compressed_path = precompressed
+                media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+                headers["Content-Encoding"] = encoding
+                return FileResponse(compressed_path, media_type=media_type, headers=headers)
+            response = self.file_response(full_path, stat_result, scope)
+            response.headers.update(headers)
+            return response
+        headers["ETag"] = asset.etag
+        if if_none_match(request_headers, asset.etag):
+            return Response(status_code=304, headers=headers)
+        encoding = negotiate_encoding(request_headers.get("accept-encoding", ""), asset.variants)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(asset.variants[encoding], media_type=asset.media_type, headers=headers)
@@ -2,39 +2,117 @@
 # @Author  : Lan
 # @File    : storage.py
 # @Software: PyCharm
-import base64
+import datetime
+import functools
 import hashlib
-from core.logger import logger
+import importlib
+import inspect
 import shutil
-from typing import Optional
-from urllib.parse import quote, unquote
+from typing import AsyncIterator, Callable, Dict, Iterator, Mapping, Optional, Set, Tuple, Type
+from urllib.parse import quote
 
 import aiofiles
-import aiohttp
 import asyncio
 from pathlib import Path
-import datetime
-import io
-import re
-import aioboto3
-from botocore.config import Config
-from fastapi import HTTPException, Response, UploadFile
+from fastapi import HTTPException, UploadFile
+from core.cache import DiskCache, disk_cache
+from core.logger import logger
 from core.response import APIResponse
 from core.settings import data_root, settings
 from apps.base.models import FileCodes, UploadChunk
+from core.metrics import instrument_storage_method
 from core.utils import get_file_url, sanitize_filename
 from fastapi.responses import FileResponse
 
 
-class FileStorageInterface:
-    _instance: Optional["FileStorageInterface"] = None
+def _track_calls(func: Callable) -> Callable:
+    """调用期间计入存储实例的进行中操作数"""
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        self._begin_operation()
+        try:
+            return await func(self, *args, **kwargs)
+        finally:
+            self._end_operation()
+
+    return wrapper
 
-    def __new__(cls, *args, **kwargs):
-        if cls._instance is None:
-            cls._instance = super(FileStorageInterface, cls).__new__(
-                cls, *args, **kwargs
-            )
-        return cls._instance
+
+def _track_stream(func: Callable) -> Callable:
+    """异步生成器版本，直到生成器结束都计入进行中操作数（下载流在响应发送期间持续读取）"""
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        self._begin_operation()
+        stream = func(self, *args, **kwargs)
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            try:
+                await stream.aclose()
+            finally:
+                self._end_operation()
+
+    return wrapper
+
+
+class FileStorageInterface:
+    # 是否实现了分片上传（save_chunk / merge_chunks / clean_chunks）
+    supports_chunk = False
+    # merge_chunks 成功后分片已由存储自身清理，无需再调用 clean_chunks
+    cleans_on_merge = False
+    # 除最后一片外分片的最小字节数
+    min_chunk_size = 0
+    # 需要记录耗时和流量的存储方法
+    instrumented_methods = (
+        "save_file", "delete_file", "get_file_url", "get_file_response",
+        "save_chunk", "merge_chunks", "clean_chunks",
+    )
+    # 替换实例前需要等待完成的存储方法
+    tracked_methods = (
+        "save_file", "delete_file", "get_file_url", "get_file_response", "iter_file",
+        "init_chunk_upload", "save_chunk", "merge_chunks", "clean_chunks",
+    )
+    # 属于该存储的配置项前缀，这些配置变化时 StorageRegistry 会重新创建实例
+    settings_prefixes: Tuple[str, ...] = ()
+    _operations = 0
+    _idle: Optional[asyncio.Event] = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for method in cls.instrumented_methods:
+            if method in cls.__dict__:
+                setattr(cls, method, instrument_storage_method(cls.__name__, method, cls.__dict__[method]))
+        for method in cls.tracked_methods:
+            if method in cls.__dict__:
+                func = cls.__dict__[method]
+                track = _track_stream if inspect.isasyncgenfunction(func) else _track_calls
+                setattr(cls, method, track(func))
+
+    def _begin_operation(self):
+        self._operations += 1
+
+    def _end_operation(self):
+        self._operations -= 1
+        if not self._operations and self._idle is not None:
+            self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        等待进行中的操作完成
+        :param timeout: 最长等待秒数
+        :return: 超时前全部完成返回 True
+        """
+        if not self._operations:
+            return True
+        self._idle = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
 
     async def save_file(self, file: UploadFile, save_path: str):
         """
@@ -66,7 +144,27 @@ class FileStorageInterface:
         """
         raise NotImplementedError
 
-    async def save_chunk(self, upload_id: str, chunk_index: int, chunk_data: bytes, chunk_hash: str, save_path: str):
+    async def iter_file(self, file_code: FileCodes, chunk_size: int = 256 * 1024) -> AsyncIterator[bytes]:
+        """
+        按块读取文件内容
+
+        实现为异步生成器，文件不存在时抛出 404 的 HTTPException，本地热缓存通过该方法回源
+        """
+        raise NotImplementedError
+        yield b""
+
+    async def init_chunk_upload(self, upload_id: str, save_path: str, total_chunks: int) -> Optional[str]:
+        """
+        创建分片上传会话
+        :param upload_id: 上传会话ID
+        :param save_path: 文件保存路径
+        :param total_chunks: 分片总数
+        :return: 存储后端的上传会话ID，不需要时返回 None
+        """
+        return None
+
+    async def save_chunk(self, upload_id: str, chunk_index: int, chunk_data: bytes, chunk_hash: str,
+                         save_path: str) -> Optional[str]:
         """
         保存分片文件
         :param upload_id: 上传会话ID
@@ -74,6 +172,7 @@ class FileStorageInterface:
         :param chunk_data: 分片数据
         :param chunk_hash: 分片哈希值
         :param save_path: 文件保存路径
+        :return: 存储后端返回的分片 ETag，不需要时返回 None
         """
         raise NotImplementedError
 
@@ -95,8 +194,15 @@ class FileStorageInterface:
         """
         raise NotImplementedError
 
+    async def close(self):
+        """
+        释放长期持有的连接等资源
+        """
+
 
 class SystemFileStorage(FileStorageInterface):
+    supports_chunk = True
+
     def __init__(self):
         self.chunk_size = 256 * 1024
         self.root_path = data_root
@@ -142,6 +248,14 @@ class SystemFileStorage(FileStorageInterface):
             filename=filename  # 保留原始文件名以备某些场景使用
         )
 
+    async def iter_file(self, file_code: FileCodes, chunk_size: int = 256 * 1024):
+        file_path = self.root_path / await file_code.get_file_path()
+        if not file_path.exists():
+            raise HTTPException(status_code=404, detail="文件已过期删除")
+        async with aiofiles.open(file_path, "rb") as f:
+            while chunk := await f.read(chunk_size):
+                yield chunk
+
     async def save_chunk(self, upload_id: str, chunk_index: int, chunk_data: bytes, chunk_hash: str, save_path: str):
         """
         保存分片文件到本地文件系统
@@ -194,619 +308,231 @@ class SystemFileStorage(FileStorageInterface):
             shutil.rmtree(chunk_dir)
 
 
-class S3FileStorage(FileStorageInterface):
-    def __init__(self):
-        self.access_key_id = settings.s3_access_key_id
-        self.secret_access_key = settings.s3_secret_access_key
-        self.bucket_name = settings.s3_bucket_name
-        self.s3_hostname = settings.s3_hostname
-        self.region_name = settings.s3_region_name
-        self.signature_version = settings.s3_signature_version
-        self.endpoint_url = settings.s3_endpoint_url or f"https://{self.s3_hostname}"
-        self.aws_session_token = settings.aws_session_token
-        self.proxy = settings.s3_proxy
-        self.session = aioboto3.Session(
-            aws_access_key_id=self.access_key_id,
-            aws_secret_access_key=self.secret_access_key,
-        )
-        if not settings.s3_endpoint_url:
-            self.endpoint_url = f"https://{self.s3_hostname}"
-        else:
-            # 如果提供了 s3_endpoint_url，则优先使用它
-            self.endpoint_url = settings.s3_endpoint_url
+class CachedFileStorage(FileStorageInterface):
+    """
+    远程存储的本地热缓存层
 
-    async def save_file(self, file: UploadFile, save_path: str):
-        async with self.session.client(
-                "s3",
-                endpoint_url=self.endpoint_url,
-                aws_session_token=self.aws_session_token,
-                region_name=self.region_name,
-                config=Config(signature_version=self.signature_version),
-        ) as s3:
-            await s3.put_object(
-                Bucket=self.bucket_name,
-                Key=save_path,
-                Body=await file.read(),
-                ContentType=file.content_type,
-            )
+    下载时先读取 data_root/cache 下的缓存文件，未命中则通过 storage.iter_file 回源写入缓存；
+    删除文件（包括过期清理）时同时删除缓存。其余方法直接交给被包装的存储处理。
+    """
+    instrumented_methods = ("get_file_response",)
+    tracked_methods = ()
 
-    async def delete_file(self, file_code: FileCodes):
-        async with self.session.client(
-                "s3",
-                endpoint_url=self.endpoint_url,
-                region_name=self.region_name,
-                config=Config(signature_version=self.signature_version),
-        ) as s3:
-            await s3.delete_object(
-                Bucket=self.bucket_name, Key=await file_code.get_file_path()
-            )
+    def __init__(self, storage: FileStorageInterface, cache: DiskCache):
+        self.storage = storage
+        self.cache = cache
 
-    async def get_file_response(self, file_code: FileCodes):
-        try:
-            filename = file_code.prefix + file_code.suffix
-            async with self.session.client(
-                    "s3",
-                    endpoint_url=self.endpoint_url,
-                    region_name=self.region_name,
-                    config=Config(signature_version=self.signature_version),
-            ) as s3:
-                link = await s3.generate_presigned_url(
-                    "get_object",
-                    Params={
-                        "Bucket": self.bucket_name,
-                        "Key": await file_code.get_file_path(),
-                    },
-                    ExpiresIn=3600,
-                )
-            tmp = io.BytesIO()
-            async with aiohttp.ClientSession() as session:
-                async with session.get(link) as resp:
-                    tmp.write(await resp.read())
-            tmp.seek(0)
-            content = tmp.read()
-            tmp.close()
-            return Response(
-                content,
-                media_type="application/octet-stream",
-                headers={
-                    "Content-Disposition": f'attachment; filename="{filename.encode("utf-8").decode("latin-1")}"'
-                },
-            )
-        except Exception:
-            raise HTTPException(status_code=503, detail="服务代理下载异常，请稍后再试")
+    @property
+    def supports_chunk(self) -> bool:
+        return self.storage.supports_chunk
 
-    async def get_file_url(self, file_code: FileCodes):
-        if file_code.prefix == "文本分享":
-            return file_code.text
-        if self.proxy:
-            return await get_file_url(file_code.code)
-        else:
-            async with self.session.client(
-                    "s3",
-                    endpoint_url=self.endpoint_url,
-                    region_name=self.region_name,
-                    config=Config(signature_version=self.signature_version),
-            ) as s3:
-                result = await s3.generate_presigned_url(
-                    "get_object",
-                    Params={
-                        "Bucket": self.bucket_name,
-                        "Key": await file_code.get_file_path(),
-                    },
-                    ExpiresIn=3600,
-                )
-                return result
+    @property
+    def cleans_on_merge(self) -> bool:
+        return self.storage.cleans_on_merge
 
-    async def save_chunk(self, upload_id: str, chunk_index: int, chunk_data: bytes, chunk_hash: str, save_path: str):
-        chunk_key = str(Path(save_path).parent / "chunks" /
-                        upload_id / f"{chunk_index}.part")
-        async with self.session.client('s3') as s3:
-            response = await s3.upload_part(
-                Bucket=self.bucket_name,
-                Key=chunk_key,
-                PartNumber=chunk_index + 1,
-                UploadId=upload_id,
-                Body=chunk_data
-            )
-            await s3.put_object_tagging(
-                Bucket=self.bucket_name,
-                Key=chunk_key,
-                Tagging={
-                    'TagSet': [
-                        {'Key': 'ChunkHash', 'Value': chunk_hash},
-                        {'Key': 'ETag', 'Value': response['ETag']}
-                    ]
-                }
-            )
-
-    async def merge_chunks(self, upload_id: str, chunk_info: UploadChunk, save_path: str) -> tuple[str, str]:
-        file_sha256 = hashlib.sha256()
-        chunk_dir = str(Path(save_path).parent / "chunks" / upload_id)
-        async with self.session.client('s3') as s3:
-            # 获取所有分片
-            parts = await s3.list_parts(
-                Bucket=self.bucket_name,
-                Key=chunk_dir,
-                UploadId=upload_id
-            )
-            part_list = []
-            for part in parts['Parts']:
-                part_number = part['PartNumber']
-                chunk_index = part_number - 1
-                chunk_record = await UploadChunk.get(upload_id=upload_id, chunk_index=chunk_index)
-                response = await s3.get_object(
-                    Bucket=self.bucket_name,
-                    Key=f"{chunk_dir}/{chunk_index}.part",
-                    PartNumber=part_number
-                )
-                chunk_data = await response['Body'].read()
-                current_hash = hashlib.sha256(chunk_data).hexdigest()
-                if current_hash != chunk_record.chunk_hash:
-                    raise Exception(f"分片{chunk_index}哈希不匹配")
-                file_sha256.update(chunk_data)
-                part_list.append(
-                    {'PartNumber': part_number, 'ETag': part['ETag']})
-            # 完成合并
-            await s3.complete_multipart_upload(
-                Bucket=self.bucket_name,
-                Key=save_path,
-                UploadId=upload_id,
-                MultipartUpload={'Parts': part_list}
-            )
-        return save_path, file_sha256.hexdigest()
-
-    async def clean_chunks(self, upload_id: str, save_path: str):
-        """
-        清理 S3 上的临时分片文件
-        :param upload_id: 上传会话ID
-        :param save_path: 文件保存路径
-        """
-        chunk_dir = str(Path(save_path).parent / "chunks" / upload_id)
-        async with self.session.client('s3') as s3:
-            try:
-                # 终止未完成的分片上传会话
-                await s3.abort_multipart_upload(
-                    Bucket=self.bucket_name,
-                    Key=chunk_dir,
-                    UploadId=upload_id
-                )
-            except Exception as e:
-                # 如果上传会话不存在或其他错误，忽略
-                logger.info(f"清理 S3 分片时出错: {e}")
-
-            try:
-                # 清理已上传的分片数据
-                parts = await s3.list_parts(
-                    Bucket=self.bucket_name,
-                    Key=chunk_dir,
-                    UploadId=upload_id
-                )
-                for part in parts.get('Parts', []):
-                    await s3.delete_object(
-                        Bucket=self.bucket_name,
-                        Key=f"{chunk_dir}/{part['PartNumber'] - 1}.part"
-                    )
-            except Exception as e:
-                # 如果分片数据不存在或其他错误，忽略
-                logger.info(f"清理 S3 分片数据时出错: {e}")
-
-
-class OneDriveFileStorage(FileStorageInterface):
-    def __init__(self):
-        try:
-            import msal
-            from office365.graph_client import GraphClient
-            from office365.runtime.client_request_exception import (
-                ClientRequestException,
-            )
-        except ImportError:
-            raise ImportError("请先安装`msal`和`Office365-REST-Python-Client`")
-        self.msal = msal
-        self.domain = settings.onedrive_domain
-        self.client_id = settings.onedrive_client_id
-        self.username = settings.onedrive_username
-        self.password = settings.onedrive_password
-        self.proxy = settings.onedrive_proxy
-        self._ClientRequestException = ClientRequestException
-
-        try:
-            client = GraphClient(self.acquire_token_pwd)
-            self.root_path = (
-                client.me.drive.root.get_by_path(settings.onedrive_root_path)
-                .get()
-                .execute_query()
-            )
-        except ClientRequestException as e:
-            if e.code == "itemNotFound":
-                client.me.drive.root.create_folder(settings.onedrive_root_path)
-                self.root_path = (
-                    client.me.drive.root.get_by_path(
-                        settings.onedrive_root_path)
-                    .get()
-                    .execute_query()
-                )
-            else:
-                raise e
-        except Exception as e:
-            raise Exception("OneDrive验证失败，请检查配置是否正确\n" + str(e))
-
-    def acquire_token_pwd(self):
-        authority_url = f"https://login.microsoftonline.com/{self.domain}"
-        app = self.msal.PublicClientApplication(
-            authority=authority_url, client_id=self.client_id
-        )
-        result = app.acquire_token_by_username_password(
-            username=self.username,
-            password=self.password,
-            scopes=["https://graph.microsoft.com/.default"],
-        )
-        return result
-
-    def _get_path_str(self, path):
-        if isinstance(path, str):
-            path = path.replace("\\", "/").replace("//", "/").split("/")
-        elif isinstance(path, Path):
-            path = str(path).replace("\\", "/").replace("//", "/").split("/")
-        else:
-            raise TypeError("path must be str or Path")
-        path[-1] = path[-1].split(".")[0]
-        return "/".join(path)
-
-    def _save(self, file, save_path):
-        content = file.file.read()
-        name = save_path(file.filename)
-        path = self._get_path_str(save_path)
-        self.root_path.get_by_path(path).upload(name, content).execute_query()
+    @property
+    def min_chunk_size(self) -> int:
+        return self.storage.min_chunk_size
 
     async def save_file(self, file: UploadFile, save_path: str):
-        await asyncio.to_thread(self._save, file, save_path)
-
-    def _delete(self, save_path):
-        path = self._get_path_str(save_path)
-        try:
-            self.root_path.get_by_path(path).delete_object().execute_query()
-        except self._ClientRequestException as e:
-            if e.code == "itemNotFound":
-                pass
-            else:
-                raise e
+        await self.storage.save_file(file, save_path)
+        # 覆盖同名文件时旧缓存失效
+        self.cache.invalidate(save_path)
 
     async def delete_file(self, file_code: FileCodes):
-        await asyncio.to_thread(self._delete, await file_code.get_file_path())
-
-    def _convert_link_to_download_link(self, link):
-        p1 = re.search(r"https://(.+)\.sharepoint\.com", link).group(1)
-        p2 = re.search(r"personal/(.+)/", link).group(1)
-        p3 = re.search(rf"{p2}/(.+)", link).group(1)
-        return f"https://{p1}.sharepoint.com/personal/{p2}/_layouts/52/download.aspx?share={p3}"
-
-    def _get_file_url(self, save_path, name):
-        path = self._get_path_str(save_path)
-        remote_file = self.root_path.get_by_path(path + "/" + name)
-        expiration_datetime = datetime.datetime.now(
-            tz=datetime.timezone.utc
-        ) + datetime.timedelta(hours=1)
-        expiration_datetime = expiration_datetime.strftime(
-            "%Y-%m-%dT%H:%M:%SZ")
-        permission = remote_file.create_link(
-            "view", "anonymous", expiration_datetime=expiration_datetime
-        ).execute_query()
-        return self._convert_link_to_download_link(permission.link.webUrl)
-
-    async def get_file_response(self, file_code: FileCodes):
-        try:
-            filename = file_code.prefix + file_code.suffix
-            link = await asyncio.to_thread(
-                self._get_file_url, await file_code.get_file_path(), filename
-            )
-            tmp = io.BytesIO()
-            async with aiohttp.ClientSession() as session:
-                async with session.get(link) as resp:
-                    tmp.write(await resp.read())
-            tmp.seek(0)
-            content = tmp.read()
-            tmp.close()
-            return Response(
-                content,
-                media_type="application/octet-stream",
-                headers={
-                    "Content-Disposition": f'attachment; filename="{filename.encode("utf-8").decode("latin-1")}"'
-                },
-            )
-        except Exception:
-            raise HTTPException(status_code=503, detail="服务代理下载异常，请稍后再试")
+        await self.storage.delete_file(file_code)
+        self.cache.invalidate(await file_code.get_file_path())
 
     async def get_file_url(self, file_code: FileCodes):
-        if self.proxy:
-            return await get_file_url(file_code.code)
-        else:
-            return await asyncio.to_thread(
-                self._get_file_url,
-                await file_code.get_file_path(),
-                f"{file_code.prefix}{file_code.suffix}",
-            )
-
-
-class OpenDALFileStorage(FileStorageInterface):
-    def __init__(self):
-        try:
-            import opendal
-        except ImportError:
-            raise ImportError('请先安装 `opendal`, 例如: "pip install opendal"')
-        self.service = settings.opendal_scheme
-        service_settings = {}
-        for key, value in settings.items():
-            if key.startswith("opendal_" + self.service):
-                setting_name = key.split("_", 2)[2]
-                service_settings[setting_name] = value
-        self.operator = opendal.AsyncOperator(
-            settings.opendal_scheme, **service_settings
-        )
-
-    async def save_file(self, file: UploadFile, save_path: str):
-        await self.operator.write(save_path, file.file.read())
-
-    async def delete_file(self, file_code: FileCodes):
-        await self.operator.delete(await file_code.get_file_path())
-
-    async def get_file_url(self, file_code: FileCodes):
-        return await get_file_url(file_code.code)
+        return await self.storage.get_file_url(file_code)
 
     async def get_file_response(self, file_code: FileCodes):
-        try:
-            filename = file_code.prefix + file_code.suffix
-            content = await self.operator.read(await file_code.get_file_path())
-            headers = {
-                "Content-Disposition": f'attachment; filename="{filename}"'}
-            return Response(
-                content, headers=headers, media_type="application/octet-stream"
-            )
-        except Exception as e:
-            logger.info(e)
-            raise HTTPException(status_code=404, detail="文件已过期删除")
-
-
-class WebDAVFileStorage(FileStorageInterface):
-    _instance: Optional["WebDAVFileStorage"] = None
-
-    def __init__(self):
-        if not hasattr(self, "_initialized"):
-            self.base_url = settings.webdav_url.rstrip("/") + "/"
-            self.auth = aiohttp.BasicAuth(
-                login=settings.webdav_username, password=settings.webdav_password
-            )
-            self._initialized = True
-
-    def _build_url(self, path: str) -> str:
-        encoded_path = quote(str(path.replace("\\", "/").lstrip("/")).lstrip("/"))
-        return f"{self.base_url}{encoded_path}"
-
-    async def _mkdir_p(self, directory_path: str):
-        """递归创建目录（类似mkdir -p）"""
-        path_obj = Path(unquote(directory_path))
-        current_path = ""
-
-        async with aiohttp.ClientSession(auth=self.auth) as session:
-            # 逐级检查目录是否存在
-            for part in path_obj.parts:
-                current_path = str(Path(current_path) / part)
-                url = self._build_url(current_path)
-
-                # 检查目录是否存在
-                async with session.head(url) as resp:
-                    if resp.status == 404:
-                        # 创建目录
-                        async with session.request("MKCOL", url) as mkcol_resp:
-                            if mkcol_resp.status not in (200, 201, 409):
-                                content = await mkcol_resp.text()
-                                raise HTTPException(
-                                    status_code=mkcol_resp.status,
-                                    detail=f"目录创建失败: {content[:200]}",
-                                )
-
-    async def _is_dir_empty(self, dir_path: str) -> bool:
-        """检查目录是否为空"""
-        url = self._build_url(dir_path)
-
-        async with aiohttp.ClientSession(auth=self.auth) as session:
-            async with session.request("PROPFIND", url, headers={"Depth": "1"}) as resp:
-                if resp.status != 207:  # 207 是 Multi-Status 响应
-                    return False
-                content = await resp.text()
-                # 如果只有一个 response（当前目录），说明目录为空
-                return content.count("<D:response>") <= 1
-
-    async def _delete_empty_dirs(self, file_path: str, session: aiohttp.ClientSession):
-        """递归删除空目录"""
-        path_obj = Path(file_path)
-        current_path = path_obj.parent
-
-        while str(current_path) != ".":
-            if not await self._is_dir_empty(str(current_path)):
-                break
-
-            url = self._build_url(str(current_path))
-            async with session.delete(url) as resp:
-                if resp.status not in (200, 204, 404):
-                    break
-
-            current_path = current_path.parent
-
-    async def save_file(self, file: UploadFile, save_path: str):
-        """保存文件（自动创建目录）"""
-        path_obj = Path(save_path)
-        directory_path = str(path_obj.parent)
-        # 提取原始文件名并进行清理
-        filename = await sanitize_filename(path_obj.name)
-        # 构建安全的保存路径
-        safe_save_path = str(Path(directory_path) / filename)
-
-        try:
-            # 先创建目录结构
-            await self._mkdir_p(directory_path)
-            # 上传文件
-            url = self._build_url(safe_save_path)
-            async with aiohttp.ClientSession(auth=self.auth) as session:
-                content = await file.read()
-                async with session.put(
-                        url, data=content, headers={
-                            "Content-Type": file.content_type}
-                ) as resp:
-                    if resp.status not in (200, 201, 204):
-                        content = await resp.text()
-                        raise HTTPException(
-                            status_code=resp.status,
-                            detail=f"文件上传失败: {content[:200]}",
-                        )
-        except aiohttp.ClientError as e:
-            raise HTTPException(
-                status_code=503, detail=f"WebDAV连接异常: {str(e)}")
-
-    async def delete_file(self, file_code: FileCodes):
-        """删除WebDAV文件及空目录"""
-        file_path = await file_code.get_file_path()
-        url = self._build_url(file_path)
-        try:
-            async with aiohttp.ClientSession(auth=self.auth) as session:
-                # 删除文件
-                async with session.delete(url) as resp:
-                    if resp.status not in (200, 204, 404):
-                        content = await resp.text()
-                        raise HTTPException(
-                            status_code=resp.status,
-                            detail=f"WebDAV删除失败: {content[:200]}",
-                        )
-
-                # 使用同一个 session 删除空目录
-                await self._delete_empty_dirs(file_path, session)
-
-        except aiohttp.ClientError as e:
-            raise HTTPException(
-                status_code=503, detail=f"WebDAV连接异常: {str(e)}")
+        if (file_code.size or 0) > settings.storage_cache_max_file_size:
+            return await self.storage.get_file_response(file_code)
+        path = await self.cache.fetch(
+            await file_code.get_file_path(), lambda: self.storage.iter_file(file_code)
+        )
+        filename = f"{file_code.prefix}{file_code.suffix}"
+        return FileResponse(
+            path,
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename, safe='')}"},
+        )
 
-    async def get_file_url(self, file_code: FileCodes):
-        return await get_file_url(file_code.code)
+    async def iter_file(self, file_code: FileCodes, chunk_size: int = 256 * 1024):
+        async for chunk in self.storage.iter_file(file_code, chunk_size):
+            yield chunk
 
-    async def get_file_response(self, file_code: FileCodes):
-        """获取文件响应（代理模式）"""
-        try:
-            filename = file_code.prefix + file_code.suffix
-            url = self._build_url(await file_code.get_file_path())
-            async with aiohttp.ClientSession(headers={
-                "Authorization": f"Basic {base64.b64encode(f'{settings.webdav_username}:{settings.webdav_password}'.encode()).decode()}"
-            }) as session:
-                async with session.get(url) as resp:
-                    if resp.status != 200:
-                        raise HTTPException(
-                            status_code=resp.status,
-                            detail=f"文件获取失败{resp.status}: {await resp.text()}",
-                        )
-                    # 读取内容到内存
-                    content = await resp.read()
-                    return Response(
-                        content=content,
-                        media_type=resp.headers.get(
-                            "Content-Type", "application/octet-stream"
-                        ),
-                        headers={
-                            "Content-Disposition": f'attachment; filename="{filename.encode("utf-8").decode()}"'
-                        },
-                    )
-        except aiohttp.ClientError as e:
-            raise HTTPException(
-                status_code=503, detail=f"WebDAV连接异常: {str(e)}")
+    async def init_chunk_upload(self, upload_id: str, save_path: str, total_chunks: int) -> Optional[str]:
+        return await self.storage.init_chunk_upload(upload_id, save_path, total_chunks)
 
-    async def save_chunk(self, upload_id: str, chunk_index: int, chunk_data: bytes, chunk_hash: str, save_path: str):
-        chunk_path = str(Path(save_path).parent / "chunks" / upload_id / f"{chunk_index}.part")
-        chunk_url = self._build_url(chunk_path)
-        async with aiohttp.ClientSession(auth=self.auth) as session:
-            await session.put(chunk_url, data=chunk_data)
-            propfind_url = self._build_url(chunk_path)
-            headers = {
-                'Content-Type': 'application/xml; charset=utf-8', 'Depth': '0'}
-            body = f"""
-                <D:propertyupdate xmlns:D="DAV:">
-                    <D:set>
-                        <D:prop>
-                            <ChunkHash xmlns="urn:filecodebox">{chunk_hash}</ChunkHash>
-                        </D:prop>
-                    </D:set>
-                </D:propertyupdate>
-            """
-            await session.request('PROPPATCH', propfind_url, headers=headers, data=body)
+    async def save_chunk(self, upload_id: str, chunk_index: int, chunk_data: bytes, chunk_hash: str,
+                         save_path: str) -> Optional[str]:
+        return await self.storage.save_chunk(upload_id, chunk_index, chunk_data, chunk_hash, save_path)
 
     async def merge_chunks(self, upload_id: str, chunk_info: UploadChunk, save_path: str) -> tuple[str, str]:
-        file_sha256 = hashlib.sha256()
-        output_url = self._build_url(save_path)
-        chunk_dir = str(Path(save_path).parent / "chunks" / upload_id)
-        async with aiohttp.ClientSession(auth=self.auth) as session:
-            await session.put(output_url, headers={'Content-Length': '0'})
-            for i in range(chunk_info.total_chunks):
-                chunk_path = f"{chunk_dir}/{i}.part"
-                chunk_url = self._build_url(chunk_path)
-                propfind_url = self._build_url(chunk_path)
-                headers = {
-                    'Content-Type': 'application/xml; charset=utf-8', 'Depth': '0'}
-                body = """
-                    <D:propfind xmlns:D="DAV:">
-                        <D:prop>
-                            <ChunkHash xmlns="urn:filecodebox"/>
-                        </D:prop>
-                    </D:propfind>
-                """
-                async with session.request('PROPFIND', propfind_url, headers=headers, data=body) as resp:
-                    xml_data = await resp.text()
-                    chunk_hash = re.search(
-                        r'<ChunkHash[^>]*>([^<]+)</ChunkHash>', xml_data).group(1)
-                file_sha256.update(bytes.fromhex(chunk_hash))
-                async with session.get(chunk_url) as resp:
-                    chunk_data = await resp.read()
-                    await session.request('PATCH', output_url, headers={
-                        'Content-Type': 'application/octet-stream',
-                        'Content-Length': str(len(chunk_data)),
-                        'Content-Range': f'bytes */{chunk_info.file_size}'
-                    }, data=chunk_data)
-        return save_path, file_sha256.hexdigest()
+        result = await self.storage.merge_chunks(upload_id, chunk_info, save_path)
+        self.cache.invalidate(save_path)
+        return result
 
     async def clean_chunks(self, upload_id: str, save_path: str):
+        return await self.storage.clean_chunks(upload_id, save_path)
+
+
+class StorageClasses(Mapping):
+    """
+    存储名称到实现类的映射
+
+    远程存储的实现和依赖的 SDK（aioboto3、aiohttp 等）放在 core.backends 下，
+    第一次取用某个存储时才导入，只使用本机存储时不会加载这些模块
+    """
+
+    def __init__(self, paths: Dict[str, str]):
+        self.paths = paths
+        self.loaded: Dict[str, Type[FileStorageInterface]] = {}
+
+    def __getitem__(self, name: str) -> Type[FileStorageInterface]:
+        storage_class = self.loaded.get(name)
+        if storage_class is None:
+            module_name, _, class_name = self.paths[name].rpartition(".")
+            storage_class = getattr(importlib.import_module(module_name), class_name)
+            self.loaded[name] = storage_class
+        return storage_class
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.paths)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+
+storages = StorageClasses({
+    "local": "core.storage.SystemFileStorage",
+    "s3": "core.backends.s3.S3FileStorage",
+    "onedrive": "core.backends.onedrive.OneDriveFileStorage",
+    "opendal": "core.backends.opendal.OpenDALFileStorage",
+    "webdav": "core.backends.webdav.WebDAVFileStorage",
+})
+
+class StorageRegistry:
+    """
+    按名称保存已创建的存储实例
+
+    每个存储只在第一次使用时创建，之后一直复用其中的连接、令牌和缓存。
+    配置变化后调用 reload，配置项改变的存储会被新实例原子替换，
+    旧实例在后台等待进行中的操作完成后再关闭。
+    """
+
+    def __init__(self, classes: Mapping[str, Type[FileStorageInterface]]):
+        self.classes = classes
+        self.instances: Dict[str, FileStorageInterface] = {}
+        self.fingerprints: Dict[str, tuple] = {}
+        self.cached: Dict[str, CachedFileStorage] = {}
+        self._retiring: Set[asyncio.Task] = set()
+
+    def fingerprint(self, name: str) -> tuple:
+        prefixes = self.classes[name].settings_prefixes
+        if not prefixes:
+            return ()
+        return tuple((key, value) for key, value in settings.items() if key.startswith(prefixes))
+
+    def get(self, name: str) -> FileStorageInterface:
+        storage = self.instances.get(name)
+        if storage is None:
+            storage = self.classes[name]()
+            self.instances[name] = storage
+            self.fingerprints[name] = self.fingerprint(name)
+        return storage
+
+    def reload(self):
+        """重新检查各存储的配置，配置改变的实例从注册表移除并在后台关闭，下次使用时重新创建"""
+        for name in list(self.instances):
+            if self.fingerprint(name) != self.fingerprints[name]:
+                logger.info(f"存储 {name} 配置已变化，替换实例")
+                self.retire(name)
+
+    def retire(self, name: str):
         """
-        清理 WebDAV 上的临时分片文件
-        :param upload_id: 上传会话ID
-        :param save_path: 文件保存路径
+        从注册表移除存储实例，等待进行中的操作完成后在后台关闭
+
+        用于配置变化，或文件迁移后不再使用某个存储时释放连接
         """
-        chunk_dir = str(Path(save_path).parent / "chunks" / upload_id)
-        chunk_dir_url = self._build_url(chunk_dir)
-        async with aiohttp.ClientSession(auth=self.auth) as session:
-            try:
-                # 检查分片目录是否存在
-                async with session.request("PROPFIND", chunk_dir_url, headers={"Depth": "1"}) as resp:
-                    if resp.status == 207:  # 207 表示 Multi-Status
-                        # 获取目录下的所有分片文件
-                        xml_data = await resp.text()
-                        file_paths = re.findall(
-                            r'<D:href>(.*?)</D:href>', xml_data)
-                        for file_path in file_paths:
-                            if file_path.endswith(".part"):
-                                # 删除分片文件
-                                file_url = self._build_url(file_path)
-                                async with session.delete(file_url) as delete_resp:
-                                    if delete_resp.status not in (200, 204, 404):
-                                        logger.info(f"删除分片文件失败: {file_path}")
-
-                        # 删除分片目录
-                        async with session.delete(chunk_dir_url) as delete_resp:
-                            if delete_resp.status not in (200, 204, 404):
-                                logger.info(f"删除分片目录失败: {chunk_dir_url}")
-                    else:
-                        logger.info(f"分片目录不存在: {chunk_dir_url}")
-            except Exception as e:
-                logger.info(f"清理 WebDAV 分片时出错: {e}")
-
-
-storages = {
-    "local": SystemFileStorage,
-    "s3": S3FileStorage,
-    "onedrive": OneDriveFileStorage,
-    "opendal": OpenDALFileStorage,
-    "webdav": WebDAVFileStorage,
-}
+        storage = self.instances.pop(name, None)
+        self.fingerprints.pop(name, None)
+        self.cached.pop(name, None)
+        if storage is None:
+            return
+        task = asyncio.create_task(self._retire(name, storage))
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    @staticmethod
+    async def _retire(name: str, storage: FileStorageInterface):
+        if not await storage.drain(settings.storage_drain_timeout):
+            logger.warning(f"存储 {name} 仍有未完成的操作，强制关闭旧实例")
+        try:
+            await storage.close()
+        except Exception as e:
+            logger.error(f"关闭存储 {name} 失败: {e}")
+
+    async def close(self):
+        """关闭全部存储实例，并等待正在替换的旧实例关闭"""
+        instances = list(self.instances.values())
+        self.instances.clear()
+        self.fingerprints.clear()
+        self.cached.clear()
+        for storage in instances:
+            await storage.close()
+        if self._retiring:
+            await asyncio.gather(*self._retiring, return_exceptions=True)
+
+
+storage_registry = StorageRegistry(storages)
+
+
+async def close_storages():
+    """关闭已创建的存储实例"""
+    await storage_registry.close()
+
+
+def get_file_storage(name: Optional[str] = None) -> FileStorageInterface:
+    """
+    获取存储
+    :param name: 存储名称，通常为 FileCodes.storage，为空时使用 settings.file_storage
+
+    开启 storage_cache_enable 且存储不是本机时，返回带本地热缓存的包装
+    """
+    name = name or settings.file_storage
+    storage = storage_registry.get(name)
+    if not settings.storage_cache_enable or isinstance(storage, SystemFileStorage) \
+            or type(storage).iter_file is FileStorageInterface.iter_file:
+        return storage
+    disk_cache.max_size = settings.storage_cache_size
+    cached = storage_registry.cached.get(name)
+    if cached is None or cached.storage is not storage:
+        cached = storage_registry.cached[name] = CachedFileStorage(storage, disk_cache)
+    return cached
+
+
+def get_policy_storages() -> Set[str]:
+    """新上传的文件可能写入的存储名称"""
+    return {settings.file_storage, *(rule["storage"] for rule in settings.storage_policy)}
+
+
+def select_storage(size: int, expired_at: Optional[datetime.datetime] = None) -> str:
+    """
+    按 storage_policy 为新文件选择存储
+    :param size: 文件大小（字节）
+    :param expired_at: 过期时间，为空表示没有时间限制（按次数过期或永久保存）
+    :return: 存储名称
+    """
+    lifetime = float("inf")
+    if expired_at is not None:
+        lifetime = (expired_at - datetime.datetime.now(expired_at.tzinfo)).total_seconds()
+    for rule in settings.storage_policy:
+        if size < rule.get("min_size", 0) or size >= rule.get("max_size", float("inf")):
+            continue
+        if lifetime < rule.get("min_expire_seconds", 0) or lifetime > rule.get("max_expire_seconds", float("inf")):
+            continue
+        return rule["storage"]
+    return settings.file_storage
@@ -0,0 +1,202 @@
+import asyncio
+import itertools
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set
+
+from core.metrics import storage_stream_requests
+
+
+class _Detached(Exception):
+    """订阅者落后太多，已被分离出共享读取"""
+
+
+async def _skip(source: AsyncIterator[bytes], offset: int) -> AsyncIterator[bytes]:
+    """跳过数据流开头的 offset 字节"""
+    try:
+        async for chunk in source:
+            if offset >= len(chunk):
+                offset -= len(chunk)
+                continue
+            yield chunk[offset:] if offset else chunk
+            offset = 0
+    finally:
+        aclose = getattr(source, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+class _Flight:
+    """
+    一次上游读取，按块分发给多个订阅者
+
+    已读取的块保存在窗口中，所有订阅者都读过且窗口超过 max_buffer 字节时才丢弃，
+    因此窗口内的数据可以回放给后加入的订阅者。窗口满时把落后 max_buffer 字节的订阅者分离出去，
+    其余订阅者继续读取；所有订阅者进度相同时上游读取暂停，等待它们读取。
+    """
+
+    def __init__(self, source: AsyncIterator[bytes], max_buffer: int):
+        self.source = source
+        self.max_buffer = max_buffer
+        self.chunks: List[bytes] = []
+        # chunks[0] 对应的块序号
+        self.base = 0
+        self.buffered = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        # 订阅者 -> 下一个要读取的块序号
+        self.positions: Dict[int, int] = {}
+        # 因落后被分离的订阅者，需要自行回源读取
+        self.detached: Set[int] = set()
+        self.cond = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def joinable(self) -> bool:
+        """还保留着第一块数据时，新的订阅者可以加入"""
+        return self.base == 0 and self.error is None
+
+    def _trim(self):
+        if not self.positions:
+            return
+        lowest = min(self.positions.values())
+        while self.chunks and self.base < lowest and self.buffered >= self.max_buffer:
+            self.buffered -= len(self.chunks.pop(0))
+            self.base += 1
+
+    def _detach_laggards(self):
+        """分离停在窗口开头的订阅者；所有订阅者进度相同时不分离"""
+        lowest = min(self.positions.values())
+        laggards = [s for s, p in self.positions.items() if p == lowest]
+        if len(laggards) == len(self.positions):
+            return
+        for subscriber in laggards:
+            del self.positions[subscriber]
+            self.detached.add(subscriber)
+        self.cond.notify_all()
+
+    def _has_room(self) -> bool:
+        self._trim()
+        if self.buffered >= self.max_buffer and self.positions:
+            self._detach_laggards()
+            self._trim()
+        return self.buffered < self.max_buffer or not self.positions
+
+    async def _produce(self):
+        try:
+            async for chunk in self.source:
+                async with self.cond:
+                    await self.cond.wait_for(self._has_room)
+                    if not self.positions:
+                        break
+                    self.chunks.append(chunk)
+                    self.buffered += len(chunk)
+                    self.cond.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            async with self.cond:
+                self.done = True
+                self.cond.notify_all()
+            aclose = getattr(self.source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    async def next_chunk(self, subscriber: int) -> Optional[bytes]:
+        """读取订阅者的下一块数据，读完返回 None，订阅者已被分离时抛出 _Detached"""
+        if self.task is None:
+            self.task = asyncio.create_task(self._produce())
+        async with self.cond:
+            if subscriber in self.detached:
+                raise _Detached
+            position = self.positions[subscriber]
+            await self.cond.wait_for(
+                lambda: position < self.base + len(self.chunks) or self.done or subscriber in self.detached
+            )
+            if subscriber in self.detached:
+                raise _Detached
+            if position < self.base + len(self.chunks):
+                self.positions[subscriber] = position + 1
+                self.cond.notify_all()
+                return self.chunks[position - self.base]
+            if self.error is not None:
+                raise self.error
+            return None
+
+    def leave(self, subscriber: int):
+        self.positions.pop(subscriber, None)
+        self.detached.discard(subscriber)
+        if not self.positions and not self.done and self.task is not None:
+            # 最后一个订阅者离开，停止上游读取
+            self.task.cancel()
+
+
+class StreamCoalescer:
+    """
+    并发下载同一远程对象时合并上游请求（single-flight）
+
+    同一 key 正在读取且仍可回放开头时，新请求订阅已有的读取，否则发起新的上游读取。
+    每个读取最多缓存 max_buffer 字节，不会把整个对象读入内存。
+    落后超过 max_buffer 字节的订阅者被分离，从已发送的位置单独回源读取，不会拖慢同一对象的其他下载。
+    """
+
+    def __init__(self, max_buffer: int = 8 * 1024 * 1024):
+        self.max_buffer = max_buffer
+        self.flights: Dict[str, _Flight] = {}
+        self._ids = itertools.count()
+
+    async def stream(self, key: str, open_source: Callable[[], AsyncIterator[bytes]]) -> AsyncIterator[bytes]:
+        """
+        订阅 key 对应的数据流
+        :param key: 对象路径
+        :param open_source: 发起上游读取的函数，返回异步迭代器
+        """
+        flight = self.flights.get(key)
+        if flight is not None and flight.joinable:
+            storage_stream_requests.inc(result="coalesced")
+        else:
+            storage_stream_requests.inc(result="upstream")
+            flight = self.flights[key] = _Flight(open_source(), self.max_buffer)
+        subscriber = next(self._ids)
+        flight.positions[subscriber] = flight.base
+        sent = 0
+        try:
+            while (chunk := await flight.next_chunk(subscriber)) is not None:
+                sent += len(chunk)
+                yield chunk
+        except _Detached:
+            pass
+        else:
+            return
+        finally:
+            flight.leave(subscriber)
+            if not flight.positions and self.flights.get(key) is flight:
+                del self.flights[key]
+        # 被分离后单独回源，跳过已发送的部分
+        storage_stream_requests.inc(result="detached")
+        async for chunk in _skip(open_source(), sent):
+            yield chunk
+
+    async def open(self, key: str, open_source: Callable[[], AsyncIterator[bytes]]) -> AsyncIterator[bytes]:
+        """
+        订阅数据流并预先读取第一块
+
+        上游读取失败（如文件不存在）时在这里抛出异常，调用方可以在发送响应头之前处理
+        """
+        stream = self.stream(key, open_source)
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = b""
+
+        async def body():
+            try:
+                if first:
+                    yield first
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.aclose()
+
+        return body()
+
+
+stream_coalescer = StreamCoalescer()
@@ -3,36 +3,116 @@
 # @File    : tasks.py
 # @Software: PyCharm
 import asyncio
+import datetime
 import logging
 import os
 
 from tortoise.expressions import Q
 
-from apps.base.models import FileCodes
-from apps.base.utils import ip_limit
+from apps.base.models import FileCodeRecord, FileCodes, FileText, KeyValue, UploadChunk
+from apps.base.utils import ip_limit, code_pool, get_chunk_session_path_name
+from core.metrics import expire_sweep_duration
 from core.settings import settings, data_root
-from core.storage import FileStorageInterface, storages
+from core.storage import get_file_storage, get_policy_storages
 from core.utils import get_now
 
 
+async def delete_expire_chunk_sessions(batch_size: int = 100, concurrency: int = 8):
+    """
+    清理超过 chunk_session_ttl 仍未完成的分片上传会话
+
+    按批次查询过期会话，以有限并发清理存储中的分片，再批量删除分片记录
+    """
+    expired_at = await get_now() - datetime.timedelta(seconds=settings.chunk_session_ttl)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def clean(session: UploadChunk):
+        async with semaphore:
+            try:
+                _, _, _, _, save_path = await get_chunk_session_path_name(session)
+                await get_file_storage(session.storage).clean_chunks(session.upload_id, save_path)
+            except Exception as e:
+                logging.error(f"清理分片会话 {session.upload_id} 失败: {e}")
+
+    while True:
+        sessions = await UploadChunk.filter(
+            chunk_index=-1, created_at__lt=expired_at
+        ).only("id", "upload_id", "file_name", "save_path", "created_at", "storage").limit(batch_size)
+        if not sessions:
+            break
+        await asyncio.gather(*(clean(session) for session in sessions))
+        await UploadChunk.filter(upload_id__in=[session.upload_id for session in sessions]).delete()
+        if len(sessions) < batch_size:
+            break
+
+
+async def delete_expire_codes(batch_size: int = 500):
+    """按批次删除过期的分享及其文件，只查询删除所需的字段"""
+    now = await get_now()
+    last_id = 0
+    while True:
+        expired = await FileCodeRecord.fetch(
+            FileCodes.filter(Q(expired_at__lt=now) | Q(expired_count=0), id__gt=last_id)
+            .order_by("id").limit(batch_size)
+        )
+        if not expired:
+            break
+        deleted = []
+        for exp in expired:
+            if not exp.is_text:
+                try:
+                    await get_file_storage(exp.storage).delete_file(exp)
+                except Exception as e:
+                    # 保留记录，下次清理时重试
+                    logging.error(f"删除文件 {exp.code} 失败: {e}")
+                    continue
+            deleted.append(exp.id)
+        await FileText.filter(file_id__in=[exp.id for exp in expired if exp.is_text]).delete()
+        await FileCodes.filter(id__in=deleted).delete()
+        last_id = expired[-1].id
+
+
 async def delete_expire_files():
-    file_storage: FileStorageInterface = storages[settings.file_storage]()
     while True:
         try:
-            # 遍历 share目录下的所有文件夹，删除空的文件夹，并判断父目录是否为空，如果为空也删除
-            if settings.file_storage == "local":
-                for root, dirs, files in os.walk(f"{data_root}/share/data"):
-                    if not dirs and not files:
-                        os.rmdir(root)
-            await ip_limit["error"].remove_expired_ip()
-            await ip_limit["upload"].remove_expired_ip()
-            expire_data = await FileCodes.filter(
-                Q(expired_at__lt=await get_now()) | Q(expired_count=0)
-            ).all()
-            for exp in expire_data:
-                await file_storage.delete_file(exp)
-                await exp.delete()
+            with expire_sweep_duration.time():
+                # 遍历 share目录下的所有文件夹，删除空的文件夹，并判断父目录是否为空，如果为空也删除
+                if "local" in get_policy_storages():
+                    for root, dirs, files in os.walk(f"{data_root}/share/data"):
+                        if not dirs and not files:
+                            os.rmdir(root)
+                await ip_limit["error"].remove_expired_ip()
+                await ip_limit["upload"].remove_expired_ip()
+                await delete_expire_codes()
+                await delete_expire_chunk_sessions()
+                # 后台同步分享码池，回收已删除的分享码
+                await code_pool.sync()
         except Exception as e:
             logging.error(e)
-        finally:
-            await asyncio.sleep(600)
+        # 不放在 finally 中，关闭应用时取消任务不会再等待
+        await asyncio.sleep(600)
+
+
+async def refresh_config(force: bool = False) -> bool:
+    """
+    配置版本号变化时从数据库重新加载配置
+    :param force: 忽略版本号，总是重新加载
+    :return: 是否重新加载了配置
+    """
+    version = await KeyValue.filter(key="settings_version").first().values_list("value", flat=True) or 0
+    if not force and version == settings.version:
+        return False
+    user_config = await KeyValue.filter(key="settings").first().values_list("value", flat=True)
+    settings.load(user_config or {}, version)
+    return True
+
+
+async def watch_config():
+    """定期检查配置版本号，加载其他进程或节点在后台修改的配置"""
+    while True:
+        await asyncio.sleep(max(settings.config_poll_interval, 1))
+        try:
+            if await refresh_config():
+                logging.info(f"配置已更新到版本 {settings.version}")
+        except Exception as e:
+            logging.error(f"同步配置失败: {e}")
@@ -0,0 +1,177 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from starlette.responses import Response
+from starlette.types import Message, Receive, Scope, Send
+
+from core.metrics import (download_bytes, download_throttle_seconds, download_throughput, downloads_active,
+                          rate_limit_rejections)
+from core.settings import settings
+
+
+class TokenBucket:
+    """
+    令牌桶限速
+
+    每秒补充 rate 个令牌（如字节数），最多积累 capacity 个，允许短时突发。
+    consume 在令牌不足时先记账再等待补足，因此一次可以消费超过容量的令牌；
+    等待期间持有锁，多个调用方按先后顺序排队。rate 不大于 0 表示不限速。
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        # Python 3.9 的 Lock 创建时绑定事件循环，在首次使用时再创建
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def consume(self, amount: float):
+        if self.rate <= 0:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._refill()
+            self.tokens -= amount
+            if self.tokens < 0:
+                await asyncio.sleep(-self.tokens / self.rate)
+
+
+class ShapedResponse(Response):
+    """
+    限速的文件响应
+
+    包装存储后端返回的任意响应（FileResponse、StreamingResponse 等），在发送响应体时按字节数
+    消费令牌，响应发送完成或客户端断开后释放下载名额。
+    """
+
+    def __init__(self, response: Response, shaper: "DownloadShaper", ip: str, code: str):
+        self.response = response
+        self.shaper = shaper
+        self.ip = ip
+        self.code = code
+        self.status_code = response.status_code
+        self.raw_headers = response.raw_headers
+        self.background = response.background
+        response.background = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        async def shaped_send(message: Message):
+            if message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                if body:
+                    await self.shaper.consume(self.ip, self.code, len(body))
+            await send(message)
+
+        try:
+            await self.response(scope, receive, shaped_send)
+        finally:
+            self.shaper.release(self.ip, self.code)
+        if self.background is not None:
+            await self.background()
+
+
+class DownloadShaper:
+    """
+    下载流量整形
+
+    全局、每个 IP、每个分享码各使用一个令牌桶限制下载带宽（download_rate_*，字节/秒，0 表示不限速），
+    并限制每个 IP 同时进行的下载数（download_max_per_ip，0 表示不限制）。
+    IP 与分享码的令牌桶在没有进行中的下载时移除，限速配置变化后重新创建。
+    """
+    # 统计当前吞吐量的窗口秒数
+    window = 5
+
+    def __init__(self):
+        self.global_bucket: Optional[TokenBucket] = None
+        self.ip_buckets: Dict[str, TokenBucket] = {}
+        self.code_buckets: Dict[str, TokenBucket] = {}
+        self.ip_active: Dict[str, int] = {}
+        self.code_active: Dict[str, int] = {}
+        # 每秒发送的字节数 [秒, 字节数]
+        self.history: Deque[List[int]] = deque()
+        downloads_active.set_function(lambda: {(): sum(self.ip_active.values())})
+        download_throughput.set_function(lambda: {(): self.throughput()})
+
+    def acquire(self, ip: str, code: str) -> bool:
+        """占用一个下载名额，同一 IP 的下载数已达上限时返回 False"""
+        limit = settings.download_max_per_ip
+        if limit > 0 and self.ip_active.get(ip, 0) >= limit:
+            rate_limit_rejections.inc(limiter="download")
+            return False
+        self.ip_active[ip] = self.ip_active.get(ip, 0) + 1
+        self.code_active[code] = self.code_active.get(code, 0) + 1
+        return True
+
+    def release(self, ip: str, code: str):
+        for key, active, buckets in ((ip, self.ip_active, self.ip_buckets),
+                                     (code, self.code_active, self.code_buckets)):
+            active[key] -= 1
+            if not active[key]:
+                del active[key]
+                buckets.pop(key, None)
+
+    def wrap(self, response, ip: str, code: str):
+        """
+        包装下载响应，需要先通过 acquire 占用名额
+        非 Response 对象（如文件不存在时的 APIResponse）直接释放名额并原样返回
+        """
+        if not isinstance(response, Response):
+            self.release(ip, code)
+            return response
+        return ShapedResponse(response, self, ip, code)
+
+    @staticmethod
+    def _bucket(buckets: Dict[str, TokenBucket], key: str, rate: int) -> Optional[TokenBucket]:
+        if rate <= 0:
+            return None
+        bucket = buckets.get(key)
+        if bucket is None or bucket.rate != rate:
+            bucket = buckets[key] = TokenBucket(rate)
+        return bucket
+
+    async def consume(self, ip: str, code: str, amount: int):
+        rate = settings.download_rate_global
+        if rate <= 0:
+            self.global_bucket = None
+        elif self.global_bucket is None or self.global_bucket.rate != rate:
+            self.global_bucket = TokenBucket(rate)
+        buckets = (
+            self.global_bucket,
+            self._bucket(self.ip_buckets, ip, settings.download_rate_per_ip),
+            self._bucket(self.code_buckets, code, settings.download_rate_per_code),
+        )
+        start = time.monotonic()
+        for bucket in buckets:
+            if bucket is not None:
+                await bucket.consume(amount)
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            download_throttle_seconds.inc(waited)
+        download_bytes.inc(amount)
+        self._record(amount)
+
+    def _record(self, amount: int):
+        second = int(time.monotonic())
+        if self.history and self.history[-1][0] == second:
+            self.history[-1][1] += amount
+        else:
+            self.history.append([second, amount])
+            while self.history[0][0] <= second - self.window:
+                self.history.popleft()
+
+    def throughput(self) -> float:
+        """最近 window 秒的平均下载速度（字节/秒）"""
+        since = int(time.monotonic()) - self.window
+        return sum(amount for second, amount in self.history if second > since) / self.window
+
+
+download_shaper = DownloadShaper()
@@ -5,32 +5,15 @@
 import datetime
 import hashlib
 import os
-import random
 import re
 import string
 import time
 from core.settings import settings
 
 
-async def get_random_num():
-    """
-    获取随机数
-    :return:
-    """
-    return random.randint(10000, 99999)
-
-
 r_s = string.ascii_uppercase + string.digits
 
 
-async def get_random_string():
-    """
-    获取随机字符串
-    :return:
-    """
-    return "".join(random.choice(r_s) for _ in range(5))
-
-
 async def get_now():
     """
     获取当前时间
@@ -5,21 +5,26 @@
 import asyncio
 import time
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Depends
 
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from tortoise.contrib.fastapi import register_tortoise
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
+from tortoise.exceptions import DoesNotExist, IntegrityError
 
 from apps.base.models import KeyValue
 from apps.base.utils import ip_limit
 from apps.base.views import share_api, chunk_api
 from apps.admin.views import admin_api
+from apps.admin.storage_migration import storage_migration
+from apps.admin.dependencies import metrics_required
 from core.database import init_db
+from core.metrics import REGISTRY, monitor_event_loop_lag
+from core.middleware import CompressionMiddleware, MetricsMiddleware
 from core.response import APIResponse
-from core.settings import data_root, settings, BASE_DIR, DEFAULT_CONFIG
-from core.tasks import delete_expire_files
+from core.settings import settings, DEFAULT_CONFIG
+from core.static import index_page, ThemeStaticFiles
+from core.storage import close_storages, get_policy_storages, storage_registry, storages
+from core.tasks import delete_expire_files, refresh_config, watch_config
 from core.logger import logger
 
 from contextlib import asynccontextmanager
@@ -36,12 +41,18 @@ async def lifespan(app: FastAPI):
     await load_config()
     app.mount(
         "/assets",
-        StaticFiles(directory=f"./{settings.themesSelect}/assets"),
+        ThemeStaticFiles(directory=f"./{settings.themesSelect}/assets"),
         name="assets",
     )
 
     # 启动后台任务
-    task = asyncio.create_task(delete_expire_files())
+    tasks = [
+        asyncio.create_task(delete_expire_files()),
+        asyncio.create_task(monitor_event_loop_lag()),
+        asyncio.create_task(watch_config()),
+    ]
+    # 继续上次被中断的存储迁移
+    await storage_migration.resume()
     logger.info("应用初始化完成")
 
     try:
@@ -49,25 +60,36 @@ async def lifespan(app: FastAPI):
     finally:
         # 清理操作
         logger.info("正在关闭应用...")
-        task.cancel()
-        await asyncio.gather(task, return_exceptions=True)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await storage_migration.shutdown()
+        await close_storages()
         await Tortoise.close_connections()
         logger.info("应用已关闭")
 
 
 async def load_config():
-    user_config, _ = await KeyValue.get_or_create(
-        key="settings", defaults={"value": DEFAULT_CONFIG}
-    )
+    await KeyValue.get_or_create(key="settings", defaults={"value": DEFAULT_CONFIG})
+    await KeyValue.get_or_create(key="settings_version", defaults={"value": 0})
     await KeyValue.update_or_create(
         key="sys_start", defaults={"value": int(time.time() * 1000)}
     )
-    settings.user_config = user_config.value
+    await refresh_config(force=True)
+
+
+def apply_config():
+    """配置加载或变更后，更新依赖配置的组件"""
     # 更新 ip_limit 配置
     ip_limit["error"].minutes = settings.errorMinute
     ip_limit["error"].count = settings.errorCount
     ip_limit["upload"].minutes = settings.uploadMinute
     ip_limit["upload"].count = settings.uploadCount
+    index_page.render()
+    storage_registry.reload()
+
+
+settings.on_change(apply_config)
 
 
 app = FastAPI(lifespan=lifespan)
@@ -79,45 +101,31 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-# 使用 register_tortoise 来添加异常处理器
-register_tortoise(
-    app,
-    config={
-        "connections": {"default": f"sqlite://{data_root}/filecodebox.db"},
-        "apps": {
-            "models": {
-                "models": ["apps.base.models"],
-                "default_connection": "default",
-            },
-        },
-    },
-    generate_schemas=False,
-    add_exception_handlers=True,
-)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(share_api)
 app.include_router(chunk_api)
 app.include_router(admin_api)
 
 
+@app.exception_handler(DoesNotExist)
+async def does_not_exist_handler(request: Request, exc: DoesNotExist):
+    return JSONResponse(status_code=404, content={"detail": str(exc)})
+
+
+@app.exception_handler(IntegrityError)
+async def integrity_error_handler(request: Request, exc: IntegrityError):
+    return JSONResponse(
+        status_code=422,
+        content={"detail": [{"loc": [], "msg": str(exc), "type": "IntegrityError"}]},
+    )
+
+
 @app.exception_handler(404)
 @app.get("/")
-async def index(request=None, exc=None):
-    return HTMLResponse(
-        content=open(
-            BASE_DIR / f"{settings.themesSelect}/index.html", "r", encoding="utf-8"
-        )
-        .read()
-        .replace("{{title}}", str(settings.name))
-        .replace("{{description}}", str(settings.description))
-        .replace("{{keywords}}", str(settings.keywords))
-        .replace("{{opacity}}", str(settings.opacity))
-        .replace('"/assets/', '"assets/')
-        .replace("{{background}}", str(settings.background)),
-        media_type="text/html",
-        headers={"Cache-Control": "no-cache"},
-    )
+async def index(request: Request, exc=None):
+    return index_page.response(request)
 
 
 @app.get("/robots.txt")
@@ -125,6 +133,13 @@ async def robots():
     return HTMLResponse(content=settings.robotsText, media_type="text/plain")
 
 
+@app.get("/metrics")
+async def metrics(admin: bool = Depends(metrics_required)):
+    return PlainTextResponse(
+        content=REGISTRY.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
 @app.post("/")
 async def get_config():
     return APIResponse(
@@ -134,7 +149,9 @@ async def get_config():
             "explain": settings.page_explain,
             "uploadSize": settings.uploadSize,
             "expireStyle": settings.expireStyle,
-            "enableChunk": settings.enableChunk if settings.file_storage == "local" and settings.enableChunk else 0,
+            "enableChunk": settings.enableChunk if settings.enableChunk and all(
+                storages[name].supports_chunk for name in get_policy_storages()
+            ) else 0,
             "openUpload": settings.openUpload,
             "notify_title": settings.notify_title,
             "notify_content": settings.notify_content,
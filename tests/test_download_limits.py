@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.responses import Response
+from tortoise import Tortoise
+
+from apps.base import views
+from apps.base.models import FileCodes
+from core.settings import settings
+from core.throttle import download_shaper
+
+
+class StubStorage:
+    async def get_file_response(self, file_code):
+        return Response(b"data", media_type="application/octet-stream")
+
+
+async def send_response(response: Response):
+    """把响应发送给一个丢弃数据的客户端，发送完成后释放下载名额"""
+    async def receive():
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        pass
+
+    await response({"type": "http", "method": "GET", "headers": []}, receive, send)
+
+
+async def rejected_download_keeps_usage():
+    await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["apps.base.models"]})
+    await Tortoise.generate_schemas()
+    try:
+        await FileCodes.create(code="12345", prefix="a", suffix=".bin", expired_count=2, storage="local")
+
+        first = await views.get_code_file("12345", "1.1.1.1")
+        # 同一 IP 的第二个并发下载超过上限，不应消耗次数
+        with pytest.raises(HTTPException) as exc:
+            await views.get_code_file("12345", "1.1.1.1")
+        assert exc.value.status_code == 429
+        assert (await FileCodes.get(code="12345")).expired_count == 1
+
+        await send_response(first)
+        second = await views.get_code_file("12345", "1.1.1.1")
+        assert isinstance(second, Response)
+        await send_response(second)
+        file_code = await FileCodes.get(code="12345")
+        assert (file_code.expired_count, file_code.used_count) == (0, 2)
+        assert not download_shaper.ip_active
+    finally:
+        await Tortoise.close_connections()
+
+
+def test_rejected_concurrent_download_keeps_usage(monkeypatch):
+    monkeypatch.setattr(views, "get_file_storage", lambda name=None: StubStorage())
+    user_config = dict(settings.user_config)
+    settings.download_max_per_ip = 1
+    try:
+        asyncio.run(rejected_download_keeps_usage())
+    finally:
+        settings.load(user_config, settings.version)